@@ -3,18 +3,35 @@ Author: Yefeng Wang
 Data scraping module to retrieve real-time Raydium liquidity pool information.
 """
 
-from stake_layout import STAKE_INFO_LAYOUT_V4, STAKE_INFO_LAYOUT, OPEN_ORDERS_LAYOUT, USER_STAKE_INFO_ACCOUNT_LAYOUT
-from resources.ids import STAKE_PROGRAM_ID, STAKE_PROGRAM_ID_V4, STAKE_PROGRAM_ID_V5
-from user_types import MemcmpOpts
+from stake_layout import USER_STAKE_INFO_ACCOUNT_LAYOUT, USER_STAKE_INFO_ACCOUNT_LAYOUT_V4
+from stake_layout import USER_STAKE_INFO_ACCOUNT_LAYOUT_V5
+from compiled_layout import STAKE_INFO_V4_DECODER, STAKE_INFO_DECODER, OPEN_ORDERS_DECODER
+from compiled_layout import SPL_ACCOUNT_DECODER, SPL_MINT_DECODER, compile_layout
+from apr_engine import FarmTable, CycleInputs, compute_apr
+from fetch_planner import FetchPlan
+from resources.ids import STAKE_PROGRAM_ID, STAKE_PROGRAM_ID_V4, STAKE_PROGRAM_ID_V5, TOKEN_PROGRAM_ID
+from user_types import MemcmpOpts, DataSliceOpts
+from json_codec import JSONCodec, JSONArrayStream, get_codec
+from rate_limit import EndpointLimiter, get_limiter
+from rpc_pool import EndpointHealth, rank_endpoints
+from cassette import Cassette, REPLAY, cassette_key
+from instrumentation import Instrumentation, get_instrumentation
+from rpc_cache import RPCCache, SingleFlight
+from holder_analytics import DistributionAnalytics, HolderStats, get_analytics
+from pool_index import PoolIndex
+from distribution_store import DistributionStore, DistributionDelta
 
 import asyncio
-from ast import literal_eval
-from typing import Optional, List
+import aiohttp
+from typing import Dict, Iterable, Optional, List, Tuple
 
 import base58
 import base64
+import numpy as np
 import json
 import itertools
+import time
+from urllib.parse import urlparse
 
 
 # Constants
@@ -29,17 +46,116 @@ LP_ADDRESS_INFO_FILE = "./resources/LPtokens_detail_addresses.json"
 FARMS_INFO_FILE = "./resources/farms.json"
 STAKE_INFO_FILE = "./resources/stake.json"
 
+# getMultipleAccounts accepts at most 100 public keys per call
+MAX_MULTIPLE_ACCOUNTS = 100
+# Seconds a Raydium price / pair snapshot is reused for
+RAYDIUM_SNAPSHOT_TTL = 30
+# Bytes read at a time from streamed responses
+STREAM_CHUNK_SIZE = 1 << 16
+# JSON RPC error of a node that has not reached the requested minContextSlot yet
+MIN_CONTEXT_SLOT_NOT_REACHED = -32016
+# Re-fetch rounds of accounts read at a stale slot in snapshot mode
+MAX_SNAPSHOT_REFETCHES = 2
+# Single-sided RAY staking pool
+RAY_STAKE_POOL = "4EwbZo8BZXP5313z5A2H11MRBP15M5n6YxfmkjXESKAW"
+STAKE_PROGRAMS = {
+    "STAKE_PROGRAM_ID": STAKE_PROGRAM_ID,
+    "STAKE_PROGRAM_ID_V4": STAKE_PROGRAM_ID_V4,
+    "STAKE_PROGRAM_ID_V5": STAKE_PROGRAM_ID_V5
+}
+# Stake program -> layout of its user stake accounts
+USER_STAKE_LAYOUTS = {
+    STAKE_PROGRAM_ID: USER_STAKE_INFO_ACCOUNT_LAYOUT,
+    STAKE_PROGRAM_ID_V4: USER_STAKE_INFO_ACCOUNT_LAYOUT_V4,
+    STAKE_PROGRAM_ID_V5: USER_STAKE_INFO_ACCOUNT_LAYOUT_V5
+}
+
+
+class AccountSnapshot(dict):
+    """
+    Account data read in a cycle: dict of public key -> base64 encoded account data, which also records the
+    context slot every account was read at.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slots: Dict[str, int] = {}
+
+    def set(self, publicKey: str, data: Optional[str], slot: int):
+        self[publicKey] = data
+        self.slots[publicKey] = slot
+
+    def merge(self, other: 'AccountSnapshot'):
+        for publicKey, data in other.items():
+            self.set(publicKey, data, other.slots[publicKey])
+
+    def slot_range(self, publicKeys: Optional[Iterable[str]] = None) -> Optional[Tuple[int, int]]:
+        """
+        Oldest and newest slot of the given accounts.
+        :param publicKeys: public keys, all accounts by default
+        :return: (min slot, max slot), None if no slot is known
+        """
+        slots = [self.slots[x] for x in (self.slots if publicKeys is None else publicKeys) if x in self.slots]
+        if not slots:
+            return None
+        return min(slots), max(slots)
+
+    def stale(self, max_slot_spread: int) -> List[str]:
+        """
+        Accounts read more than max_slot_spread slots before the newest account of the snapshot.
+        """
+        if not self.slots:
+            return []
+        newest = max(self.slots.values())
+        return [x for x, slot in self.slots.items() if newest - slot > max_slot_spread]
+
+
+def merge_slot_ranges(*slot_ranges) -> Optional[Tuple[int, int]]:
+    """
+    Smallest slot range covering the given ones, ignoring None.
+    """
+    slot_ranges = [x for x in slot_ranges if x is not None]
+    if not slot_ranges:
+        return None
+    return min(x[0] for x in slot_ranges), max(x[1] for x in slot_ranges)
+
 
 class SolanaAPICall:
     """
     JSON RPC API call async I/O rewrite.
+
+    With batch_size set, calls are queued and sent as JSON RPC 2.0 batches: a batch is posted as soon as it holds
+    batch_size calls, or flush_interval seconds after its first call, and responses are routed back by request id.
+
+    Every POST goes through the rate limiter of the endpoint, shared by all callers of the same host.
+
+    With a cassette, calls are recorded to it or replayed from it, see cassette.Cassette.
+
+    Calls report to the instrumentation: rpc_request latency by method, batch_queue_wait, json_decode time and
+    rpc_bytes_sent / rpc_bytes_received. rpc_request times each HTTP request sent, by method or "batch": cassette
+    replays, cache hits and rate limiter waits are not part of it.
+
+    With a cache, concurrent identical calls share one request and responses are reused while their method policy
+    allows it, see rpc_cache.RPCCache. Streamed getProgramAccounts calls bypass the cache.
     """
-    def __init__(self, endpoint, session):
+    def __init__(self, endpoint, session, batch_size: Optional[int] = None, flush_interval: float = 0.005,
+                 codec: Optional[JSONCodec] = None, limiter: Optional[EndpointLimiter] = None,
+                 cassette: Optional[Cassette] = None, instrumentation: Optional[Instrumentation] = None,
+                 cache: Optional[RPCCache] = None):
         self._endpoint = endpoint
+        self._cache = cache
+        self._instrumentation = instrumentation or get_instrumentation()
+        self._cassette = cassette
         self._session = session
+        self._codec = codec or get_codec()
+        self._limiter = limiter or get_limiter(endpoint)
         self._request_counter = itertools.count()
         self._commitment = None
         self._encoding = None
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._batch_queue = []
+        self._flush_handle = None
+        self._batch_tasks = set()
 
     def _set_commitment(self, commitment: str):
         if commitment not in ["max", "root", "single", "recent"]:
@@ -53,10 +169,16 @@ class SolanaAPICall:
                              "Must be 'base58', 'base64', or 'jsonParsed'.")
         self._encoding = encoding
 
+    @staticmethod
+    def _set_min_context_slot(config: dict, min_context_slot: Optional[int]) -> dict:
+        if min_context_slot is not None:
+            config["minContextSlot"] = min_context_slot
+        return config
+
     def _add_payload(self, method, *params):
         """
         Add JSON RPC header for a request.
-        :return:
+        :return: request body and HTTP headers
         """
         request_id = next(self._request_counter) + 1
         headers = {"Content-Type": "application/json"}
@@ -66,41 +188,240 @@ class SolanaAPICall:
             "method": method,
             "params": params
         }
-        return json.dumps(data), headers
+        return data, headers
 
     async def _make_request(self, data, headers):
-        async with self._session.post(self._endpoint, headers=headers, data=data) as response:
-            result = await response.text()
-            response.raise_for_status()
-
-        return json.loads(result)
+        # The cassette sits above the cache: every call is recorded, cache hits included, so that a replay sees the
+        # same sequence of calls whatever the cache would have served
+        if self._cassette is not None:
+            return await self._cassette.call(cassette_key(data['method'], data['params']),
+                                             lambda: self._request(data, headers), self._codec)
+        return await self._request(data, headers)
+
+    async def _request(self, data, headers):
+        if self._cache is not None:
+            return await self._cache.call(self._endpoint, data, lambda: self._send(data, headers))
+        return await self._send(data, headers)
+
+    async def _send(self, data, headers):
+        """
+        Send a request to the endpoint, queued in a batch if batching is enabled.
+        :return: decoded JSON RPC response
+        """
+        if self._batch_size:
+            return await self._enqueue(data)
+        return await self._post(self._codec.dumps(data), headers, data['method'])
+
+    async def _post(self, data, headers, method: str):
+        async def post():
+            with self._instrumentation.span("rpc_request", method=method):
+                async with self._session.post(self._endpoint, headers=headers, data=data) as response:
+                    result = await response.read()
+                    response.raise_for_status()
+            return result
+
+        body = await self._limiter.call(post)
+        self._instrumentation.count("rpc_bytes_sent", len(data))
+        self._instrumentation.count("rpc_bytes_received", len(body))
+        with self._instrumentation.span("json_decode", source="rpc"):
+            return self._codec.loads(body)
+
+    async def _stream(self, data, headers):
+        """
+        Send a request and yield the items of its result array as they are parsed from the response stream.
+        :return: async generator of result items
+        """
+        parser = JSONArrayStream("result", self._codec)
+        attempt = 0
+        while True:
+            try:
+                async with self._limiter.slot():
+                    body = self._codec.dumps(data)
+                    self._instrumentation.count("rpc_bytes_sent", len(body))
+                    async with self._session.post(self._endpoint, headers=headers, data=body) as response:
+                        response.raise_for_status()
+                        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                            self._instrumentation.count("rpc_bytes_received", len(chunk))
+                            with self._instrumentation.span("json_decode", source="stream"):
+                                items = parser.feed(chunk)
+                            for item in items:
+                                yield item
+                break
+            except aiohttp.ClientResponseError as e:
+                # Raised by the status line, before any item: the request can still be retried
+                delay = self._limiter.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+        error = parser.close()
+        if error is not None:
+            raise ValueError("JSON RPC request failed: {}".format(error.get('error', error)))
+
+    def _enqueue(self, data):
+        """
+        Queue a request for the next batch.
+        :return: future resolved with the response of the request
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._batch_queue.append((data, future, time.perf_counter()))
+        if len(self._batch_queue) >= self._batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._flush_interval, self._flush)
+        return future
+
+    def _flush(self):
+        """
+        Send the queued requests as one batch.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._batch_queue = self._batch_queue, []
+        now = time.perf_counter()
+        for _, _, queued_at in batch:
+            self._instrumentation.observe("batch_queue_wait", now - queued_at)
+        if batch:
+            task = asyncio.ensure_future(self._send_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send_batch(self, batch):
+        futures = {data['id']: future for data, future, _ in batch}
+        try:
+            responses = await self._post(self._codec.dumps([data for data, _, _ in batch]),
+                                         {"Content-Type": "application/json"}, "batch")
+            if isinstance(responses, dict):
+                # The whole batch was rejected, e.g. the endpoint does not support batches
+                raise ValueError("JSON RPC batch rejected: {}".format(responses.get('error')))
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for response in responses:
+            future = futures.pop(response.get('id'), None)
+            if future is not None and not future.done():
+                future.set_result(response)
+        for request_id, future in futures.items():
+            if not future.done():
+                future.set_exception(ValueError("No response for JSON RPC request id {}.".format(request_id)))
+
+    async def getSlot(self, commitment: str = 'max'):
+        self._set_commitment(commitment)
+        payload, header = self._add_payload("getSlot", {"commitment": self._commitment})
+        result = await self._make_request(payload, header)
+        return result
 
-    async def getTokenAccountBalance(self, publicKey: str, commitment: str = 'max'):
+    async def getTokenAccountBalance(self, publicKey: str, commitment: str = 'max',
+                                     min_context_slot: Optional[int] = None):
         self._set_commitment(commitment)
         payload, header = self._add_payload("getTokenAccountBalance",
                                             publicKey,
-                                            {"commitment": self._commitment})
+                                            self._set_min_context_slot({"commitment": self._commitment},
+                                                                       min_context_slot))
         result = await self._make_request(payload, header)
         return result
 
-    async def getAccountInfo(self, publicKey: str, commitment: str = 'max', encoding: str = 'base64'):
+    async def getAccountInfo(self, publicKey: str, commitment: str = 'max', encoding: str = 'base64',
+                             min_context_slot: Optional[int] = None):
         self._set_commitment(commitment)
         self._set_encoding(encoding)
         payload, header = self._add_payload("getAccountInfo",
                                             publicKey,
-                                            {"commitment": self._commitment,
-                                             "encoding": self._encoding})
+                                            self._set_min_context_slot({"commitment": self._commitment,
+                                                                        "encoding": self._encoding},
+                                                                       min_context_slot))
+        result = await self._make_request(payload, header)
+        return result
+
+    async def getMultipleAccounts(self, publicKeys: List[str], commitment: str = 'max', encoding: str = 'base64',
+                                  min_context_slot: Optional[int] = None):
+        self._set_commitment(commitment)
+        self._set_encoding(encoding)
+        payload, header = self._add_payload("getMultipleAccounts",
+                                            list(publicKeys),
+                                            self._set_min_context_slot({"commitment": self._commitment,
+                                                                        "encoding": self._encoding},
+                                                                       min_context_slot))
         result = await self._make_request(payload, header)
         return result
 
-    async def getTokenSupply(self, publicKey: str):
+    async def getMultipleAccountsChunked(self, publicKeys: List[str], commitment: str = 'max',
+                                         chunk_size: int = MAX_MULTIPLE_ACCOUNTS,
+                                         min_context_slot: Optional[int] = None) -> AccountSnapshot:
+        """
+        Batched read mode: fetch any number of accounts with as few getMultipleAccounts calls as possible.
+        :param publicKeys: list of account public keys
+        :param commitment: commitment level
+        :param chunk_size: number of public keys per getMultipleAccounts call
+        :param min_context_slot: only accept responses from nodes which reached this slot
+        :return: dict of public key -> base64 encoded account data (None if the account does not exist), with the
+            context slot of every account
+        """
+        chunks = [publicKeys[i:i + chunk_size] for i in range(0, len(publicKeys), chunk_size)]
+        responses = await asyncio.gather(*[self.getMultipleAccounts(chunk, commitment,
+                                                                    min_context_slot=min_context_slot)
+                                           for chunk in chunks])
+
+        accounts = AccountSnapshot()
+        for chunk, response in zip(chunks, responses):
+            if 'error' in response:
+                raise ValueError("getMultipleAccounts failed: {}".format(response['error']))
+            slot = response['result']['context']['slot']
+            for publicKey, account in zip(chunk, response['result']['value']):
+                accounts.set(publicKey, account['data'][0] if account is not None else None, slot)
+        return accounts
+
+    async def getTokenSupply(self, publicKey: str, min_context_slot: Optional[int] = None):
+        params = [publicKey]
+        if min_context_slot is not None:
+            params.append({"minContextSlot": min_context_slot})
         payload, header = self._add_payload("getTokenSupply",
-                                            publicKey)
+                                            *params)
         result = await self._make_request(payload, header)
         return result
 
     async def getProgramAccounts(self, publicKey: str, commitment: str = 'max', encoding: str = 'base64',
-                                 data_size: Optional[int] = None, memcmp_opts: Optional[List[MemcmpOpts]] = None):
+                                 data_size: Optional[int] = None, memcmp_opts: Optional[List[MemcmpOpts]] = None,
+                                 data_slice: Optional[DataSliceOpts] = None):
+        payload, header = self._program_accounts_payload(publicKey, commitment, encoding, data_size, memcmp_opts,
+                                                         data_slice)
+        result = await self._make_request(payload, header)
+        return result
+
+    async def iterProgramAccounts(self, publicKey: str, commitment: str = 'max', encoding: str = 'base64',
+                                  data_size: Optional[int] = None, memcmp_opts: Optional[List[MemcmpOpts]] = None,
+                                  data_slice: Optional[DataSliceOpts] = None):
+        """
+        Streaming getProgramAccounts: yield the accounts as they are parsed from the response, so memory stays
+        bounded however many accounts the program owns.
+        :return: async generator of {"pubkey", "account"} dicts
+        """
+        payload, header = self._program_accounts_payload(publicKey, commitment, encoding, data_size, memcmp_opts,
+                                                         data_slice)
+        if self._cassette is None:
+            async for account_info in self._stream(payload, header):
+                yield account_info
+            return
+
+        # Streamed responses are recorded whole once fully read
+        key = cassette_key(payload['method'], payload['params'])
+        if self._cassette.mode == REPLAY:
+            for account_info in self._codec.loads(self._cassette.replay(key))['result']:
+                yield account_info
+            return
+        result = []
+        async for account_info in self._stream(payload, header):
+            result.append(account_info)
+            yield account_info
+        self._cassette.record(key, self._codec.dumps({"jsonrpc": "2.0", "id": payload['id'], "result": result}))
+
+    def _program_accounts_payload(self, publicKey, commitment, encoding, data_size, memcmp_opts, data_slice):
         self._set_commitment(commitment)
         self._set_encoding(encoding)
         filters = {"filters": []}
@@ -109,41 +430,222 @@ class SolanaAPICall:
                 filters['filters'].append({"memcmp": dict(opt._asdict())})
         if data_size:
             filters['filters'].append({"dataSize": data_size})
+        if data_slice:
+            filters['dataSlice'] = dict(data_slice._asdict())
         filters['encoding'] = self._encoding
         filters['commitment'] = self._commitment
         filters = dict(sorted(filters.items())) # make sure the order is correctly sorted aphabetically
-        payload, header = self._add_payload("getProgramAccounts",
-                                            publicKey,
-                                            filters)
-        result = await self._make_request(payload, header)
+        return self._add_payload("getProgramAccounts",
+                                 publicKey,
+                                 filters)
+
+class SolanaRPCPool(SolanaAPICall):
+    """
+    JSON RPC API calls spread over several endpoints.
+
+    Each request goes to one endpoint picked by observed latency and error rate, and fails over to the next one on
+    errors. Endpoints failing repeatedly are taken out of rotation by a circuit breaker, and are not even failed over
+    to until their cooldown ends: then a single trial request goes through. Requests fail with ValueError while no
+    endpoint is available. With hedge_after set, a read still unanswered after hedge_after seconds is duplicated to a
+    second endpoint and the first answer wins.
+    """
+    def __init__(self, clients: List[SolanaAPICall], hedge_after: Optional[float] = None,
+                 failure_threshold: int = 3, cooldown: float = 30, cassette: Optional[Cassette] = None,
+                 cache: Optional[RPCCache] = None):
+        if not clients:
+            raise ValueError("The RPC pool needs at least one endpoint.")
+        super().__init__(",".join(client._endpoint for client in clients), clients[0]._session,
+                         codec=clients[0]._codec, limiter=clients[0]._limiter, cassette=cassette,
+                         instrumentation=clients[0]._instrumentation, cache=cache)
+        self.clients = clients
+        self.health = [EndpointHealth(failure_threshold, cooldown) for _ in clients]
+        self.hedge_after = hedge_after
+
+    def _ranking(self) -> List[int]:
+        ranking = rank_endpoints(self.health)
+        if not ranking:
+            raise ValueError("No RPC endpoint available: the circuit of every endpoint is open.")
+        return ranking
+
+    async def _send(self, data, headers):
+        ranking = self._ranking()
+        last_error = None
+        for attempt, index in enumerate(ranking):
+            try:
+                if self.hedge_after is not None and attempt + 1 < len(ranking):
+                    return await self._send_hedged(index, ranking[attempt + 1], data, headers)
+                return await self._send_to(index, data, headers)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+        raise last_error
+
+    async def _send_to(self, index, data, headers):
+        health = self.health[index]
+        if not health.available():
+            # Tripped, or another request took the half-open trial, since the ranking
+            raise ValueError("RPC endpoint {} is unavailable: circuit open.".format(self.clients[index]._endpoint))
+        health.begin()
+        start = time.monotonic()
+        try:
+            result = await self.clients[index]._send(data, headers)
+        except asyncio.CancelledError:
+            health.cancel()
+            raise
+        except Exception:
+            health.record_failure()
+            raise
+        if isinstance(result, dict) and result.get('error', {}).get('code') == MIN_CONTEXT_SLOT_NOT_REACHED:
+            # The node lags behind the slot floor: try the next one
+            health.record_failure()
+            raise ValueError("JSON RPC request failed: {}".format(result['error']))
+        health.record_success(time.monotonic() - start)
         return result
 
+    async def _stream(self, data, headers):
+        """
+        Stream from the best ranked endpoint, failing over to the next one only while no item was yielded yet.
+        """
+        last_error = None
+        for index in self._ranking():
+            health = self.health[index]
+            if not health.available():
+                last_error = ValueError("RPC endpoint {} is unavailable: circuit open.".format(
+                    self.clients[index]._endpoint))
+                continue
+            health.begin()
+            start = time.monotonic()
+            streamed = False
+            try:
+                async for item in self.clients[index]._stream(data, headers):
+                    streamed = True
+                    yield item
+            except (asyncio.CancelledError, GeneratorExit):
+                health.cancel()
+                raise
+            except Exception as e:
+                health.record_failure()
+                if streamed:
+                    raise
+                last_error = e
+                continue
+            health.record_success(time.monotonic() - start)
+            return
+        raise last_error
+
+    async def _send_hedged(self, primary, secondary, data, headers):
+        """
+        Send to primary, and also to secondary if primary has not answered after hedge_after seconds.
+        :return: the first successful response
+        """
+        first = asyncio.ensure_future(self._send_to(primary, data, headers))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                return first.result()
+
+            pending.add(asyncio.ensure_future(self._send_to(secondary, data, headers)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
 class RaydiumAPICall:
-    def __init__(self, price_endpoint, fee_endpoint, session):
+    """
+    Raydium API calls.
+
+    Price and pair data are snapshots shared by every caller for ttl seconds: concurrent callers wait on the same
+    in-flight request instead of downloading the payload again.
+
+    Calls report to the instrumentation: raydium_snapshot latency (cached or not), raydium_request latency of the
+    downloads, json_decode time and raydium_bytes_received.
+    """
+    def __init__(self, price_endpoint, fee_endpoint, session, ttl: float = RAYDIUM_SNAPSHOT_TTL,
+                 codec: Optional[JSONCodec] = None, limiter: Optional[EndpointLimiter] = None,
+                 cassette: Optional[Cassette] = None, instrumentation: Optional[Instrumentation] = None):
+        self._cassette = cassette
+        self._instrumentation = instrumentation or get_instrumentation()
         self._price_endpoint = price_endpoint
         self._fee_endpoint = fee_endpoint
         self._session = session
+        self._codec = codec or get_codec()
+        self._limiter = limiter or get_limiter(price_endpoint)
+        self._ttl = ttl
+        self._snapshots = {}
+        self._flights = SingleFlight()
         self.token_name_dict = self.generate_token_name_dict()
 
+    async def _get_snapshot(self, endpoint, fetch):
+        """
+        Return the cached snapshot of an endpoint, or join / start the request refreshing it.
+        :param endpoint: endpoint the snapshot is keyed on
+        :param fetch: coroutine function downloading the snapshot
+        :return:
+        """
+        snapshot = self._snapshots.get(endpoint)
+        if snapshot is not None and snapshot[0] > time.monotonic():
+            return snapshot[1]
+        return await self._flights.do(endpoint, lambda: self._refresh_snapshot(endpoint, fetch))
+
+    async def _refresh_snapshot(self, endpoint, fetch):
+        result = await fetch()
+        self._snapshots[endpoint] = (time.monotonic() + self._ttl, result)
+        return result
+
+    def invalidate(self):
+        """
+        Drop the cached snapshots so the next call downloads fresh data.
+        """
+        self._snapshots.clear()
+
     async def get_price(self):
         """
 
         :return:
         """
-        async with self._session.get(self._price_endpoint) as resp:
-            resp.raise_for_status()
-            result = await resp.text()
-
-            return literal_eval(result)
+        with self._instrumentation.span("raydium_snapshot", snapshot="price"):
+            return await self._get_snapshot(self._price_endpoint, self._fetch_price)
 
     async def get_pair(self):
-        async with self._session.get(self._fee_endpoint) as resp:
-            resp.raise_for_status()
-            result = await resp.text()
-
-            data = literal_eval(result)
-            data_dict = {self.token_name_dict[x['name']]: x['apy'] / 100 for x in data}
-            return data_dict
+        with self._instrumentation.span("raydium_snapshot", snapshot="pairs"):
+            return await self._get_snapshot(self._fee_endpoint, self._fetch_pair)
+
+    async def _get(self, endpoint):
+        if self._cassette is not None:
+            return await self._cassette.call(cassette_key("GET", endpoint), lambda: self._download(endpoint),
+                                             self._codec)
+        return await self._download(endpoint)
+
+    async def _download(self, endpoint):
+        async def get():
+            async with self._session.get(endpoint) as resp:
+                resp.raise_for_status()
+                return await resp.read()
+
+        path = urlparse(endpoint).path
+        with self._instrumentation.span("raydium_request", path=path):
+            body = await self._limiter.call(get)
+        self._instrumentation.count("raydium_bytes_received", len(body), path=path)
+        with self._instrumentation.span("json_decode", source="raydium"):
+            return self._codec.loads(body)
+
+    async def _fetch_price(self):
+        return await self._get(self._price_endpoint)
+
+    async def _fetch_pair(self):
+        data = await self._get(self._fee_endpoint)
+        data_dict = {self.token_name_dict[x['name']]: x['apy'] / 100 for x in data}
+        return data_dict
 
     @staticmethod
     def generate_token_name_dict():
@@ -158,21 +660,157 @@ class RaydiumPoolInfo:
     """
     Data Scraper.
     """
-    def __init__(self, session):
+    def __init__(self, session, batch_size: Optional[int] = None, endpoints: Optional[List[str]] = None,
+                 hedge_after: Optional[float] = None, max_slot_spread: Optional[int] = None,
+                 cassette: Optional[Cassette] = None, price_endpoint: Optional[str] = None,
+                 fee_endpoint: Optional[str] = None, codec: Optional[JSONCodec] = None,
+                 instrumentation: Optional[Instrumentation] = None, rpc_cache: Optional[RPCCache] = None,
+                 analytics: Optional[DistributionAnalytics] = None, pool_index: Optional[PoolIndex] = None,
+                 rpc_rate: Optional[float] = None):
+        """
+        :param session: aiohttp ClientSession
+        :param batch_size: JSON RPC batch size of the Solana calls, no batching by default
+        :param endpoints: Solana RPC endpoints of the pool
+        :param hedge_after: seconds after which a slow read is also sent to the next endpoint
+        :param max_slot_spread: snapshot mode: largest slot spread tolerated between the accounts of a cycle,
+            see fetch_cycle_accounts. Disabled by default.
+        :param cassette: record every Solana and Raydium call to this cassette, or replay them from it
+        :param price_endpoint: Raydium price endpoint, RAYDIUM_PRICE_ENDPOINT by default
+        :param fee_endpoint: Raydium pairs endpoint, RAYDIUM_FEE_ENDPOINT by default
+        :param codec: JSON backend of every call, the fastest available one by default
+        :param instrumentation: where the calls, decoders and APR stages report, get_instrumentation() by default
+        :param rpc_cache: coalescing response cache of the Solana calls, an RPCCache with the default policies by
+            default
+        :param analytics: process pool summarizing the distribution scans, get_analytics() by default
+        :param pool_index: discovered AMM pools to add to the configured ones, see add_pools
+        :param rpc_rate: highest request rate per second of each Solana RPC endpoint. If given, the endpoints get
+            limiters of their own, otherwise the limiters shared by every caller of their hosts (rate 10), see
+            rate_limit.get_limiter.
+        """
         self.token_info = self.get_tokens()
         self.LP_token_info = self.get_lp_tokens()
         self.LP_address_info = self.get_details(LP_ADDRESS_INFO_FILE)
         self.farms_info = self.get_details(FARMS_INFO_FILE)
         self.LP_addresses = self.generate_addresses()
-        self.SOLANA = SolanaAPICall(SOLANA_ENDPOINT, session)
-        self.SERUM = SolanaAPICall(SERUM_ENDPOINT, session)
-        self.RAYDIUM = RaydiumAPICall(RAYDIUM_PRICE_ENDPOINT, RAYDIUM_FEE_ENDPOINT, session)
+        self.discovered_pools = self.add_pools(pool_index) if pool_index is not None else []
+        self._instrumentation = instrumentation or get_instrumentation()
+        self.farm_table = FarmTable.from_config(self.farms_info, self.LP_addresses)
+        self.fetch_plan = FetchPlan.from_config(self.farms_info, self.LP_addresses, chunk_size=MAX_MULTIPLE_ACCOUNTS)
+        self.RPC_CLIENTS = [SolanaAPICall(endpoint, session, batch_size, codec=codec,
+                                          limiter=self._own_limiter(endpoint, rpc_rate),
+                                          instrumentation=self._instrumentation)
+                            for endpoint in endpoints or [SOLANA_ENDPOINT, SERUM_ENDPOINT]]
+        # Replayed cycles run back to back: reuse price snapshots within a cycle only, as when they were recorded.
+        # Replayed RPC calls never reach the cache, see SolanaAPICall._make_request.
+        replay = cassette is not None and cassette.mode == REPLAY
+        self.rpc_cache = rpc_cache or RPCCache(codec=codec, instrumentation=self._instrumentation)
+        self.SOLANA = SolanaRPCPool(self.RPC_CLIENTS, hedge_after, cassette=cassette, cache=self.rpc_cache)
+        ttl = 0 if replay else RAYDIUM_SNAPSHOT_TTL
+        self.RAYDIUM = RaydiumAPICall(price_endpoint or RAYDIUM_PRICE_ENDPOINT, fee_endpoint or RAYDIUM_FEE_ENDPOINT,
+                                      session, ttl=ttl, codec=codec, cassette=cassette,
+                                      instrumentation=self._instrumentation)
+        self.max_slot_spread = max_slot_spread
+        self.slot_floor = None
+        self.analytics = analytics or get_analytics()
+
+    def _own_limiter(self, endpoint: str, max_rate: Optional[float]) -> Optional[EndpointLimiter]:
+        """
+        Limiter of an endpoint with a rate of its own, None to use the shared limiter of its host.
+        """
+        if max_rate is None:
+            return None
+        return EndpointLimiter(max_rate=max_rate, min_rate=min(1, max_rate), name=urlparse(endpoint).netloc or endpoint,
+                               instrumentation=self._instrumentation)
 
     def base64_decode(self, data, layout):
-        data_decode = base64.b64decode(data)
-        structured_data = layout.parse(data_decode)
+        """
+        Decode base64 encoded account data with a construct layout or a compiled layout.
+        :param data: base64 encoded account data
+        :param layout: construct Struct or CompiledLayout
+        :return:
+        """
+        with self._instrumentation.span("account_decode", mode="single"):
+            data_decode = base64.b64decode(data)
+            structured_data = layout.parse(data_decode)
         return structured_data
 
+    def decode_token_amount(self, data, decimals: int) -> float:
+        """
+        Decode the UI amount held by a base64 encoded SPL token account.
+        :param data: base64 encoded account data
+        :param decimals: decimals of the token mint
+        :return:
+        """
+        return self.base64_decode(data, SPL_ACCOUNT_DECODER).amount / (10 ** decimals)
+
+    def decode_mint_supply(self, data) -> float:
+        """
+        Decode the UI supply of a base64 encoded SPL token mint.
+        :param data: base64 encoded account data
+        :return:
+        """
+        mint_data = self.base64_decode(data, SPL_MINT_DECODER)
+        return mint_data.supply / (10 ** mint_data.decimals)
+
+    async def decode_program_accounts(self, program_accounts, decoder, sliced: bool = False) -> np.ndarray:
+        """
+        Decode getProgramAccounts results into columns: the decoded account bytes are concatenated into one buffer
+        viewed as the structured dtype of the decoder. Accounts smaller than the layout (other account types of the
+        program) are skipped.
+        :param program_accounts: async iterator of getProgramAccounts results (base64 encoding),
+            e.g. SolanaAPICall.iterProgramAccounts
+        :param decoder: CompiledLayout of the accounts
+        :param sliced: the accounts were requested with decoder.data_slice()
+        :return: structured array with one record per account
+        """
+        return decoder.parse_many(await self.read_program_accounts(program_accounts, decoder, sliced), sliced)
+
+    async def read_program_accounts(self, program_accounts, decoder, sliced: bool = False) -> bytearray:
+        """
+        Concatenate the account bytes of getProgramAccounts results, as parsed by decoder.parse_many.
+        :param program_accounts: async iterator of getProgramAccounts results (base64 encoding)
+        :param decoder: CompiledLayout of the accounts
+        :param sliced: the accounts were requested with decoder.data_slice()
+        :return: buffer of consecutive accounts
+        """
+        size = decoder.window_length if sliced else decoder.sizeof()
+        buffer = bytearray()
+        # Only the decoding is timed, not the waits for the next items
+        timed = self._instrumentation.enabled
+        decode_time = 0.0
+        async for account_info in program_accounts:
+            start = time.perf_counter() if timed else 0.0
+            data = base64.b64decode(account_info['account']['data'][0])
+            if len(data) >= size:
+                buffer += data[:size]
+            if timed:
+                decode_time += time.perf_counter() - start
+        self._instrumentation.observe("account_decode", decode_time, mode="program_accounts")
+        return buffer
+
+    @staticmethod
+    def stake_distribution(stake_accounts: np.ndarray, decimals: int, label: str, pool_id: Optional[str] = None):
+        """
+        Select the stakers with a deposit from decoded user stake accounts.
+        :param stake_accounts: structured array with stakerOwner and depositBalance (and poolId) columns
+        :param decimals: decimals of the staked token
+        :param label: name of the amount column
+        :param pool_id: stake pool public key, if the accounts were not already filtered by pool
+        :return:
+        """
+        mask = stake_accounts['depositBalance'] > 0
+        if pool_id is not None:
+            pool = np.frombuffer(base58.b58decode(pool_id), dtype=np.uint8)
+            mask &= (stake_accounts['poolId'] == pool).all(axis=1)
+
+        # Only the surviving rows are base58 encoded
+        owners = stake_accounts['stakerOwner'][mask]
+        balances = stake_accounts['depositBalance'][mask]
+        return {
+            "publicKey": [base58.b58encode(x.tobytes()).decode('utf-8') for x in owners],
+            label: (balances / pow(10, decimals)).tolist()
+        }
+
     def get_tokens(self):
         """
         Read token info from the JSON file.
@@ -248,11 +886,87 @@ class RaydiumPoolInfo:
             }
         return address_dict
 
-    async def get_pool_supply(self, lp: str):
+    def add_pools(self, pool_index: PoolIndex) -> List[str]:
+        """
+        Add the discovered pools missing from the resources files to LP_addresses, so that get_pool_supply and
+        get_discovered_pools read them. A pool is named COIN-PC, with the mint address of the tokens missing from the
+        resources files, followed by the start of its AMM id if another pool has that name. Discovered pools have no
+        farm: they are not part of the APR cycles.
+        :param pool_index: discovered pools, see pool_index.PoolDiscovery
+        :return: names of the added pools
+        """
+        configured = {x['ammId'] for x in self.LP_address_info.values()}
+        added = []
+        for amm_id, addresses in pool_index.lp_addresses(self.token_info).items():
+            if amm_id in configured:
+                continue
+            name = "{}-{}".format(addresses['coin'], addresses['pc'])
+            if name in self.LP_addresses:
+                name = "{}-{}".format(name, amm_id[:8])
+            self.LP_addresses[name] = addresses
+            added.append(name)
+        return added
+
+    def plan_cycle(self, farms: Optional[List[str]] = None) -> FetchPlan:
+        """
+        Plan the reads of the given farms, see fetch_planner. The plan of all farms is built once.
+        :param farms: farm names, all farms by default
+        :return:
+        """
+        if farms is None or list(farms) == self.fetch_plan.farms:
+            return self.fetch_plan
+        return FetchPlan.from_config(self.farms_info, self.LP_addresses, farms, chunk_size=MAX_MULTIPLE_ACCOUNTS)
+
+    def cycle_addresses(self, farms: Optional[List[str]] = None) -> List[str]:
+        """
+        Collect every public key read by get_APR for the given farms.
+        :param farms: farm names, all farms by default
+        :return: list of unique public keys
+        """
+        return self.plan_cycle(farms).addresses
+
+    async def fetch_cycle_accounts(self, farms: Optional[List[str]] = None,
+                                   plan: Optional[FetchPlan] = None) -> AccountSnapshot:
+        """
+        Fetch every account needed by the given farms in chunked getMultipleAccounts calls, all sent at once.
+
+        In snapshot mode (max_slot_spread set) the reads are slot-consistent: no node behind the newest slot of the
+        previous cycle may answer (minContextSlot floor), and accounts read more than max_slot_spread slots before
+        the newest account of the cycle are re-fetched at that newest slot.
+        :param farms: farm names, all farms by default
+        :param plan: fetch plan of the farms, planned from farms by default
+        :return: dict of public key -> base64 encoded account data, with the slot of every account
+        """
+        plan = plan or self.plan_cycle(farms)
+        if self.max_slot_spread is None:
+            return await self.SOLANA.getMultipleAccountsChunked(plan.addresses, chunk_size=plan.chunk_size)
+
+        accounts = await self.SOLANA.getMultipleAccountsChunked(plan.addresses, chunk_size=plan.chunk_size,
+                                                                min_context_slot=self.slot_floor)
+        for _ in range(MAX_SNAPSHOT_REFETCHES):
+            stale = accounts.stale(self.max_slot_spread)
+            if not stale:
+                break
+            try:
+                accounts.merge(await self.SOLANA.getMultipleAccountsChunked(stale,
+                                                                            min_context_slot=accounts.slot_range()[1]))
+            except ValueError:
+                # No node reached the newest slot yet: keep the reads, the slot range of the results shows the spread
+                break
+
+        slot_range = accounts.slot_range()
+        if slot_range is not None:
+            self.slot_floor = max(self.slot_floor or 0, slot_range[1])
+        return accounts
+
+    async def get_pool_supply(self, lp: str, accounts: Optional[dict] = None, price: Optional[dict] = None):
         """
         Get the reserves and LP supply from a certain Raydium liquidity pool.
         :param lp: LP name (e.g. OXY-RAY)
-        :return:
+        :param accounts: pre-fetched account data from fetch_cycle_accounts. If given, the pool is decoded locally.
+        :param price: price snapshot of the cycle. Defaults to the (cached) Raydium price map.
+        :return: reserves, LP supply, prices and liquidity of the pool. A token without a Raydium price (e.g. in a
+            discovered pool) has a None price, and then so have the liquidity and LP share price.
         """
         # Get coin symbols
         coin = self.LP_addresses[lp]['coin']
@@ -264,33 +978,49 @@ class RaydiumPoolInfo:
         pc_account = self.LP_addresses[lp]['pc_in_pool_address']
         lp_account = self.LP_addresses[lp]['lp_mint_address']
 
-        # Use API to read the data
-        coin_amount_data_task = asyncio.create_task(self.SOLANA.getTokenAccountBalance(coin_account))
-        pc_amount_data_task = asyncio.create_task(self.SOLANA.getTokenAccountBalance(pc_account))
-        lp_supply_task = asyncio.create_task(self.SOLANA.getTokenSupply(lp_account))
-        open_order_task = asyncio.create_task(self.SOLANA.getAccountInfo(amm_address))
-        price_task = asyncio.create_task(self.RAYDIUM.get_price())
-
-
-        coin_amount_data = await coin_amount_data_task
-        pc_amount_data = await pc_amount_data_task
-        lp_supply_data = await lp_supply_task
-        open_order_data = await open_order_task
-        price = await price_task
-
-        coin_amount = coin_amount_data['result']['value']['uiAmount']
-        pc_amount = pc_amount_data['result']['value']['uiAmount']
-        lp_supply = lp_supply_data['result']['value']['uiAmount']
-        open_order_data_decode = self.base64_decode(open_order_data['result']['value']['data'][0], OPEN_ORDERS_LAYOUT)
+        if accounts is None:
+            # Use API to read the data
+            coin_amount_data_task = asyncio.create_task(self.SOLANA.getTokenAccountBalance(coin_account))
+            pc_amount_data_task = asyncio.create_task(self.SOLANA.getTokenAccountBalance(pc_account))
+            lp_supply_task = asyncio.create_task(self.SOLANA.getTokenSupply(lp_account))
+            open_order_task = asyncio.create_task(self.SOLANA.getAccountInfo(amm_address))
+            price_task = asyncio.create_task(self.RAYDIUM.get_price()) if price is None else None
+
+            coin_amount_data = await coin_amount_data_task
+            pc_amount_data = await pc_amount_data_task
+            lp_supply_data = await lp_supply_task
+            open_order_data = await open_order_task
+            price = await price_task if price_task is not None else price
+
+            slot_range = merge_slot_ranges(*[(x['result']['context']['slot'],) * 2 for x in (
+                coin_amount_data, pc_amount_data, lp_supply_data, open_order_data)])
+            coin_amount = coin_amount_data['result']['value']['uiAmount']
+            pc_amount = pc_amount_data['result']['value']['uiAmount']
+            lp_supply = lp_supply_data['result']['value']['uiAmount']
+            open_order_data = open_order_data['result']['value']['data'][0]
+        else:
+            # Decode the pre-fetched accounts locally
+            if price is None:
+                price = await self.RAYDIUM.get_price()
+
+            slot_range = accounts.slot_range([coin_account, pc_account, lp_account, amm_address]) \
+                if isinstance(accounts, AccountSnapshot) else None
+            coin_amount = self.decode_token_amount(accounts[coin_account], self.LP_addresses[lp]['coin_decimals'])
+            pc_amount = self.decode_token_amount(accounts[pc_account], self.LP_addresses[lp]['pc_decimals'])
+            lp_supply = self.decode_mint_supply(accounts[lp_account])
+            open_order_data = accounts[amm_address]
+
+        open_order_data_decode = self.base64_decode(open_order_data, OPEN_ORDERS_DECODER)
         open_order_coin = open_order_data_decode.base_token_total / (10 ** self.LP_addresses[lp]['coin_decimals'])
         open_order_pc = open_order_data_decode.quote_token_total / (10 ** self.LP_addresses[lp]['pc_decimals'])
-        coin_price = price[coin]
-        pc_price = price[pc]
+        coin_price = price.get(coin)
+        pc_price = price.get(pc)
 
         total_coin = coin_amount + open_order_coin
         total_pc = pc_amount + open_order_pc
 
-        liquidity = total_coin * coin_price + total_pc * pc_price
+        liquidity = total_coin * coin_price + total_pc * pc_price \
+            if coin_price is not None and pc_price is not None else None
 
         return {
             "coin": self.LP_addresses[lp]['coin'],
@@ -301,110 +1031,235 @@ class RaydiumPoolInfo:
             "pcAmount": total_pc,
             "lp_supply": lp_supply,
             "liquidity": liquidity,
-            "lp_share_price": liquidity / lp_supply
+            "lp_share_price": liquidity / lp_supply if liquidity is not None else None,
+            "slot_range": slot_range
         }
 
-    async def get_APR(self, farm: str):
+    async def get_discovered_pools(self, pools: Optional[List[str]] = None):
+        """
+        Batched read of the discovered pools: their vaults, LP mints and open orders in chunked getMultipleAccounts
+        calls, sent along with the price request, then get_pool_supply of every pool from the accounts.
+        :param pools: pool names, all discovered pools by default
+        :return: list of {pool: get_pool_supply result} dicts, in the order of pools
+        """
+        pools = list(self.discovered_pools if pools is None else pools)
+        keys = ('coin_in_pool_address', 'pc_in_pool_address', 'lp_mint_address', 'pool_amm_address')
+        addresses = list(dict.fromkeys(self.LP_addresses[x][key] for x in pools for key in keys))
+        accounts, price = await asyncio.gather(self.SOLANA.getMultipleAccountsChunked(addresses),
+                                               self.RAYDIUM.get_price())
+        return [{x: await self.get_pool_supply(x, accounts, price)} for x in pools]
+
+    def decode_account_columns(self, data: List[str], decoder) -> np.ndarray:
+        """
+        Decode base64 encoded accounts of one layout into columns.
+        :param data: base64 encoded account data
+        :param decoder: CompiledLayout of the accounts
+        :return: structured array with one record per account
+        """
+        with self._instrumentation.span("account_decode", mode="columns"):
+            size = decoder.sizeof()
+            buffer = bytearray()
+            for account_data in data:
+                account = base64.b64decode(account_data)
+                if len(account) < size:
+                    raise ValueError("Account of {} bytes is smaller than its {} bytes layout.".format(
+                        len(account), size))
+                buffer += account[:size]
+            return decoder.parse_many(buffer)
+
+    def decode_reward_rates(self, table: FarmTable, stake_infos: List[str]):
+        """
+        Decode the reward rates of farms from their stake pool accounts.
+        :param table: farms
+        :param stake_infos: base64 encoded stake pool account of every farm
+        :return: per_block_a, per_block_b arrays
+        """
+        per_block_a = np.zeros(len(table.farms))
+        per_block_b = np.zeros(len(table.farms))
+        # Dual and fusion pools use the V4 stake pool layout
+        v4 = table.has_b
+        if v4.any():
+            stake_info_data = self.decode_account_columns([x for x, m in zip(stake_infos, v4) if m],
+                                                          STAKE_INFO_V4_DECODER)
+            per_block_a[v4] = stake_info_data['perBlock']
+            per_block_b[v4] = stake_info_data['perBlockB']
+        if not v4.all():
+            stake_info_data = self.decode_account_columns([x for x, m in zip(stake_infos, v4) if not m],
+                                                          STAKE_INFO_DECODER)
+            per_block_a[~v4] = stake_info_data['rewardPerBlock']
+        return per_block_a, per_block_b
+
+    def decode_cycle_inputs(self, farms: List[str], accounts: dict):
+        """
+        Decode the state of farms from pre-fetched accounts, as arrays for the APR engine.
+        :param farms: farm names
+        :param accounts: pre-fetched account data from fetch_cycle_accounts
+        :return: FarmTable and CycleInputs of the farms
+        """
+        table = self.farm_table.take(farms)
+        lp_addresses = [self.LP_addresses[x] for x in farms]
+        farms_info = [self.farms_info[x] for x in farms]
+        coin_scale = np.power(10.0, [x['coin_decimals'] for x in lp_addresses])
+        pc_scale = np.power(10.0, [x['pc_decimals'] for x in lp_addresses])
+        lp_scale = np.power(10.0, [x['lp_decimals'] for x in lp_addresses])
+
+        coin_vaults = self.decode_account_columns([accounts[x['coin_in_pool_address']] for x in lp_addresses],
+                                                  SPL_ACCOUNT_DECODER)
+        pc_vaults = self.decode_account_columns([accounts[x['pc_in_pool_address']] for x in lp_addresses],
+                                                SPL_ACCOUNT_DECODER)
+        open_orders = self.decode_account_columns([accounts[x['pool_amm_address']] for x in lp_addresses],
+                                                  OPEN_ORDERS_DECODER)
+        mints = self.decode_account_columns([accounts[x['lp_mint_address']] for x in lp_addresses], SPL_MINT_DECODER)
+        staked = self.decode_account_columns([accounts[x['poolLpTokenAccount']] for x in farms_info],
+                                             SPL_ACCOUNT_DECODER)
+        per_block_a, per_block_b = self.decode_reward_rates(table, [accounts[x['poolId']] for x in farms_info])
+
+        inputs = CycleInputs(
+            coin_amount=coin_vaults['amount'] / coin_scale + open_orders['base_token_total'] / coin_scale,
+            pc_amount=pc_vaults['amount'] / pc_scale + open_orders['quote_token_total'] / pc_scale,
+            lp_supply=mints['supply'] / np.power(10.0, mints['decimals']),
+            staked_lp=staked['amount'] / lp_scale,
+            per_block_a=per_block_a,
+            per_block_b=per_block_b
+        )
+        return table, inputs
+
+    @staticmethod
+    def farm_results(table: FarmTable, inputs: CycleInputs, columns: dict, price: dict, slot_ranges: list):
+        """
+        Format the APR engine columns as get_APR results.
+        :return: list of {farm: farm info} dicts, in the order of the table
+        """
+        results = []
+        for i, farm in enumerate(table.farms):
+            farm_lp_info = {
+                "coin": table.coin[i],
+                "pc": table.pc[i],
+                "coin_price": price[table.coin[i]],
+                "pc_price": price[table.pc[i]],
+                "coinAmount": float(inputs.coin_amount[i]),
+                "pcAmount": float(inputs.pc_amount[i]),
+                "lp_supply": float(inputs.lp_supply[i]),
+                "liquidity": float(columns['liquidity'][i]),
+                "lp_share_price": float(columns['lp_share_price'][i]),
+                "slot_range": slot_ranges[i]
+            }
+            rewards = [(table.reward_a[i], 'a'), (table.reward_b[i], 'b')]
+            rewards = [(coin, slot) for coin, slot in rewards if coin is not None]
+            for coin, slot in rewards:
+                farm_lp_info[coin + "_reward_per_block_ann"] = float(columns['reward_{}_ann'.format(slot)][i])
+            for coin, slot in rewards:
+                farm_lp_info[coin + "_APR"] = float(columns['reward_{}_apr'.format(slot)][i])
+            results.append({farm: farm_lp_info})
+        return results
+
+    def compute_farms(self, farms: List[str], accounts: dict, price: dict):
+        """
+        Compute farms from pre-fetched accounts in one vectorized pass of the APR engine.
+        :param farms: farm names
+        :param accounts: pre-fetched account data from fetch_cycle_accounts
+        :param price: price snapshot of the cycle
+        :return: list of {farm: farm info} dicts, in the order of farms
+        """
+        table, inputs = self.decode_cycle_inputs(farms, accounts)
+        columns = compute_apr(table, inputs, [price[x] for x in table.coin], [price[x] for x in table.pc])
+        if isinstance(accounts, AccountSnapshot):
+            plan = self.plan_cycle(farms)
+            slot_ranges = [accounts.slot_range(plan.farm_reads[x]) for x in farms]
+        else:
+            slot_ranges = [None] * len(farms)
+        return self.farm_results(table, inputs, columns, price, slot_ranges)
+
+    async def get_APR(self, farm: str, accounts: Optional[dict] = None, price: Optional[dict] = None):
         """
 
         :param farm:
+        :param accounts: pre-fetched account data from fetch_cycle_accounts. If given, the farm is decoded locally.
+        :param price: price snapshot of the cycle. Defaults to the (cached) Raydium price map.
         :return:
         """
-
-        is_fusion = self.farms_info[farm]['fusion']
-        is_dual = self.farms_info[farm]['dual']
-
-        farm_lp_info_task = asyncio.create_task(self.get_pool_supply(farm))
-        farm_lp_info = await farm_lp_info_task
+        with self._instrumentation.span("farm_cycle", farm=farm):
+            return await self._get_APR(farm, accounts, price)
+
+    async def _get_APR(self, farm: str, accounts: Optional[dict], price: Optional[dict]):
+        stage = self._instrumentation.span
+        if accounts is not None:
+            if price is None:
+                with stage("get_APR_stage", farm=farm, stage="price"):
+                    price = await self.RAYDIUM.get_price()
+            with stage("get_APR_stage", farm=farm, stage="compute"):
+                return self.compute_farms([farm], accounts, price)[0]
 
         # Grab reward per block
         pool_info = self.farms_info[farm]['poolId']
-
-        stake_info_task = asyncio.create_task(self.SOLANA.getAccountInfo(pool_info))
-        stake_info = await stake_info_task
-        if is_dual:
-            # Dual reward
-            stake_info_data = self.base64_decode(stake_info['result']['value']['data'][0], STAKE_INFO_LAYOUT_V4)
-            per_block_rewardA = stake_info_data.perBlock
-            per_block_rewardB = stake_info_data.perBlockB
-
-            rewardA_coin = self.farms_info[farm]['reward']
-            rewardB_coin = self.farms_info[farm]['rewardB']
-
-            if rewardA_coin == farm_lp_info['coin']:
-                rewardA_price = farm_lp_info['coin_price']
-                rewardA_decimal = self.LP_addresses[farm]['coin_decimals']
-                rewardB_price = farm_lp_info['pc_price']
-                rewardB_decimal = self.LP_addresses[farm]['lp_decimals']
-            elif rewardB_coin == farm_lp_info['coin']:
-                rewardA_price = farm_lp_info['pc_price']
-                rewardA_decimal = self.LP_addresses[farm]['pc_decimals']
-                rewardB_price = farm_lp_info['coin_price']
-                rewardB_decimal = self.LP_addresses[farm]['coin_decimals']
-
-            stake_lp_pool = self.farms_info[farm]['poolLpTokenAccount']
+        stake_lp_pool = self.farms_info[farm]['poolLpTokenAccount']
+
+        # None of the reads depends on another (see fetch_planner): send them all at once. Without a price
+        # snapshot, get_pool_supply and this call share one price request.
+        with stage("get_APR_stage", farm=farm, stage="fetch"):
+            price_task = asyncio.create_task(self.RAYDIUM.get_price()) if price is None else None
+            farm_lp_info_task = asyncio.create_task(self.get_pool_supply(farm, price=price))
+            stake_info_task = asyncio.create_task(self.SOLANA.getAccountInfo(pool_info))
             staked_lp_amount_task = asyncio.create_task(self.SOLANA.getTokenAccountBalance(stake_lp_pool))
-            staked_lp_amount_data = await staked_lp_amount_task
-            staked_lp_amount = staked_lp_amount_data['result']['value']['uiAmount']
-            staked_liquidity = staked_lp_amount * farm_lp_info['lp_share_price']
-
-            APR_A = per_block_rewardA * 2 * 86400 * 365 * rewardA_price / staked_liquidity / (10 ** rewardA_decimal)
-            APR_B = per_block_rewardB * 2 * 86400 * 365 * rewardB_price / staked_liquidity / (10 ** rewardB_decimal)
-
-            farm_lp_info.update({
-                rewardA_coin + "_reward_per_block_ann": per_block_rewardA * 2 * 86400 * 365 / (10 ** rewardA_decimal),
-                rewardB_coin + "_reward_per_block_ann": per_block_rewardB * 2 * 86400 * 365 / (10 ** rewardB_decimal),
-                rewardA_coin + "_APR": APR_A,
-                rewardB_coin + "_APR": APR_B
-            })
-
-        elif is_fusion:
-            # X-USDC fusion pool
-            stake_info_data = self.base64_decode(stake_info['result']['value']['data'][0], STAKE_INFO_LAYOUT_V4)
-            per_block_reward = stake_info_data.perBlockB
-            reward_coin = self.farms_info[farm]['rewardB']
-
-            if reward_coin == farm_lp_info['coin']:
-                reward_price = farm_lp_info['coin_price']
-                reward_decimal = self.LP_addresses[farm]['coin_decimals']
-            else:
-                reward_price = farm_lp_info['pc_price']
-                reward_decimal = self.LP_addresses[farm]['pc_decimals']
-
-            stake_lp_pool = self.farms_info[farm]['poolLpTokenAccount']
-            staked_lp_amount_task = asyncio.create_task(self.SOLANA.getTokenAccountBalance(stake_lp_pool))
-            staked_lp_amount_data = await staked_lp_amount_task
-            staked_lp_amount = staked_lp_amount_data['result']['value']['uiAmount']
-            staked_liquidity = staked_lp_amount * farm_lp_info['lp_share_price']
 
-            APR = per_block_reward * 2 * 86400 * 365 * reward_price / staked_liquidity / (10 ** reward_decimal)
-
-            farm_lp_info.update({
-                reward_coin + "_reward_per_block_ann": per_block_reward * 2 * 86400 * 365 / (10 ** reward_decimal),
-                reward_coin + "_APR": APR
-            })
-
-        else:
-            # RAY yield farming pool
-            stake_info_data = self.base64_decode(stake_info['result']['value']['data'][0], STAKE_INFO_LAYOUT)
-
-            per_block_reward = stake_info_data.rewardPerBlock
-            reward_price = farm_lp_info['coin_price']
-            reward_decimal = self.LP_addresses[farm]['coin_decimals']
-
-            stake_lp_pool = self.farms_info[farm]['poolLpTokenAccount']
-            staked_lp_amount_task = asyncio.create_task(self.SOLANA.getTokenAccountBalance(stake_lp_pool))
+            price = await price_task if price_task is not None else price
+            farm_lp_info = await farm_lp_info_task
+            stake_info = await stake_info_task
             staked_lp_amount_data = await staked_lp_amount_task
-            staked_lp_amount = staked_lp_amount_data['result']['value']['uiAmount']
-            staked_liquidity = staked_lp_amount * farm_lp_info['lp_share_price']
-
-            APR = per_block_reward * 2 * 86400 * 365 * reward_price / staked_liquidity / (10 ** reward_decimal)
-
-            farm_lp_info.update({
-                "RAY_reward_per_block_ann": per_block_reward * 2 * 86400 * 365 / (10 ** reward_decimal),
-                "RAY_APR": APR
-            })
-        return {farm: farm_lp_info}
+        stake_slot = stake_info['result']['context']['slot']
+        stake_info = stake_info['result']['value']['data'][0]
+        staked_lp_amount = staked_lp_amount_data['result']['value']['uiAmount']
+
+        # Tag the result with the slots of every account it was computed from
+        slot_range = merge_slot_ranges(farm_lp_info['slot_range'], (stake_slot, stake_slot),
+                                       (staked_lp_amount_data['result']['context']['slot'],) * 2)
+
+        with stage("get_APR_stage", farm=farm, stage="compute"):
+            table = self.farm_table.take([farm])
+            per_block_a, per_block_b = self.decode_reward_rates(table, [stake_info])
+            inputs = CycleInputs(
+                coin_amount=np.array([farm_lp_info['coinAmount']], dtype=np.float64),
+                pc_amount=np.array([farm_lp_info['pcAmount']], dtype=np.float64),
+                lp_supply=np.array([farm_lp_info['lp_supply']], dtype=np.float64),
+                staked_lp=np.array([staked_lp_amount], dtype=np.float64),
+                per_block_a=per_block_a,
+                per_block_b=per_block_b
+            )
+            columns = compute_apr(table, inputs, [price[table.coin[0]]], [price[table.pc[0]]])
+            return self.farm_results(table, inputs, columns, price, [slot_range])[0]
+
+    async def get_all_APR(self, farms: Optional[List[str]] = None):
+        """
+        Batched read mode of get_APR: read every account of the cycle through chunked getMultipleAccounts calls
+        and compute all farms locally in one pass of the APR engine.
+        :param farms: farm names, all farms by default
+        :return: list of {farm: farm info} dicts, in the order of farms
+        """
+        plan = self.plan_cycle(farms)
+        stage = self._instrumentation.span
+        with stage("farm_cycle", farm="all"):
+            # One wave of reads, every farm priced from the same snapshot
+            with stage("get_APR_stage", farm="all", stage="fetch"):
+                accounts, price = await asyncio.gather(self.fetch_cycle_accounts(plan=plan),
+                                                       self.RAYDIUM.get_price())
+            with stage("get_APR_stage", farm="all", stage="compute"):
+                return self.compute_farms(plan.farms, accounts, price)
+
+    def stake_scan_options(self, pool_id: str, layout):
+        """
+        getProgramAccounts options returning only the stakerOwner and depositBalance bytes of the user stake
+        accounts of one pool: memcmp on the poolId offset. No dataSize filter: the user stake accounts of some
+        programs are longer than the fields their layout describes, and the memcmp alone selects them.
+        :param pool_id: stake pool public key
+        :param layout: user stake account layout of the stake program
+        :return: options for SolanaAPICall.getProgramAccounts, and the decoder of the sliced accounts
+        """
+        decoder = compile_layout(layout, "stakerOwner", "depositBalance")
+        options = {
+            "memcmp_opts": [MemcmpOpts(decoder.offsets['poolId'], pool_id)],
+            "data_slice": decoder.data_slice()
+        }
+        return options, decoder
 
     async def get_RAY_staking_dist(self):
         """
@@ -413,26 +1268,13 @@ class RaydiumPoolInfo:
         :return:
         """
         stake_program_id = STAKE_PROGRAM_ID
-        stake_distro_task = asyncio.create_task(self.SOLANA.getProgramAccounts(stake_program_id))
-        stake_distro_info = await stake_distro_task
-
-        stake_result = stake_distro_info['result']
-        stake_distribution = {
-            "publicKey": [],
-            "Staked RAY amount": []
-        }
-        for account_info in stake_result:
-            stake_owner_data = self.base64_decode(account_info['account']['data'][0], USER_STAKE_INFO_ACCOUNT_LAYOUT)
-            pool_id = base58.b58encode(stake_owner_data.poolId).decode('utf-8')
-            owner_account = base58.b58encode(stake_owner_data.stakerOwner).decode('utf-8')
-            deposit_balance = stake_owner_data.depositBalance
-
-            if pool_id == "4EwbZo8BZXP5313z5A2H11MRBP15M5n6YxfmkjXESKAW" and deposit_balance > 0:
-                # There's only one single-sided staking pool so it's OK to hard-code it
-                stake_distribution['publicKey'].append(owner_account)
-                stake_distribution['Staked RAY amount'].append(deposit_balance / pow(10, 6))
-
-        return stake_distribution
+        # There's only one single-sided staking pool so it's OK to hard-code it
+        options, decoder = self.stake_scan_options(RAY_STAKE_POOL, USER_STAKE_INFO_ACCOUNT_LAYOUT)
+        stake_accounts = await self.decode_program_accounts(self.SOLANA.iterProgramAccounts(stake_program_id, **options),
+                                                            decoder, sliced=True)
+        # Selecting the stakers is mostly base58 encoding of their owners
+        with self._instrumentation.span("base58_encode"):
+            return self.stake_distribution(stake_accounts, 6, "Staked RAY amount")
 
     async def get_fusion_LP_dist(self, farms: str, program_id: str, LAYOUT):
         """
@@ -440,46 +1282,34 @@ class RaydiumPoolInfo:
         :return:
         """
         stake_program_id = program_id
-        stake_distro_task = asyncio.create_task(self.SOLANA.getProgramAccounts(stake_program_id))
-        stake_distro_info = await stake_distro_task
-
-        stake_result = stake_distro_info['result']
-        stake_distribution = {
-            "publicKey": [],
-            "Staked {} LP amount".format(farms): []
-        }
-        for account_info in stake_result:
-            stake_owner_data = self.base64_decode(account_info['account']['data'][0], LAYOUT)
-            pool_id = base58.b58encode(stake_owner_data.poolId).decode('utf-8')
-            owner_account = base58.b58encode(stake_owner_data.stakerOwner).decode('utf-8')
-            deposit_balance = stake_owner_data.depositBalance
-
-            if pool_id == self.farms_info[farms]['poolId'] and deposit_balance > 0:
-                # There's only one single-sided staking pool so it's OK to hard-code it
-                stake_distribution["publicKey"].append(owner_account)
-                stake_distribution["Staked {} LP amount".format(farms)].append(deposit_balance / pow(10, self.LP_addresses[farms]['lp_decimals']))
-
-        return stake_distribution
-
-    async def get_token_dist(self, mint_address: str):
+        options, decoder = self.stake_scan_options(self.farms_info[farms]['poolId'], LAYOUT)
+        stake_accounts = await self.decode_program_accounts(self.SOLANA.iterProgramAccounts(stake_program_id, **options),
+                                                            decoder, sliced=True)
+        with self._instrumentation.span("base58_encode"):
+            return self.stake_distribution(stake_accounts, self.LP_addresses[farms]['lp_decimals'],
+                                           "Staked {} LP amount".format(farms))
+
+    async def get_token_dist(self, mint_address: str, compact: bool = True):
         """
 
         :param mint_address:
+        :param compact: request base64 data sliced to the mint, owner and amount fields and decode it locally,
+            instead of the much larger jsonParsed encoding
         :return:
         """
 
         memcmp = MemcmpOpts(0, mint_address)
-        token_distro_task = asyncio.create_task(self.SOLANA.getProgramAccounts("TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA",
-                                                                               encoding='jsonParsed',
-                                                                               data_size=165,
-                                                                               memcmp_opts=[memcmp]))
-        token_distro_info = await token_distro_task
+        if compact:
+            return await self._get_token_dist_compact(mint_address, memcmp)
 
         token_distro = {
             "publicKey": [],
             "OwnedAmount": []
         }
-        for holder in token_distro_info['result']:
+        async for holder in self.SOLANA.iterProgramAccounts(TOKEN_PROGRAM_ID,
+                                                            encoding='jsonParsed',
+                                                            data_size=165,
+                                                            memcmp_opts=[memcmp]):
             holder_info = holder['account']['data']['parsed']['info']
             holder_account = holder_info['owner']
             holder_amount = holder_info['tokenAmount']['uiAmount']
@@ -489,5 +1319,140 @@ class RaydiumPoolInfo:
 
         return token_distro
 
+    async def _get_token_dist_compact(self, mint_address: str, memcmp: MemcmpOpts):
+        token_distro = self.SOLANA.iterProgramAccounts(TOKEN_PROGRAM_ID,
+                                                       data_size=SPL_ACCOUNT_DECODER.sizeof(),
+                                                       memcmp_opts=[memcmp],
+                                                       data_slice=SPL_ACCOUNT_DECODER.data_slice())
+        holders_task = asyncio.create_task(self.decode_program_accounts(token_distro, SPL_ACCOUNT_DECODER, sliced=True))
+        mint_supply_task = asyncio.create_task(self.SOLANA.getTokenSupply(mint_address))
+        holders = await holders_task
+        mint_supply = await mint_supply_task
+        decimals = mint_supply['result']['value']['decimals']
+
+        mint = np.frombuffer(base58.b58decode(mint_address), dtype=np.uint8)
+        mask = (holders['mint'] == mint).all(axis=1) & (holders['amount'] > 0)
+
+        with self._instrumentation.span("base58_encode"):
+            owners = [base58.b58encode(x.tobytes()).decode('utf-8') for x in holders['owner'][mask]]
+        return {
+            "publicKey": owners,
+            "OwnedAmount": (holders['amount'][mask] / pow(10, decimals)).tolist()
+        }
 
+    def stake_program(self, farm: str):
+        """
+        Stake program of a farm and the layout of its user stake accounts.
+        :param farm: farm name
+        :return:
+        """
+        program_id = STAKE_PROGRAMS[self.farms_info[farm]['programId']]
+        return program_id, USER_STAKE_LAYOUTS[program_id]
+
+    async def get_stake_stats(self, program_id: str, pool_id: str, layout, decimals: int,
+                              label: str) -> HolderStats:
+        """
+        Holder concentration of the stakers of one pool. The scan is summarized by the analytics process pool,
+        see holder_analytics.
+        :param program_id: stake program public key
+        :param pool_id: stake pool public key
+        :param layout: user stake account layout of the stake program
+        :param decimals: decimals of the staked token
+        :param label: name of the distribution
+        :return:
+        """
+        options, decoder = self.stake_scan_options(pool_id, layout)
+        buffer = await self.read_program_accounts(self.SOLANA.iterProgramAccounts(program_id, **options), decoder,
+                                                  sliced=True)
+        return await self.analytics.summarize(buffer, decoder.dtype(sliced=True), "stakerOwner", "depositBalance",
+                                              decimals, label)
 
+    async def get_RAY_staking_stats(self) -> HolderStats:
+        """
+        Holder concentration of the single-sided RAY staking pool.
+        :return:
+        """
+        return await self.get_stake_stats(STAKE_PROGRAM_ID, RAY_STAKE_POOL, USER_STAKE_INFO_ACCOUNT_LAYOUT, 6,
+                                          "RAY staking")
+
+    async def get_fusion_LP_stats(self, farm: str) -> HolderStats:
+        """
+        Holder concentration of the LP stakers of a farm.
+        :param farm: farm name
+        :return:
+        """
+        program_id, layout = self.stake_program(farm)
+        return await self.get_stake_stats(program_id, self.farms_info[farm]['poolId'], layout,
+                                          self.LP_addresses[farm]['lp_decimals'], farm)
+
+    async def get_token_stats(self, mint_address: str) -> HolderStats:
+        """
+        Holder concentration of a token, summed per owner over its token accounts.
+        :param mint_address: token mint public key
+        :return:
+        """
+        token_accounts = self.SOLANA.iterProgramAccounts(TOKEN_PROGRAM_ID,
+                                                         data_size=SPL_ACCOUNT_DECODER.sizeof(),
+                                                         memcmp_opts=[MemcmpOpts(0, mint_address)],
+                                                         data_slice=SPL_ACCOUNT_DECODER.data_slice())
+        buffer_task = asyncio.create_task(self.read_program_accounts(token_accounts, SPL_ACCOUNT_DECODER, sliced=True))
+        mint_supply_task = asyncio.create_task(self.SOLANA.getTokenSupply(mint_address))
+        buffer = await buffer_task
+        mint_supply = await mint_supply_task
+        return await self.analytics.summarize(buffer, SPL_ACCOUNT_DECODER.dtype(sliced=True), "owner", "amount",
+                                              mint_supply['result']['value']['decimals'], mint_address,
+                                              match=("mint", base58.b58decode(mint_address)))
+
+    async def get_distribution_stats(self, farms: Optional[List[str]] = None,
+                                     mints: Iterable[str] = ()) -> Dict[str, HolderStats]:
+        """
+        Scan and summarize the RAY stakers, the LP stakers of some farms and the holders of some tokens
+        concurrently. The summaries run on every core of the analytics pool while the next scans stream in.
+        :param farms: farm names, the fusion farms by default
+        :param mints: token mint public keys
+        :return: dict of label -> HolderStats
+        """
+        if farms is None:
+            farms = [x for x, info in self.farms_info.items() if info['fusion']]
+        stats = await asyncio.gather(self.get_RAY_staking_stats(), *[self.get_fusion_LP_stats(x) for x in farms],
+                                     *[self.get_token_stats(x) for x in mints])
+        return {x.label: x for x in stats}
+
+    async def record_stake_snapshot(self, store: DistributionStore, program_id: str, pool_id: str, layout,
+                                    decimals: int) -> DistributionDelta:
+        """
+        Scan the stakers of one pool into a distribution store, keyed "<program_id>/<pool_id>". Only the changes
+        since the previous scan are written, see distribution_store.
+        :param store: distribution store
+        :param program_id: stake program public key
+        :param pool_id: stake pool public key
+        :param layout: user stake account layout of the stake program
+        :param decimals: decimals of the staked token
+        :return: changes since the previous scan
+        """
+        # The scan reflects the chain at this slot or a later one
+        slot = (await self.SOLANA.getSlot())['result']
+        options, decoder = self.stake_scan_options(pool_id, layout)
+        stake_accounts = await self.decode_program_accounts(self.SOLANA.iterProgramAccounts(program_id, **options),
+                                                            decoder, sliced=True)
+        with self._instrumentation.span("distribution_delta"):
+            return store.append("{}/{}".format(program_id, pool_id), slot, stake_accounts['stakerOwner'],
+                                stake_accounts['depositBalance'], decimals)
+
+    async def record_distribution_snapshots(self, store: DistributionStore,
+                                            farms: Optional[List[str]] = None) -> Dict[str, DistributionDelta]:
+        """
+        Scan the RAY stakers and the LP stakers of some farms concurrently into a distribution store, e.g. hourly
+        instead of keeping the full get_RAY_staking_dist and get_fusion_LP_dist results.
+        :param store: distribution store
+        :param farms: farm names, the fusion farms by default
+        :return: dict of store key -> changes since the previous scan
+        """
+        if farms is None:
+            farms = [x for x, info in self.farms_info.items() if info['fusion']]
+        scans = [(STAKE_PROGRAM_ID, RAY_STAKE_POOL, USER_STAKE_INFO_ACCOUNT_LAYOUT, 6)]
+        for farm in farms:
+            program_id, layout = self.stake_program(farm)
+            scans.append((program_id, self.farms_info[farm]['poolId'], layout, self.LP_addresses[farm]['lp_decimals']))
+        deltas = await asyncio.gather(*[self.record_stake_snapshot(store, *x) for x in scans])
+        return {"{}/{}".format(x[0], x[1]): delta for x, delta in zip(scans, deltas)}
@@ -0,0 +1,193 @@
+"""
+Vectorized APR engine.
+
+The farms of a cycle are computed together, one array element per farm. The static description of each farm
+(FarmTable) is built once from the farm configuration. Farm types (dual, fusion, RAY yield) are encoded as boolean
+masks choosing the reward sources, prices and decimals, so liquidity, LP share price, reward APRs and fee APR are
+computed in one pass without per-farm branches. Inputs broadcast over leading axes, which is what sensitivity_grid
+uses to compute what-if price and reward scenarios.
+"""
+
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+
+# Solana produces about 2 blocks per second
+BLOCKS_PER_YEAR = 2 * 86400 * 365
+
+
+class FarmTable(NamedTuple):
+    """
+    Static description of farms, one element per farm.
+
+    Reward A is the RAY reward of RAY yield farms and the first reward of dual farms. Reward B is the reward of
+    fusion farms and the second reward of dual farms. a_is_coin / b_is_coin tell whether a reward is priced with the
+    coin price of the LP (otherwise the pc price).
+    """
+    farms: List[str]
+    coin: List[str]
+    pc: List[str]
+    reward_a: List[Optional[str]]
+    reward_b: List[Optional[str]]
+    dual: np.ndarray
+    fusion: np.ndarray
+    has_a: np.ndarray
+    has_b: np.ndarray
+    a_is_coin: np.ndarray
+    b_is_coin: np.ndarray
+    decimals_a: np.ndarray
+    decimals_b: np.ndarray
+
+    @classmethod
+    def from_config(cls, farms_info: dict, LP_addresses: dict, farms: Optional[List[str]] = None) -> 'FarmTable':
+        """
+        Build the table from RaydiumPoolInfo.farms_info and RaydiumPoolInfo.LP_addresses.
+        :param farms_info: farm name -> farm configuration
+        :param LP_addresses: farm name -> coin, pc and decimals of the LP
+        :param farms: farm names, all farms by default
+        :return:
+        """
+        farms = list(farms or farms_info)
+        coin = [LP_addresses[x]['coin'] for x in farms]
+        pc = [LP_addresses[x]['pc'] for x in farms]
+        dual = np.array([bool(farms_info[x]['dual']) for x in farms], dtype=bool)
+        fusion = np.array([bool(farms_info[x]['fusion']) for x in farms], dtype=bool) & ~dual
+        ray = ~dual & ~fusion
+
+        a_coin_match = np.array([farms_info[x]['reward'] == c for x, c in zip(farms, coin)], dtype=bool)
+        b_coin_match = np.array([farms_info[x].get('rewardB') == c for x, c in zip(farms, coin)], dtype=bool)
+        # Dual farms with reward A in the coin side, otherwise reward B must be in the coin side
+        dual_a_coin = dual & a_coin_match
+        dual_b_coin = dual & ~a_coin_match & b_coin_match
+        unpriced = dual & ~dual_a_coin & ~dual_b_coin
+        if unpriced.any():
+            raise ValueError("Dual farms without a reward in the coin side: {}.".format(
+                ", ".join(x for x, bad in zip(farms, unpriced) if bad)))
+
+        coin_decimals = np.array([LP_addresses[x]['coin_decimals'] for x in farms], dtype=np.int64)
+        pc_decimals = np.array([LP_addresses[x]['pc_decimals'] for x in farms], dtype=np.int64)
+        lp_decimals = np.array([LP_addresses[x]['lp_decimals'] for x in farms], dtype=np.int64)
+
+        a_is_coin = dual_a_coin | ray
+        b_is_coin = dual_b_coin | (fusion & b_coin_match)
+        # Reward B of dual farms with reward A in the coin side is scaled by the LP decimals, as it always was
+        decimals_b = np.where(dual_a_coin, lp_decimals, np.where(b_is_coin, coin_decimals, pc_decimals))
+
+        return cls(
+            farms=farms,
+            coin=coin,
+            pc=pc,
+            reward_a=[farms_info[x]['reward'] if d else ("RAY" if r else None) for x, d, r in zip(farms, dual, ray)],
+            reward_b=[farms_info[x]['rewardB'] if d or f else None for x, d, f in zip(farms, dual, fusion)],
+            dual=dual,
+            fusion=fusion,
+            has_a=dual | ray,
+            has_b=dual | fusion,
+            a_is_coin=a_is_coin,
+            b_is_coin=b_is_coin,
+            decimals_a=np.where(a_is_coin, coin_decimals, pc_decimals),
+            decimals_b=decimals_b
+        )
+
+    def index(self, farms: List[str]) -> np.ndarray:
+        """
+        Positions of farms in the table.
+        """
+        positions = {x: i for i, x in enumerate(self.farms)}
+        return np.array([positions[x] for x in farms], dtype=np.intp)
+
+    def take(self, farms: List[str]) -> 'FarmTable':
+        """
+        Sub-table of some farms, in the given order.
+        """
+        index = self.index(farms)
+        return FarmTable(*[[x[i] for i in index] if isinstance(x, list) else x[index] for x in self])
+
+
+class CycleInputs(NamedTuple):
+    """
+    Decoded per-farm state of a cycle, one element per farm of a FarmTable.
+
+    coin_amount and pc_amount are the UI amounts of the pool including its open orders. per_block_a / per_block_b
+    are the raw reward rates (0 where the farm has no such reward).
+    """
+    coin_amount: np.ndarray
+    pc_amount: np.ndarray
+    lp_supply: np.ndarray
+    staked_lp: np.ndarray
+    per_block_a: np.ndarray
+    per_block_b: np.ndarray
+
+
+def compute_apr(table: FarmTable, inputs: CycleInputs, coin_price, pc_price, fee_apr=None,
+                reward_scale=1.0) -> Dict[str, np.ndarray]:
+    """
+    Compute the liquidity and APR columns of every farm.
+
+    Prices, fee APR and reward scale broadcast against the farm axis (the last one), so leading axes can hold
+    scenarios.
+    :param table: farms
+    :param inputs: decoded state of the farms
+    :param coin_price: coin price of every farm
+    :param pc_price: pc price of every farm
+    :param fee_apr: fee APR of every farm (e.g. from the Raydium pairs API), 0 by default
+    :param reward_scale: multiplier of the reward rates
+    :return: dict of columns: liquidity, lp_share_price, staked_liquidity, reward_a_ann, reward_b_ann, reward_a_apr,
+        reward_b_apr, fee_apr and total_apr. Rewards a farm does not have are 0.
+    """
+    coin_price = np.asarray(coin_price, dtype=np.float64)
+    pc_price = np.asarray(pc_price, dtype=np.float64)
+
+    liquidity = inputs.coin_amount * coin_price + inputs.pc_amount * pc_price
+    lp_share_price = liquidity / inputs.lp_supply
+    staked_liquidity = inputs.staked_lp * lp_share_price
+
+    reward_a_year = np.where(table.has_a, inputs.per_block_a, 0) * np.float64(BLOCKS_PER_YEAR) * reward_scale
+    reward_b_year = np.where(table.has_b, inputs.per_block_b, 0) * np.float64(BLOCKS_PER_YEAR) * reward_scale
+    scale_a = np.power(10.0, table.decimals_a)
+    scale_b = np.power(10.0, table.decimals_b)
+    reward_a_price = np.where(table.a_is_coin, coin_price, pc_price)
+    reward_b_price = np.where(table.b_is_coin, coin_price, pc_price)
+
+    reward_a_apr = reward_a_year * reward_a_price / staked_liquidity / scale_a
+    reward_b_apr = reward_b_year * reward_b_price / staked_liquidity / scale_b
+    fee_apr = np.zeros_like(liquidity) if fee_apr is None else np.asarray(fee_apr, dtype=np.float64)
+
+    return {
+        "liquidity": liquidity,
+        "lp_share_price": lp_share_price,
+        "staked_liquidity": staked_liquidity,
+        "reward_a_ann": reward_a_year / scale_a,
+        "reward_b_ann": reward_b_year / scale_b,
+        "reward_a_apr": reward_a_apr,
+        "reward_b_apr": reward_b_apr,
+        "fee_apr": fee_apr,
+        "total_apr": reward_a_apr + reward_b_apr + fee_apr
+    }
+
+
+def sensitivity_grid(table: FarmTable, inputs: CycleInputs, coin_price, pc_price, price_scales, reward_scales,
+                     fee_apr=None, scale_coin: bool = True, scale_pc: bool = False) -> np.ndarray:
+    """
+    Total APR of every farm for every combination of a price scenario and a reward rate scenario.
+    :param table: farms
+    :param inputs: decoded state of the farms
+    :param coin_price: coin price of every farm
+    :param pc_price: pc price of every farm
+    :param price_scales: price multipliers, scalars or one row of multipliers per scenario (one per farm)
+    :param reward_scales: reward rate multipliers, scalars or one row of multipliers per scenario
+    :param fee_apr: fee APR of every farm
+    :param scale_coin: apply the price scenarios to the coin prices
+    :param scale_pc: apply the price scenarios to the pc prices
+    :return: array of shape (price scenarios, reward scenarios, farms)
+    """
+    price_scales = np.asarray(price_scales, dtype=np.float64).reshape(-1, 1, 1) \
+        if np.ndim(price_scales) <= 1 else np.asarray(price_scales, dtype=np.float64)[:, None, :]
+    reward_scales = np.asarray(reward_scales, dtype=np.float64).reshape(1, -1, 1) \
+        if np.ndim(reward_scales) <= 1 else np.asarray(reward_scales, dtype=np.float64)[None, :, :]
+
+    coin_price = np.asarray(coin_price, dtype=np.float64) * (price_scales if scale_coin else 1.0)
+    pc_price = np.asarray(pc_price, dtype=np.float64) * (price_scales if scale_pc else 1.0)
+    columns = compute_apr(table, inputs, coin_price, pc_price, fee_apr, reward_scales)
+    return np.broadcast_to(columns["total_apr"], (price_scales.shape[0], reward_scales.shape[1], len(table.farms)))
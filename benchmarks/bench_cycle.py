@@ -0,0 +1,290 @@
+"""
+End-to-end benchmark of a scraper cycle against the mock Solana / Raydium server.
+
+The mock runs in a child process, so the CPU time and peak RSS reported are those of the scraper alone. Phases:
+    apr_per_farm        get_APR of every farm, concurrently, each farm reading its own accounts
+    apr_batched         get_all_APR, every account in chunked getMultipleAccounts calls
+    distributions       get_RAY_staking_dist, get_fusion_LP_dist of every fusion farm and get_token_dist
+    distribution_stats  the same scans through get_distribution_stats, summarized by the analytics process pool
+                        (whose CPU time is not counted)
+Every phase starts with the Raydium pairs snapshot, as the driver cycle does.
+
+Reported per phase: cycle wall time, HTTP requests and RPC calls per cycle, p50 / p99 request latency (time to the
+response headers), CPU time and decode CPU time (JSON decoding and account decoding) per cycle, and the peak RSS
+of the process at the end of the phase.
+
+    python -m benchmarks.bench_cycle --stakers 100000 --latency 0.02 --output bench.json
+    python -m benchmarks.bench_cycle --stakers 100000 --latency 0.02 --compare bench.json
+
+--output writes the results as JSON, tagged with the git commit, so that runs on different commits can be compared
+with --compare.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+import numpy as np
+
+from LPInfo import RaydiumPoolInfo
+from benchmarks import mock_server
+from json_codec import JSONArrayStream, JSONCodec, get_codec
+
+
+PHASES = ["apr_per_farm", "apr_batched", "distributions", "distribution_stats"]
+# Metrics compared by --compare, and whether lower is better
+COMPARED_METRICS = {
+    "cycle_wall_s": True,
+    "http_requests_per_cycle": True,
+    "latency_p50_ms": True,
+    "latency_p99_ms": True,
+    "cpu_s_per_cycle": True,
+    "decode_cpu_s_per_cycle": True,
+    "peak_rss_mb": True
+}
+
+
+class DecodeTimer:
+    """
+    CPU time spent in the wrapped decoding functions. Nested calls are counted once.
+    """
+    def __init__(self):
+        self.seconds = 0.0
+        self._depth = 0
+
+    def wrap(self, function):
+        def timed(*args, **kwargs):
+            self._depth += 1
+            start = time.thread_time() if self._depth == 1 else None
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                if start is not None:
+                    self.seconds += time.thread_time() - start
+        return timed
+
+    def codec(self, codec: JSONCodec) -> JSONCodec:
+        return JSONCodec(codec.name, self.wrap(codec.loads), codec.dumps)
+
+
+def latency_trace(latencies: List[float]) -> aiohttp.TraceConfig:
+    """
+    Trace config recording the latency of every request, up to its response headers.
+    """
+    async def on_request_start(session, context, params):
+        context.start = time.monotonic()
+
+    async def on_request_end(session, context, params):
+        latencies.append(time.monotonic() - context.start)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL)
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.decode().strip() + ("-dirty" if dirty else "")
+
+
+async def mock_stats(session: aiohttp.ClientSession, rpc_url: str, reset: bool = False) -> dict:
+    request = session.post if reset else session.get
+    async with request(rpc_url + "stats") as resp:
+        return await resp.json()
+
+
+async def run_phase(phase: str, LP: RaydiumPoolInfo, token_mint: str):
+    await LP.RAYDIUM.get_pair()
+    if phase == "apr_per_farm":
+        await asyncio.gather(*[LP.get_APR(x) for x in LP.farms_info])
+    elif phase == "apr_batched":
+        await LP.get_all_APR()
+    elif phase == "distribution_stats":
+        await LP.get_distribution_stats(mints=[token_mint])
+    else:
+        fusion_farms = [x for x, info in LP.farms_info.items() if info['fusion']]
+        await asyncio.gather(
+            LP.get_RAY_staking_dist(),
+            *[LP.get_fusion_LP_dist(x, *LP.stake_program(x)) for x in fusion_farms],
+            LP.get_token_dist(token_mint)
+        )
+
+
+async def bench_phase(phase: str, LP: RaydiumPoolInfo, session: aiohttp.ClientSession, rpc_url: str,
+                      token_mint: str, latencies: List[float], timer: DecodeTimer, cycles: int,
+                      warmup: int) -> Dict[str, float]:
+    for _ in range(warmup):
+        await run_phase(phase, LP, token_mint)
+
+    walls = []
+    http_requests = []
+    rpc_calls = []
+    cycle_latencies = []
+    cpu = 0.0
+    decode_cpu = 0.0
+    for _ in range(cycles):
+        # Nothing cached outlives the minute between two cycles
+        LP.RAYDIUM.invalidate()
+        LP.rpc_cache.invalidate()
+        await mock_stats(session, rpc_url, reset=True)
+        latencies.clear()
+        decode_start = timer.seconds
+        cpu_start = cpu_seconds()
+        start = time.perf_counter()
+        await run_phase(phase, LP, token_mint)
+        walls.append(time.perf_counter() - start)
+        cpu += cpu_seconds() - cpu_start
+        decode_cpu += timer.seconds - decode_start
+        cycle_latencies += latencies
+
+        stats = await mock_stats(session, rpc_url)
+        # Service totals include the rejected requests, which are also counted under "<service> <status>"
+        http_requests.append(sum(v for k, v in stats['http_requests'].items() if " " not in k))
+        rpc_calls.append(sum(stats['rpc_calls'].values()))
+    latencies_ms = np.array(cycle_latencies) * 1000
+
+    return {
+        "cycles": cycles,
+        "cycle_wall_s": float(np.median(walls)),
+        "cycle_wall_s_min": float(np.min(walls)),
+        "cycle_wall_s_max": float(np.max(walls)),
+        "http_requests_per_cycle": float(np.mean(http_requests)),
+        "rpc_calls_per_cycle": float(np.mean(rpc_calls)),
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else None,
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else None,
+        "cpu_s_per_cycle": cpu / cycles,
+        "decode_cpu_s_per_cycle": decode_cpu / cycles,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+async def run_benchmark(urls, phases: List[str], cycles: int, warmup: int, batch_size: Optional[int],
+                        codec_name: Optional[str]) -> Dict[str, dict]:
+    rpc_url, price_url, pairs_url = urls
+    latencies = []
+    timer = DecodeTimer()
+    codec = timer.codec(get_codec(codec_name))
+    # Decoding outside of the codec: the streaming scanner and the account decoders
+    JSONArrayStream.feed = timer.wrap(JSONArrayStream.feed)
+    RaydiumPoolInfo.base64_decode = timer.wrap(RaydiumPoolInfo.base64_decode)
+    RaydiumPoolInfo.decode_account_columns = timer.wrap(RaydiumPoolInfo.decode_account_columns)
+
+    async with aiohttp.ClientSession(trace_configs=[latency_trace(latencies)]) as session:
+        token_mint = (await mock_stats(session, rpc_url))['token_mint']
+        LP = RaydiumPoolInfo(session, batch_size=batch_size, endpoints=[rpc_url], price_endpoint=price_url,
+                             fee_endpoint=pairs_url, codec=codec)
+        results = {}
+        try:
+            for phase in phases:
+                results[phase] = await bench_phase(phase, LP, session, rpc_url, token_mint, latencies, timer, cycles,
+                                                   warmup)
+                print_phase(phase, results[phase])
+        finally:
+            LP.analytics.close()
+        return results
+
+
+def print_phase(phase: str, result: dict):
+    print("{}: {:.3f} s/cycle (min {:.3f}, max {:.3f}), {:.0f} HTTP requests / {:.0f} RPC calls per cycle, "
+          "latency p50 {} ms p99 {} ms, CPU {:.3f} s/cycle (decode {:.3f} s), peak RSS {:.1f} MB".format(
+              phase, result['cycle_wall_s'], result['cycle_wall_s_min'], result['cycle_wall_s_max'],
+              result['http_requests_per_cycle'], result['rpc_calls_per_cycle'],
+              _format(result['latency_p50_ms']), _format(result['latency_p99_ms']), result['cpu_s_per_cycle'],
+              result['decode_cpu_s_per_cycle'], result['peak_rss_mb']))
+
+
+def _format(value: Optional[float]) -> str:
+    return "-" if value is None else "{:.1f}".format(value)
+
+
+def compare(results: dict, baseline: dict):
+    """
+    Print the relative change of every compared metric against a baseline run.
+    """
+    print("\nAgainst {} (commit {}):".format(baseline.get('path'), baseline.get('commit')))
+    if baseline.get('config') != results['config']:
+        print("  warning: the runs used different configurations")
+    for phase, metrics in results['phases'].items():
+        base = baseline['phases'].get(phase)
+        if base is None:
+            continue
+        for metric, lower_is_better in COMPARED_METRICS.items():
+            new, old = metrics.get(metric), base.get(metric)
+            if new is None or not old:
+                continue
+            change = (new - old) / old
+            better = change < 0 if lower_is_better else change > 0
+            print("  {:<14} {:<24} {:>12.3f} -> {:>12.3f}  {:+7.1%}{}".format(
+                phase, metric, old, new, change, "" if abs(change) < 0.05 else (" better" if better else " worse")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mock_server.add_cluster_arguments(parser)
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=PHASES)
+    parser.add_argument("--cycles", type=int, default=3, help="measured cycles per phase")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured cycles run first in every phase")
+    parser.add_argument("--batch-size", type=int, help="JSON RPC batch size of the Solana calls")
+    parser.add_argument("--codec", help="JSON backend, the fastest available one by default")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results of a previous run")
+    args = parser.parse_args()
+
+    config = dict(mock_server.cluster_options(args), cycles=args.cycles, warmup=args.warmup,
+                  batch_size=args.batch_size, codec=get_codec(args.codec).name)
+    context = multiprocessing.get_context("spawn")
+    urls = context.Queue()
+    server = context.Process(target=mock_server.serve, args=(mock_server.cluster_options(args), urls), daemon=True)
+    server.start()
+    try:
+        phases = asyncio.run(run_benchmark(urls.get(timeout=600), args.phases, args.cycles, args.warmup,
+                                           args.batch_size, args.codec))
+    finally:
+        server.terminate()
+        server.join()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "phases": phases
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        baseline['path'] = args.compare
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Micro-benchmark of response decoding: ast.literal_eval vs the json_codec backends.
+
+Recorded payloads can be passed on the command line:
+    python -m benchmarks.bench_decode --pairs pairs.json --program-accounts program_accounts.json
+Without them, payloads with the shape of the /pairs and getProgramAccounts responses are synthesized.
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import timeit
+from ast import literal_eval
+
+from json_codec import BACKENDS
+
+
+def synthetic_pairs(n_pairs: int = 300) -> bytes:
+    # No true/false/null values, so that literal_eval can take part in the comparison
+    rnd = random.Random(0)
+    pairs = []
+    for i in range(n_pairs):
+        pairs.append({
+            "name": "TOKEN{}-USDC".format(i),
+            "pair_id": "PAIR{}".format(i),
+            "lp_mint": "LP{}".format(i),
+            "liquidity": rnd.uniform(1e3, 1e8),
+            "market": "MARKET{}".format(i),
+            "volume_24h": rnd.uniform(0, 1e7),
+            "volume_24h_quote": rnd.uniform(0, 1e7),
+            "fee_24h": rnd.uniform(0, 1e4),
+            "fee_24h_quote": rnd.uniform(0, 1e4),
+            "volume_7d": rnd.uniform(0, 1e8),
+            "volume_7d_quote": rnd.uniform(0, 1e8),
+            "fee_7d": rnd.uniform(0, 1e5),
+            "fee_7d_quote": rnd.uniform(0, 1e5),
+            "price": rnd.uniform(0, 100),
+            "lp_price": rnd.uniform(0, 100),
+            "amm_id": "AMM{}".format(i),
+            "token_amount_coin": rnd.uniform(0, 1e9),
+            "token_amount_pc": rnd.uniform(0, 1e9),
+            "token_amount_lp": rnd.uniform(0, 1e9),
+            "apy": rnd.uniform(0, 200)
+        })
+    return json.dumps(pairs).encode()
+
+
+def synthetic_program_accounts(n_accounts: int = 20000, data_size: int = 96) -> bytes:
+    rnd = random.Random(1)
+    accounts = []
+    for _ in range(n_accounts):
+        data = bytes(rnd.getrandbits(8) for _ in range(data_size))
+        accounts.append({
+            "account": {
+                "data": [base64.b64encode(data).decode(), "base64"],
+                "executable": False,
+                "lamports": 1392000,
+                "owner": "CBuCnLe26faBpcBP2fktp4rp8abpcAnTWft6ZrP5Q4T",
+                "rentEpoch": 200
+            },
+            "pubkey": base64.b64encode(bytes(rnd.getrandbits(8) for _ in range(32))).decode()
+        })
+    return json.dumps({"jsonrpc": "2.0", "result": accounts, "id": 1}).encode()
+
+
+def bench(name: str, payload: bytes, number: int, literal: bool):
+    print("{} ({:.1f} kB)".format(name, len(payload) / 1024))
+    # The first decoder is the baseline the speed-ups are relative to
+    decoders = {}
+    if literal:
+        decoders["ast.literal_eval(text())"] = lambda body: literal_eval(body.decode('utf-8'))
+    decoders["json loads(text())"] = lambda body: json.loads(body.decode('utf-8'))
+    decoders.update({"{} loads(bytes)".format(x): codec.loads for x, codec in BACKENDS.items()})
+
+    baseline = None
+    for label, decode in decoders.items():
+        seconds = min(timeit.repeat(lambda: decode(payload), number=number, repeat=3)) / number
+        baseline = baseline or seconds
+        print("  {:<28} {:>10.3f} ms  {:>6.2f}x".format(label, seconds * 1000, baseline / seconds))
+
+
+def read_payload(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", help="recorded /pairs response body")
+    parser.add_argument("--program-accounts", help="recorded getProgramAccounts response body")
+    parser.add_argument("--number", type=int, default=5, help="decodes per timing run")
+    args = parser.parse_args()
+
+    pairs = read_payload(args.pairs) if args.pairs else synthetic_pairs()
+    program_accounts = read_payload(args.program_accounts) if args.program_accounts else synthetic_program_accounts()
+
+    bench(os.path.basename(args.pairs) if args.pairs else "/pairs (synthetic)", pairs, args.number, literal=True)
+    # literal_eval cannot parse the true/false literals of RPC responses
+    bench(os.path.basename(args.program_accounts) if args.program_accounts else "getProgramAccounts (synthetic)",
+          program_accounts, args.number, literal=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,480 @@
+"""
+Mock of the Solana JSON RPC and Raydium APIs, for benchmarks.
+
+The mock serves synthetic but well-formed accounts for every pool and farm of the resources files: vaults, LP mints,
+open orders, stake pools, AMM pool states and any number of user stake accounts, token holders and extra AMM
+pools. Latency, rate limits and error
+rates are configurable, so a cycle can be measured under realistic network conditions without touching mainnet.
+
+Emulated: getTokenAccountBalance, getTokenSupply, getAccountInfo, getMultipleAccounts, getProgramAccounts (dataSize
+and memcmp filters, dataSlice, base64 and jsonParsed encodings), JSON RPC batches, GET /coin/price and GET /pairs.
+GET /stats returns the requests served, POST /stats returns them and resets the counters.
+
+Standalone:
+    python -m benchmarks.mock_server --stakers 100000 --latency 0.05 --rate-limit 40
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import struct
+import time
+from collections import Counter
+from typing import Optional
+
+import base58
+import numpy as np
+from aiohttp import web
+
+from LPInfo import TOKEN_INFO_FILE, LP_TOKEN_INFO_FILE, LP_ADDRESS_INFO_FILE, FARMS_INFO_FILE, STAKE_INFO_FILE
+from compiled_layout import SPL_ACCOUNT_DECODER, SPL_MINT_DECODER, OPEN_ORDERS_DECODER
+from compiled_layout import STAKE_INFO_DECODER, STAKE_INFO_V4_DECODER
+from compiled_layout import USER_STAKE_INFO_DECODER, USER_STAKE_INFO_V4_DECODER, USER_STAKE_INFO_V5_DECODER
+from compiled_layout import AMM_INFO_V4_DECODER
+from resources import ids
+from resources.ids import TOKEN_PROGRAM_ID, LIQUIDITY_POOL_PROGRAM_ID_V4
+
+
+_BASE58_ALPHABET = np.frombuffer(base58.alphabet, dtype=np.uint8)
+# Stake program -> decoder of its user stake accounts, at their size on chain
+USER_STAKE_DECODERS = {
+    ids.STAKE_PROGRAM_ID: USER_STAKE_INFO_DECODER,
+    ids.STAKE_PROGRAM_ID_V4: USER_STAKE_INFO_V4_DECODER,
+    ids.STAKE_PROGRAM_ID_V5: USER_STAKE_INFO_V5_DECODER
+}
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class MockCluster:
+    """
+    Synthetic Solana cluster and Raydium API served by aiohttp.web.
+    """
+    def __init__(self, stakers: int = 1000, holders: int = 1000, latency: float = 0.0, jitter: float = 0.0,
+                 rate_limit: Optional[float] = None, error_rate: float = 0.0, seed: int = 0, pools: int = 0):
+        """
+        :param stakers: user stake accounts of the RAY stake pool and of every fusion pool
+        :param holders: token accounts of the synthetic token mint (token_mint)
+        :param latency: seconds added to every response
+        :param jitter: upper bound of a uniformly random delay added to latency
+        :param rate_limit: requests per second answered before 429 Too Many Requests, unlimited by default
+        :param error_rate: fraction of requests answered with 503 Service Unavailable
+        :param seed: seed of the synthetic data and of the injected errors
+        :param pools: AMM V4 pools added to the pools of the resources files
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._numpy_random = np.random.default_rng(seed)
+        self.slot = 100000000
+        self.accounts = {}
+        self.programs = {}
+        self.prices = {}
+        self.pairs = []
+        self.http_requests = Counter()
+        self.rpc_calls = Counter()
+        self._windows = {}
+        self._results = {}
+        self._runner = None
+        self.rpc_url = None
+        self.price_url = None
+        self.pairs_url = None
+
+        self._build(stakers, holders, pools)
+
+    # Synthetic data
+
+    def _key(self) -> str:
+        return base58.b58encode(bytes(self._random.getrandbits(8) for _ in range(32))).decode()
+
+    def _token_account(self, mint: bytes, owner: bytes, amount: int) -> bytes:
+        data = bytearray(SPL_ACCOUNT_DECODER.sizeof())
+        data[SPL_ACCOUNT_DECODER.offsets["mint"]:SPL_ACCOUNT_DECODER.offsets["mint"] + 32] = mint
+        data[SPL_ACCOUNT_DECODER.offsets["owner"]:SPL_ACCOUNT_DECODER.offsets["owner"] + 32] = owner
+        struct.pack_into("<Q", data, SPL_ACCOUNT_DECODER.offsets["amount"], amount)
+        return bytes(data)
+
+    def _mint(self, supply: int, decimals: int) -> bytes:
+        data = bytearray(SPL_MINT_DECODER.sizeof())
+        struct.pack_into("<Q", data, SPL_MINT_DECODER.offsets["supply"], supply)
+        struct.pack_into("<B", data, SPL_MINT_DECODER.offsets["decimals"], decimals)
+        return bytes(data)
+
+    def _build(self, stakers: int, holders: int, pools: int):
+        rnd = self._random
+        tokens = _load(TOKEN_INFO_FILE)
+        lp_tokens = _load(LP_TOKEN_INFO_FILE)
+        details = {x['name']: x for x in _load(LP_ADDRESS_INFO_FILE)}
+        farms = _load(FARMS_INFO_FILE)
+        stake = _load(STAKE_INFO_FILE)
+
+        self.prices = {x: rnd.uniform(0.01, 100) for x in tokens}
+        self.pairs = [{"name": x, "apy": rnd.uniform(1, 100)} for x in lp_tokens]
+
+        self._decimals = {}
+        lp_decimals = {}
+        for lp in lp_tokens.values():
+            coin, pc = lp['symbol'].split('-')
+            pool = details[lp['symbol']]
+            lp_decimals[lp['symbol']] = lp['decimals']
+            self._decimals[pool['poolCoinTokenAccount']] = tokens[coin]['decimals']
+            self._decimals[pool['poolPcTokenAccount']] = tokens[pc]['decimals']
+            self.accounts[pool['poolCoinTokenAccount']] = self._token_account(
+                bytes(32), bytes(32), rnd.randint(10 ** 6, 10 ** 15))
+            self.accounts[pool['poolPcTokenAccount']] = self._token_account(
+                bytes(32), bytes(32), rnd.randint(10 ** 6, 10 ** 15))
+            self.accounts[lp['mintAddress']] = self._mint(rnd.randint(10 ** 9, 10 ** 14), lp['decimals'])
+            open_orders = bytearray(OPEN_ORDERS_DECODER.sizeof())
+            struct.pack_into("<Q", open_orders, OPEN_ORDERS_DECODER.offsets["base_token_total"], rnd.randint(0, 10 ** 9))
+            struct.pack_into("<Q", open_orders, OPEN_ORDERS_DECODER.offsets["quote_token_total"], rnd.randint(0, 10 ** 9))
+            self.accounts[pool['ammOpenOrders']] = bytes(open_orders)
+
+        for farm in farms + [stake]:
+            program_id = getattr(ids, farm['programId'])
+            if farm['fusion'] or farm['dual']:
+                pool_info = bytearray(STAKE_INFO_V4_DECODER.sizeof())
+                struct.pack_into("<Q", pool_info, STAKE_INFO_V4_DECODER.offsets["perBlock"], rnd.randint(1, 10 ** 7))
+                struct.pack_into("<Q", pool_info, STAKE_INFO_V4_DECODER.offsets["perBlockB"], rnd.randint(1, 10 ** 7))
+            else:
+                pool_info = bytearray(STAKE_INFO_DECODER.sizeof())
+                struct.pack_into("<Q", pool_info, STAKE_INFO_DECODER.offsets["rewardPerBlock"], rnd.randint(1, 10 ** 7))
+            self.accounts[farm['poolId']] = bytes(pool_info)
+            self.accounts[farm['poolLpTokenAccount']] = self._token_account(
+                bytes(32), bytes(32), rnd.randint(10 ** 6, 10 ** 14))
+            self._decimals[farm['poolLpTokenAccount']] = lp_decimals.get(farm['name'], 6)
+
+            # User stake accounts of the pools whose distribution is scanned: the RAY pool and the fusion pools
+            if farm is stake or farm['fusion']:
+                decoder = USER_STAKE_DECODERS[program_id]
+                self.programs.setdefault(program_id, []).append(
+                    self._user_stake_accounts(decoder, farm['poolId'], stakers))
+
+        # Holders of one token mint, for the token distribution scans
+        self.token_mint = self._key()
+        self.accounts[self.token_mint] = self._mint(10 ** 15, 6)
+        self.programs[TOKEN_PROGRAM_ID] = [self._token_holders(self.token_mint, holders)]
+
+        # AMM pool states, for pool discovery
+        v4_pools = [(x, details[x['symbol']]) for x in lp_tokens.values()
+                    if details[x['symbol']]['programId'] == 'LIQUIDITY_POOL_PROGRAM_ID_V4']
+        amm_ids = [pool['ammId'] for _, pool in v4_pools] + [self._key() for _ in range(pools)]
+        states = np.zeros((len(amm_ids), AMM_INFO_V4_DECODER.sizeof()), dtype=np.uint8)
+        for i, amm_id in enumerate(amm_ids):
+            if i < len(v4_pools):
+                lp, pool = v4_pools[i]
+                coin, pc = lp['symbol'].split('-')
+                fields = {"coinMintAddress": tokens[coin]['mintAddress'], "pcMintAddress": tokens[pc]['mintAddress'],
+                          "lpMintAddress": lp['mintAddress'], "poolCoinTokenAccount": pool['poolCoinTokenAccount'],
+                          "poolPcTokenAccount": pool['poolPcTokenAccount'], "ammOpenOrders": pool['ammOpenOrders'],
+                          "serumMarket": pool['serumMarket']}
+                decimals = (tokens[coin]['decimals'], tokens[pc]['decimals'])
+            else:
+                fields = {x: self._key() for x in ("coinMintAddress", "pcMintAddress", "lpMintAddress",
+                                                   "poolCoinTokenAccount", "poolPcTokenAccount", "ammOpenOrders",
+                                                   "serumMarket")}
+                decimals = (rnd.randint(0, 9), rnd.randint(0, 9))
+            self.set_pool(amm_id, states[i], fields, decimals)
+        self.programs[LIQUIDITY_POOL_PROGRAM_ID_V4] = [(amm_ids, states)]
+
+    def set_pool(self, amm_id: str, state: np.ndarray, fields: dict, decimals: tuple, status: int = 1):
+        """
+        Write an AMM pool state in place, and serve it by address too.
+        """
+        offsets = AMM_INFO_V4_DECODER.offsets
+        struct.pack_into("<QQ", state, offsets["coinDecimals"], *decimals)
+        struct.pack_into("<Q", state, offsets["status"], status)
+        for name, address in fields.items():
+            state[offsets[name]:offsets[name] + 32] = np.frombuffer(base58.b58decode(address), dtype=np.uint8)
+        self.accounts[amm_id] = state.tobytes()
+        self._results.clear()
+
+    def _random_amounts(self, n: int) -> np.ndarray:
+        """
+        Amounts with a long tail, a fifth of them empty.
+        """
+        amounts = np.exp(self._numpy_random.uniform(0, np.log(10 ** 12), n)).astype(np.uint64)
+        amounts[self._numpy_random.random(n) < 0.2] = 0
+        return amounts
+
+    def _random_keys(self, n: int) -> np.ndarray:
+        return self._numpy_random.integers(0, 256, (n, 32), dtype=np.uint8)
+
+    def _accounts(self, data: np.ndarray):
+        """
+        Group of synthetic program accounts of one size: their public keys, and their data as one row per account.
+        The public keys are random base58 strings: nothing decodes them, and encoding real keys would dominate the
+        setup time.
+        """
+        keys = _BASE58_ALPHABET[self._numpy_random.integers(0, 58, (len(data), 44))].tobytes().decode()
+        return [keys[i * 44:(i + 1) * 44] for i in range(len(data))], data
+
+    def _user_stake_accounts(self, decoder, pool_id: str, n: int):
+        data = np.zeros((n, decoder.sizeof()), dtype=np.uint8)
+        offsets = decoder.offsets
+        data[:, offsets["poolId"]:offsets["poolId"] + 32] = np.frombuffer(base58.b58decode(pool_id), dtype=np.uint8)
+        data[:, offsets["stakerOwner"]:offsets["stakerOwner"] + 32] = self._random_keys(n)
+        data[:, offsets["depositBalance"]:offsets["depositBalance"] + 8] = \
+            self._random_amounts(n).astype("<u8").view(np.uint8).reshape(n, 8)
+        return self._accounts(data)
+
+    def _token_holders(self, mint: str, n: int):
+        data = np.zeros((n, SPL_ACCOUNT_DECODER.sizeof()), dtype=np.uint8)
+        offsets = SPL_ACCOUNT_DECODER.offsets
+        data[:, offsets["mint"]:offsets["mint"] + 32] = np.frombuffer(base58.b58decode(mint), dtype=np.uint8)
+        data[:, offsets["owner"]:offsets["owner"] + 32] = self._random_keys(n)
+        data[:, offsets["amount"]:offsets["amount"] + 8] = \
+            self._random_amounts(n).astype("<u8").view(np.uint8).reshape(n, 8)
+        return self._accounts(data)
+
+    # JSON RPC
+
+    def _context(self, value):
+        return {"context": {"slot": self.slot}, "value": value}
+
+    def _account(self, publicKey: str, data_slice: Optional[dict] = None):
+        data = self.accounts.get(publicKey)
+        if data is None:
+            return None
+        if data_slice:
+            data = data[data_slice['offset']:data_slice['offset'] + data_slice['length']]
+        return {"data": [base64.b64encode(data).decode(), "base64"], "executable": False, "lamports": 2039280,
+                "owner": TOKEN_PROGRAM_ID, "rentEpoch": 200}
+
+    def _token_amount(self, amount: int, decimals: int):
+        return {"amount": str(amount), "decimals": decimals, "uiAmount": amount / 10 ** decimals,
+                "uiAmountString": str(amount / 10 ** decimals)}
+
+    def _program_accounts(self, program_id: str, options: dict):
+        filters = options.get('filters', [])
+        data_slice = options.get('dataSlice')
+        result = []
+        for publicKeys, data in self.programs.get(program_id, []):
+            mask = np.ones(len(data), dtype=bool)
+            for condition in filters:
+                if 'dataSize' in condition and data.shape[1] != condition['dataSize']:
+                    mask[:] = False
+                if 'memcmp' in condition:
+                    expected = np.frombuffer(base58.b58decode(condition['memcmp']['bytes']), dtype=np.uint8)
+                    offset = condition['memcmp']['offset']
+                    mask &= (data[:, offset:offset + len(expected)] == expected).all(axis=1)
+
+            for i in np.flatnonzero(mask):
+                row = data[i]
+                if options.get('encoding') == 'jsonParsed':
+                    owner = row[SPL_ACCOUNT_DECODER.offsets["owner"]:SPL_ACCOUNT_DECODER.offsets["owner"] + 32]
+                    amount = struct.unpack_from("<Q", row, SPL_ACCOUNT_DECODER.offsets["amount"])[0]
+                    account_data = {"parsed": {"info": {"owner": base58.b58encode(owner.tobytes()).decode(),
+                                                        "tokenAmount": self._token_amount(amount, 6)},
+                                               "type": "account"},
+                                    "program": "spl-token", "space": len(row)}
+                else:
+                    if data_slice:
+                        row = row[data_slice['offset']:data_slice['offset'] + data_slice['length']]
+                    account_data = [base64.b64encode(row.tobytes()).decode(), "base64"]
+                result.append({"pubkey": publicKeys[i], "account": {"data": account_data, "executable": False,
+                                                                    "lamports": 2039280, "owner": program_id,
+                                                                    "rentEpoch": 200}})
+        return result
+
+    def _result(self, method: str, params: list):
+        if method == 'getTokenAccountBalance':
+            data = self.accounts[params[0]]
+            amount = struct.unpack_from("<Q", data, SPL_ACCOUNT_DECODER.offsets["amount"])[0]
+            return self._context(self._token_amount(amount, self._decimals.get(params[0], 6)))
+        if method == 'getTokenSupply':
+            data = self.accounts[params[0]]
+            supply = struct.unpack_from("<Q", data, SPL_MINT_DECODER.offsets["supply"])[0]
+            decimals = data[SPL_MINT_DECODER.offsets["decimals"]]
+            return self._context(self._token_amount(supply, decimals))
+        if method == 'getSlot':
+            return self.slot
+        if method == 'getAccountInfo':
+            return self._context(self._account(params[0]))
+        if method == 'getMultipleAccounts':
+            data_slice = params[1].get('dataSlice') if len(params) > 1 else None
+            return self._context([self._account(x, data_slice) for x in params[0]])
+        if method == 'getProgramAccounts':
+            return self._program_accounts(params[0], params[1] if len(params) > 1 else {})
+        return None
+
+    def handle(self, request: dict) -> bytes:
+        """
+        Answer one JSON RPC request.
+        :param request: decoded request
+        :return: serialized response
+        """
+        method = request['method']
+        params = request.get('params', [])
+        self.rpc_calls[method] += 1
+        request_id = json.dumps(request.get('id')).encode()
+        # Results are deterministic: serialize each distinct call once, large program scans included
+        key = json.dumps([method, params], sort_keys=True)
+        result = self._results.get(key)
+        if result is None:
+            value = self._result(method, params)
+            if value is None:
+                return b'{"jsonrpc":"2.0","id":' + request_id + b',"error":{"code":-32601,"message":"Method not found"}}'
+            result = json.dumps(value).encode()
+            self._results[key] = result
+        return b'{"jsonrpc":"2.0","id":' + request_id + b',"result":' + result + b'}'
+
+    # HTTP
+
+    async def _throttle(self, service: str) -> Optional[web.Response]:
+        """
+        Apply the configured latency, rate limit and error rate to a request.
+        :param service: 'rpc' or 'api', rate limited separately
+        :return: an error response, or None to answer normally
+        """
+        self.http_requests[service] += 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if self.rate_limit is not None:
+            now = time.monotonic()
+            window_start, count = self._windows.get(service, (0.0, 0))
+            if now - window_start >= 1:
+                window_start, count = now, 0
+            self._windows[service] = (window_start, count + 1)
+            if count + 1 > self.rate_limit:
+                self.http_requests[service + " 429"] += 1
+                return web.Response(status=429, headers={"Retry-After": "1"})
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.http_requests[service + " 503"] += 1
+            return web.Response(status=503)
+        return None
+
+    async def _rpc(self, request: web.Request) -> web.Response:
+        error = await self._throttle("rpc")
+        if error is not None:
+            return error
+        payload = json.loads(await request.read())
+        if isinstance(payload, list):
+            body = b"[" + b",".join(self.handle(x) for x in payload) + b"]"
+        else:
+            body = self.handle(payload)
+        return web.Response(body=body, content_type="application/json")
+
+    async def _price(self, request: web.Request) -> web.Response:
+        return await self._throttle("api") or web.json_response(self.prices)
+
+    async def _pairs(self, request: web.Request) -> web.Response:
+        return await self._throttle("api") or web.json_response(self.pairs)
+
+    async def _stats(self, request: web.Request) -> web.Response:
+        stats = self.stats()
+        if request.method == "POST":
+            self.reset_counters()
+        return web.json_response(stats)
+
+    def stats(self) -> dict:
+        """
+        Requests served since the last reset: HTTP requests per service (and per error status), RPC calls per method.
+        """
+        return {"token_mint": self.token_mint, "http_requests": dict(self.http_requests),
+                "rpc_calls": dict(self.rpc_calls)}
+
+    def reset_counters(self):
+        self.http_requests.clear()
+        self.rpc_calls.clear()
+
+    async def start(self, host: str = "127.0.0.1", rpc_port: int = 0, api_port: int = 0):
+        """
+        Start serving in the running event loop. The Solana RPC and the Raydium API listen on separate ports, as
+        they are separate hosts for the client rate limiters.
+        :param host: interface to listen on
+        :param rpc_port: port of the Solana RPC, 0 for any free port
+        :param api_port: port of the Raydium API, 0 for any free port
+        :return: URLs of the RPC endpoint, the price endpoint and the pairs endpoint
+        """
+        app = web.Application(client_max_size=1 << 26)
+        app.router.add_post("/", self._rpc)
+        app.router.add_get("/coin/price", self._price)
+        app.router.add_get("/pairs", self._pairs)
+        app.router.add_route("*", "/stats", self._stats)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        ports = []
+        for port in (rpc_port, api_port):
+            site = web.TCPSite(self._runner, host, port)
+            await site.start()
+            ports.append(site._server.sockets[0].getsockname()[1])
+        self.rpc_url = "http://{}:{}/".format(host, ports[0])
+        api_url = "http://{}:{}".format(host, ports[1])
+        self.price_url = api_url + "/coin/price"
+        self.pairs_url = api_url + "/pairs"
+        return self.rpc_url, self.price_url, self.pairs_url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def serve(options: dict, urls=None):
+    """
+    Run a MockCluster until the process is terminated, e.g. as the target of a multiprocessing.Process so that the
+    mock does not share the CPU time and memory of the process being measured.
+    :param options: MockCluster and start() keyword arguments
+    :param urls: multiprocessing queue receiving the endpoint URLs once the mock listens
+    :return:
+    """
+    start_options = {x: options.pop(x) for x in ("host", "rpc_port", "api_port") if x in options}
+
+    async def run():
+        cluster = MockCluster(**options)
+        endpoints = await cluster.start(**start_options)
+        if urls is not None:
+            urls.put(endpoints)
+        else:
+            print("Solana RPC: {}\nPrice API: {}\nPairs API: {}".format(*endpoints))
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--rpc-port", type=int, default=8899)
+    parser.add_argument("--api-port", type=int, default=8900)
+    add_cluster_arguments(parser)
+    args = parser.parse_args()
+    serve(dict(host=args.host, rpc_port=args.rpc_port, api_port=args.api_port, **cluster_options(args)))
+
+
+def add_cluster_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--stakers", type=int, default=100000,
+                        help="user stake accounts of the RAY pool and of every fusion pool")
+    parser.add_argument("--holders", type=int, default=10000, help="token accounts of the synthetic token mint")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, up to this many seconds")
+    parser.add_argument("--rate-limit", type=float, help="requests per second per service before 429 responses")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--pools", type=int, default=0, help="AMM pools added to the pools of the resources files")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def cluster_options(args) -> dict:
+    return {
+        "stakers": args.stakers,
+        "holders": args.holders,
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "rate_limit": args.rate_limit,
+        "error_rate": args.error_rate,
+        "seed": args.seed,
+        "pools": args.pools
+    }
+
+
+if __name__ == '__main__':
+    main()
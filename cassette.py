@@ -0,0 +1,191 @@
+"""
+Record / replay cassettes of API calls, to run the scraper offline.
+
+In record mode every request / response pair is appended to the cassette file, with the response compressed. In
+replay mode responses are served from the cassette instead of the network. The lookup goes through an index of
+key hashes, which is memory-mapped and binary-searched, so nothing is parsed up front however large the cassette
+is. Requests are keyed by method and params (the JSON RPC id is ignored). The n-th replay of a key returns the
+n-th recorded response of that key, so cassettes recorded over many cycles replay them in order. Once the recorded
+responses of a key run out, its last response keeps being returned.
+
+File format: a magic line, then one record per call: key length and value length (little endian uint32), the key
+(canonical JSON of [method, params]) and the zlib compressed response body. The index (<cassette>.idx.npy) is
+derived from the cassette file, and is rebuilt whenever it is missing or out of date.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+from typing import Optional
+
+import numpy as np
+
+from json_codec import JSONCodec, get_codec
+
+
+RECORD = "record"
+REPLAY = "replay"
+MAGIC = b"RAYCASSETTE1\n"
+_RECORD_HEADER = struct.Struct("<II")
+INDEX_DTYPE = np.dtype([
+    ("hash", "<u8"),
+    ("sequence", "<u4"),
+    ("offset", "<u8"),
+    ("key_length", "<u4"),
+    ("value_length", "<u4")
+])
+
+
+def cassette_key(method: str, params) -> bytes:
+    """
+    Canonical key of a call.
+    :param method: JSON RPC method, or HTTP method for plain HTTP calls
+    :param params: JSON RPC params, or the URL for plain HTTP calls
+    :return:
+    """
+    return json.dumps([method, params], sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def _key_hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class Cassette:
+    """
+    Cassette file in record or replay mode.
+    """
+    def __init__(self, path: str, mode: str = REPLAY, compression_level: int = 6):
+        """
+        :param path: cassette file
+        :param mode: 'record' appends the calls made to the file, 'replay' serves them from it
+        :param compression_level: zlib level of recorded responses
+        """
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("Unsupported cassette mode '{}'. Must be '{}' or '{}'.".format(mode, RECORD, REPLAY))
+        self.path = path
+        self.index_path = path + ".idx.npy"
+        self.mode = mode
+        self.compression_level = compression_level
+        self.recorded = 0
+        self.replayed = 0
+        self._file = None
+        self._data = None
+        self._index = None
+        self._replays = {}
+
+        if mode == RECORD:
+            exists = os.path.exists(path) and os.path.getsize(path) > 0
+            self._file = open(path, "ab")
+            if not exists:
+                self._file.write(MAGIC)
+        else:
+            self._open_replay()
+
+    # Recording
+
+    def record(self, key: bytes, response: bytes):
+        """
+        Append a call to the cassette.
+        :param key: cassette_key of the request
+        :param response: response body
+        :return:
+        """
+        value = zlib.compress(response, self.compression_level)
+        self._file.write(_RECORD_HEADER.pack(len(key), len(value)) + key + value)
+        self.recorded += 1
+
+    # Replaying
+
+    def _open_replay(self):
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a cassette file.".format(self.path))
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if not os.path.exists(self.index_path) or os.path.getmtime(self.index_path) < os.path.getmtime(self.path):
+            self.build_index()
+        self._index = np.load(self.index_path, mmap_mode="r")
+
+    def build_index(self):
+        """
+        Scan the cassette file and write its index, sorted by key hash then recording order.
+        :return:
+        """
+        with open(self.path, "rb") as f:
+            data = f.read()
+        entries = []
+        sequences = {}
+        offset = len(MAGIC)
+        while offset + _RECORD_HEADER.size <= len(data):
+            key_length, value_length = _RECORD_HEADER.unpack_from(data, offset)
+            end = offset + _RECORD_HEADER.size + key_length + value_length
+            if end > len(data):
+                # Truncated last record of an interrupted recording
+                break
+            key_hash = _key_hash(data[offset + _RECORD_HEADER.size:offset + _RECORD_HEADER.size + key_length])
+            sequence = sequences.get(key_hash, 0)
+            sequences[key_hash] = sequence + 1
+            entries.append((key_hash, sequence, offset, key_length, value_length))
+            offset = end
+
+        index = np.array(entries, dtype=INDEX_DTYPE)
+        index.sort(order=["hash", "sequence"])
+        tmp_path = self.index_path + ".tmp.npy"
+        np.save(tmp_path, index)
+        os.replace(tmp_path, self.index_path)
+
+    def replay(self, key: bytes) -> bytes:
+        """
+        Next recorded response of a request.
+        :param key: cassette_key of the request
+        :return: response body
+        """
+        key_hash = _key_hash(key)
+        lo = int(np.searchsorted(self._index["hash"], key_hash, side="left"))
+        hi = int(np.searchsorted(self._index["hash"], key_hash, side="right"))
+        # Entries of colliding keys share the hash: keep the ones whose key matches
+        matches = [i for i in range(lo, hi) if self._key_at(i) == key]
+        if not matches:
+            raise ValueError("Request not found in cassette {}: {}".format(self.path, key.decode('utf-8')))
+
+        count = self._replays.get(key, 0)
+        self._replays[key] = count + 1
+        entry = self._index[matches[min(count, len(matches) - 1)]]
+        start = int(entry["offset"]) + _RECORD_HEADER.size + int(entry["key_length"])
+        self.replayed += 1
+        return zlib.decompress(self._data[start:start + int(entry["value_length"])])
+
+    def _key_at(self, position: int) -> bytes:
+        entry = self._index[position]
+        start = int(entry["offset"]) + _RECORD_HEADER.size
+        return self._data[start:start + int(entry["key_length"])]
+
+    # Both modes
+
+    async def call(self, key: bytes, request, codec: Optional[JSONCodec] = None):
+        """
+        Replay a call, or make and record it.
+        :param key: cassette_key of the request
+        :param request: coroutine function making the request, returning the decoded response
+        :param codec: JSON backend of the recorded bodies
+        :return: decoded response
+        """
+        codec = codec or get_codec()
+        if self.mode == REPLAY:
+            return codec.loads(self.replay(key))
+        response = await request()
+        self.record(key, codec.dumps(response))
+        return response
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.build_index()
+        if self._data is not None:
+            self._index = None
+            self._data.close()
+            self._data = None
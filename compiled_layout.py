@@ -0,0 +1,159 @@
+"""
+Precompiled decoders built from the construct layouts in stake_layout.
+
+construct parses every field of a layout, including the ones never read (e.g. the 128 orders and client ids of an
+open orders account). A compiled layout instead reads only the requested fields, in one struct.unpack_from call on
+the account buffer, at offsets computed once from the layout definition.
+"""
+
+import struct
+from collections import namedtuple
+
+import numpy as np
+from construct import Bytes, FormatField
+
+from stake_layout import STAKE_INFO_LAYOUT_V4, STAKE_INFO_LAYOUT, OPEN_ORDERS_LAYOUT
+from stake_layout import USER_STAKE_INFO_ACCOUNT_LAYOUT, USER_STAKE_INFO_ACCOUNT_LAYOUT_V4
+from stake_layout import USER_STAKE_INFO_ACCOUNT_LAYOUT_V5
+from stake_layout import SPL_ACCOUNT_LAYOUT, SPL_MINT_LAYOUT, LIQUIDITY_STATE_LAYOUT_V4
+from user_types import DataSliceOpts
+
+
+class CompiledLayout:
+    """
+    Decoder of selected fields of a construct Struct.
+
+    Integer fields (FormatField) decode to int and Bytes fields to bytes. parse() returns a namedtuple, so the
+    decoded fields are read with the same attribute names as the construct Container. dtype() gives the equivalent
+    NumPy structured dtype, to decode many accounts at once.
+    """
+    def __init__(self, layout, *fields: str):
+        self.layout = layout
+        self.fields = fields
+        self.offsets = {}
+        self.sizes = {}
+
+        offset = 0
+        formats = {}
+        for subcon in layout.subcons:
+            size = subcon.sizeof()
+            if subcon.name is not None:
+                self.offsets[subcon.name] = offset
+                self.sizes[subcon.name] = size
+                if subcon.name in fields:
+                    formats[subcon.name] = self._field_format(subcon)
+            offset += size
+        self.size = offset
+
+        missing = [x for x in fields if x not in formats]
+        if missing:
+            raise ValueError("Unknown layout fields: {}.".format(", ".join(missing)))
+
+        # One format string covering the requested fields in layout order, skipping everything in between
+        fmt = "<"
+        position = 0
+        names = sorted(fields, key=lambda x: self.offsets[x])
+        for name in names:
+            fmt += "{}x".format(self.offsets[name] - position) if self.offsets[name] > position else ""
+            fmt += formats[name]
+            position = self.offsets[name] + self.sizes[name]
+        self._formats = formats
+        self._struct = struct.Struct(fmt)
+        self._tuple = namedtuple("Decoded", names)
+        self._dtypes = {}
+
+        # Smallest byte range holding every requested field, e.g. for dataSlice requests
+        self.window_offset = self.offsets[names[0]]
+        self.window_length = position - self.window_offset
+
+    @staticmethod
+    def _field_format(subcon) -> str:
+        inner = subcon.subcon
+        if isinstance(inner, FormatField):
+            return inner.fmtstr.lstrip("<>=!@")
+        if isinstance(inner, Bytes) and isinstance(inner.length, int):
+            return "{}s".format(inner.length)
+        raise ValueError("Field '{}' of type {} cannot be compiled.".format(subcon.name, type(inner).__name__))
+
+    def sizeof(self) -> int:
+        """
+        Size of the full layout, e.g. for dataSize filters.
+        """
+        return self.size
+
+    def data_slice(self):
+        """
+        dataSlice option returning only the requested fields of each account.
+        :return:
+        """
+        return DataSliceOpts(self.window_offset, self.window_length)
+
+    def dtype(self, sliced: bool = False) -> np.dtype:
+        """
+        NumPy structured dtype of the requested fields.
+
+        Integer fields map to little endian integers and Bytes fields to uint8 sub-arrays, so that raw keys can be
+        compared byte-wise and turned back into bytes with tobytes().
+        :param sliced: describe the data_slice() window instead of the full layout
+        :return:
+        """
+        if sliced not in self._dtypes:
+            names = list(self._tuple._fields)
+            formats = [("u1", (self.sizes[x],)) if self._formats[x].endswith("s") else "<" + self._formats[x]
+                       for x in names]
+            base = self.window_offset if sliced else 0
+            self._dtypes[sliced] = np.dtype({
+                "names": names,
+                "formats": formats,
+                "offsets": [self.offsets[x] - base for x in names],
+                "itemsize": self.window_length if sliced else self.size
+            })
+        return self._dtypes[sliced]
+
+    def parse_many(self, buffer, sliced: bool = False) -> np.ndarray:
+        """
+        Decode consecutive accounts without copying the buffer.
+        :param buffer: concatenated account data
+        :param sliced: the buffer holds data_slice() windows instead of full accounts
+        :return: structured array with one record per account
+        """
+        return np.frombuffer(buffer, dtype=self.dtype(sliced))
+
+    def parse(self, data):
+        """
+        Decode the requested fields of an account.
+        :param data: account data (bytes, bytearray or memoryview)
+        :return: namedtuple of the requested fields
+        """
+        return self._tuple._make(self._struct.unpack_from(data, 0))
+
+
+_COMPILED = {}
+
+
+def compile_layout(layout, *fields: str) -> CompiledLayout:
+    """
+    Get the compiled decoder of some fields of a layout, built on first use.
+    :param layout: construct Struct from stake_layout
+    :param fields: names of the fields to decode
+    :return:
+    """
+    key = (id(layout), fields)
+    if key not in _COMPILED:
+        _COMPILED[key] = CompiledLayout(layout, *fields)
+    return _COMPILED[key]
+
+
+STAKE_INFO_V4_DECODER = compile_layout(STAKE_INFO_LAYOUT_V4, "perBlock", "perBlockB")
+STAKE_INFO_DECODER = compile_layout(STAKE_INFO_LAYOUT, "rewardPerBlock")
+OPEN_ORDERS_DECODER = compile_layout(OPEN_ORDERS_LAYOUT, "base_token_total", "quote_token_total")
+USER_STAKE_INFO_DECODER = compile_layout(USER_STAKE_INFO_ACCOUNT_LAYOUT, "poolId", "stakerOwner", "depositBalance")
+USER_STAKE_INFO_V4_DECODER = compile_layout(USER_STAKE_INFO_ACCOUNT_LAYOUT_V4, "poolId", "stakerOwner",
+                                            "depositBalance")
+USER_STAKE_INFO_V5_DECODER = compile_layout(USER_STAKE_INFO_ACCOUNT_LAYOUT_V5, "poolId", "stakerOwner",
+                                            "depositBalance")
+SPL_ACCOUNT_DECODER = compile_layout(SPL_ACCOUNT_LAYOUT, "mint", "owner", "amount")
+SPL_MINT_DECODER = compile_layout(SPL_MINT_LAYOUT, "supply", "decimals")
+AMM_INFO_V4_DECODER = compile_layout(LIQUIDITY_STATE_LAYOUT_V4, "status", "coinDecimals", "pcDecimals",
+                                     "poolCoinTokenAccount", "poolPcTokenAccount", "coinMintAddress", "pcMintAddress",
+                                     "lpMintAddress", "ammOpenOrders", "serumMarket")
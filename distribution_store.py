@@ -0,0 +1,380 @@
+"""
+Delta-encoded store of staker and holder distribution snapshots.
+
+Successive scans of a distribution (the stakers of a pool, the holders of a token) are mostly identical. The store
+keeps each distribution, keyed by "program/pool", as a chain: the first scan is written whole as a base snapshot
+(owner keys sorted as 32 byte strings, with their raw amounts summed per owner), and every later scan only as its
+delta against the previous one: the owners added, removed or changed, each with its amount before and after. Deltas
+are found by a sorted merge of the two owner arrays (binary search of one in the other), without building any
+per-owner dict.
+
+A snapshot at any slot is rebuilt from the closest base at or before it and the deltas after that base. A new base
+is written once the deltas since the last one hold rebase_fraction of its rows, or rebase_every deltas, so a rebuild
+never replays a long chain. Flows over a slot range (who entered, exited or moved, and by how much) are read from
+the deltas of that range alone, as the first "before" and last "after" amount of every owner they touch.
+
+Like TimeSeriesStore, every snapshot is a directory of .npy columns listed in a JSON manifest replaced atomically,
+and reads memory-map the columns.
+"""
+
+import json
+import os
+import shutil
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import base58
+import numpy as np
+
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+KEY_SIZE = 32
+# Owner keys as comparable, sortable 32 byte strings
+KEY_DTYPE = np.dtype("S{}".format(KEY_SIZE))
+
+
+def _encode(keys: np.ndarray) -> List[str]:
+    rows = np.ascontiguousarray(keys).view(np.uint8).reshape(-1, KEY_SIZE)
+    return [base58.b58encode(x.tobytes()).decode('utf-8') for x in rows]
+
+
+def sorted_distribution(owners: np.ndarray, amounts: np.ndarray):
+    """
+    Owner keys sorted, with the amounts of each owner summed. Zero amounts are dropped.
+    :param owners: (n, 32) uint8 array of owner public keys, e.g. decoded stakerOwner column
+    :param amounts: n raw (integer) amounts
+    :return: sorted owner keys (32 byte strings) and their uint64 amounts
+    """
+    mask = amounts > 0
+    keys = np.ascontiguousarray(owners[mask]).view(KEY_DTYPE).ravel()
+    amounts = np.asarray(amounts[mask], dtype=np.uint64)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    if not len(keys):
+        return keys, amounts
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(amounts[order], starts)
+
+
+def _lookup(keys: np.ndarray, sorted_keys: np.ndarray):
+    """
+    Binary search of keys in sorted keys.
+    :return: index of each key in sorted_keys (clipped), and whether it was found
+    """
+    index = np.searchsorted(sorted_keys, keys)
+    index = np.minimum(index, max(len(sorted_keys) - 1, 0))
+    found = sorted_keys[index] == keys if len(sorted_keys) else np.zeros(len(keys), dtype=bool)
+    return index, found
+
+
+class Snapshot(NamedTuple):
+    """
+    One scan of a distribution.
+    """
+    slot: int
+    timestamp: float
+    decimals: int
+    owners: np.ndarray
+    amounts: np.ndarray
+
+    def __len__(self):
+        return len(self.owners)
+
+    def distribution(self, label: str) -> dict:
+        """
+        Owners and UI amounts, in the format of RaydiumPoolInfo.stake_distribution.
+        :param label: name of the amount column
+        """
+        return {"publicKey": _encode(self.owners), label: (self.amounts / pow(10, self.decimals)).tolist()}
+
+
+class DistributionDelta(NamedTuple):
+    """
+    Changes of a distribution between two slots: the owners whose amount changed, sorted, and their raw amounts
+    before and after. A zero amount before means the owner entered, a zero amount after that it exited.
+    """
+    start_slot: int
+    end_slot: int
+    decimals: int
+    owners: np.ndarray
+    before: np.ndarray
+    after: np.ndarray
+
+    def __len__(self):
+        return len(self.owners)
+
+    @property
+    def entered(self) -> List[str]:
+        return _encode(self.owners[self.before == 0])
+
+    @property
+    def exited(self) -> List[str]:
+        return _encode(self.owners[self.after == 0])
+
+    @property
+    def changed(self) -> List[str]:
+        return _encode(self.owners[(self.before > 0) & (self.after > 0)])
+
+    @property
+    def inflow(self) -> float:
+        """
+        UI amount deposited over the range, by the owners whose amount grew.
+        """
+        grew = self.after > self.before
+        return float((self.after[grew] - self.before[grew]).sum()) / pow(10, self.decimals)
+
+    @property
+    def outflow(self) -> float:
+        """
+        UI amount withdrawn over the range, by the owners whose amount shrank.
+        """
+        shrank = self.after < self.before
+        return float((self.before[shrank] - self.after[shrank]).sum()) / pow(10, self.decimals)
+
+    @property
+    def net_flow(self) -> float:
+        return self.inflow - self.outflow
+
+
+def diff_distributions(owners: np.ndarray, amounts: np.ndarray, new_owners: np.ndarray,
+                       new_amounts: np.ndarray):
+    """
+    Sorted merge of two distributions.
+    :param owners: sorted owner keys of the old distribution
+    :param amounts: their amounts
+    :param new_owners: sorted owner keys of the new distribution
+    :param new_amounts: their amounts
+    :return: sorted owner keys whose amount changed, their amounts before and after
+    """
+    index, found = _lookup(new_owners, owners)
+    before = np.zeros(len(new_owners), dtype=np.uint64)
+    before[found] = amounts[index[found]]
+    changed = before != new_amounts
+    _, kept = _lookup(owners, new_owners)
+
+    delta_owners = np.concatenate((new_owners[changed], owners[~kept]))
+    delta_before = np.concatenate((before[changed], amounts[~kept]))
+    delta_after = np.concatenate((new_amounts[changed], np.zeros((~kept).sum(), dtype=np.uint64)))
+    order = np.argsort(delta_owners, kind="stable")
+    return delta_owners[order], delta_before[order], delta_after[order]
+
+
+def apply_delta(owners: np.ndarray, amounts: np.ndarray, delta_owners: np.ndarray, delta_after: np.ndarray):
+    """
+    Apply a delta to a distribution.
+    :param owners: sorted owner keys
+    :param amounts: their amounts
+    :param delta_owners: sorted owner keys of the delta
+    :param delta_after: their amounts after the delta
+    :return: sorted owner keys and amounts
+    """
+    index, found = _lookup(delta_owners, owners)
+    keep = np.ones(len(owners), dtype=bool)
+    keep[index[found]] = False
+    present = delta_after > 0
+    owners = np.concatenate((owners[keep], delta_owners[present]))
+    amounts = np.concatenate((amounts[keep], delta_after[present]))
+    order = np.argsort(owners, kind="stable")
+    return owners[order], amounts[order]
+
+
+class DistributionStore:
+    """
+    Delta-encoded snapshots of distributions, with a single writer.
+    """
+    def __init__(self, path: str, rebase_every: int = 168, rebase_fraction: float = 0.5):
+        """
+        :param path: store directory, created if needed
+        :param rebase_every: deltas after which a new base snapshot is written
+        :param rebase_fraction: delta rows, as a fraction of the base rows, after which a new base snapshot is written
+        """
+        if rebase_every < 1:
+            raise ValueError("rebase_every must be at least 1.")
+        self.path = path
+        self.rebase_every = rebase_every
+        self.rebase_fraction = rebase_fraction
+        # Latest snapshot of each distribution written or read by this process, the base of the next delta
+        self._latest: Dict[str, Snapshot] = {}
+        os.makedirs(path, exist_ok=True)
+        self._manifest = self._read_manifest()
+
+    # Manifest
+
+    def _read_manifest(self) -> dict:
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return {"version": MANIFEST_VERSION, "next_entry": 0, "distributions": {}}
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError("Unsupported distribution store version {}.".format(manifest.get("version")))
+        return manifest
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, manifest_path)
+
+    @property
+    def keys(self) -> List[str]:
+        return list(self._manifest["distributions"])
+
+    def scans(self, key: str) -> List[dict]:
+        """
+        Scans of a distribution, in slot order: slot, timestamp and number of owners changed since the previous scan.
+        """
+        return [{"slot": x["slot"], "timestamp": x["timestamp"], "rows": x["rows"]}
+                for x in self._distribution(key)["deltas"]]
+
+    def slot_at(self, key: str, timestamp: float) -> Optional[int]:
+        """
+        Slot of the last scan of a distribution at or before a UNIX time, None if there is none.
+        """
+        slots = [x["slot"] for x in self._distribution(key)["deltas"] if x["timestamp"] <= timestamp]
+        return slots[-1] if slots else None
+
+    def _distribution(self, key: str) -> dict:
+        distribution = self._manifest["distributions"].get(key)
+        if distribution is None:
+            raise ValueError("Unknown distribution {}.".format(key))
+        return distribution
+
+    # Writing
+
+    def _write_entry(self, columns: Dict[str, np.ndarray], slot: int, timestamp: float) -> dict:
+        name = "entry-{:08d}".format(self._manifest["next_entry"])
+        self._manifest["next_entry"] += 1
+        entry_path = os.path.join(self.path, name)
+        if os.path.exists(entry_path):
+            # Left over by a write interrupted before the manifest listed it
+            shutil.rmtree(entry_path)
+        os.makedirs(entry_path)
+        for column, values in columns.items():
+            with open(os.path.join(entry_path, column + ".npy"), "wb") as f:
+                np.save(f, values)
+                f.flush()
+                os.fsync(f.fileno())
+        return {"name": name, "slot": slot, "timestamp": timestamp, "rows": len(columns["owners"])}
+
+    def append(self, key: str, slot: int, owners: np.ndarray, amounts: np.ndarray, decimals: int,
+               timestamp: Optional[float] = None) -> DistributionDelta:
+        """
+        Record a scan of a distribution.
+        :param key: distribution, e.g. "<stake program>/<stake pool>"
+        :param slot: slot of the scan, greater than the slot of the previous scan
+        :param owners: (n, 32) uint8 array of owner public keys, owners of several accounts may repeat
+        :param amounts: n raw (integer) amounts
+        :param decimals: decimals of the amounts
+        :param timestamp: UNIX time of the scan, now by default
+        :return: changes since the previous scan, every owner entering on the first scan
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        distributions = self._manifest["distributions"]
+        distribution = distributions.setdefault(key, {"decimals": decimals, "bases": [], "deltas": []})
+        if distribution["deltas"] and slot <= distribution["deltas"][-1]["slot"]:
+            raise ValueError("Slots must increase.")
+
+        new_owners, new_amounts = sorted_distribution(owners, amounts)
+        if distribution["deltas"]:
+            latest = self._latest.get(key) or self.snapshot(key)
+            start_slot = latest.slot
+            delta = diff_distributions(latest.owners, latest.amounts, new_owners, new_amounts)
+        else:
+            start_slot = -1
+            delta = (new_owners, np.zeros(len(new_owners), dtype=np.uint64), new_amounts)
+
+        columns = dict(zip(("owners", "before", "after"), delta))
+        distribution["deltas"].append(self._write_entry(columns, slot, timestamp))
+
+        # The first scan is a base, later ones once the chain of deltas since the last base grows long
+        bases = distribution["bases"]
+        chain = [x for x in distribution["deltas"] if not bases or x["slot"] > bases[-1]["slot"]]
+        if not bases or len(chain) >= self.rebase_every or \
+                sum(x["rows"] for x in chain) > self.rebase_fraction * max(bases[-1]["rows"], 1):
+            bases.append(self._write_entry({"owners": new_owners, "amounts": new_amounts}, slot, timestamp))
+        distribution["decimals"] = decimals
+        self._write_manifest()
+
+        self._latest[key] = Snapshot(slot, timestamp, decimals, new_owners, new_amounts)
+        return DistributionDelta(start_slot, slot, decimals, *delta)
+
+    # Reading
+
+    def _column(self, entry: dict, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, entry["name"], name + ".npy"), mmap_mode="r")
+
+    def snapshot(self, key: str, slot: Optional[int] = None) -> Snapshot:
+        """
+        Rebuild a distribution as of its last scan at or before a slot.
+        :param key: distribution
+        :param slot: slot, the latest scan by default
+        :return:
+        """
+        distribution = self._distribution(key)
+        bases = [x for x in distribution["bases"] if slot is None or x["slot"] <= slot]
+        if not bases:
+            raise ValueError("No scan of {} at or before slot {}.".format(key, slot))
+        base = bases[-1]
+        owners, amounts = self._column(base, "owners"), self._column(base, "amounts")
+        last = base
+        for entry in distribution["deltas"]:
+            if entry["slot"] <= base["slot"] or (slot is not None and entry["slot"] > slot):
+                continue
+            owners, amounts = apply_delta(owners, amounts, self._column(entry, "owners"),
+                                          self._column(entry, "after"))
+            last = entry
+        return Snapshot(last["slot"], last["timestamp"], distribution["decimals"], owners, amounts)
+
+    def iter_deltas(self, key: str, start_slot: Optional[int] = None,
+                    end_slot: Optional[int] = None) -> Iterator[DistributionDelta]:
+        """
+        Memory-mapped deltas of the scans in (start_slot, end_slot].
+        :param key: distribution
+        :param start_slot: first slot, exclusive
+        :param end_slot: last slot, inclusive
+        :return: iterator of DistributionDelta, one per scan
+        """
+        distribution = self._distribution(key)
+        previous = -1
+        for entry in distribution["deltas"]:
+            if (start_slot is None or entry["slot"] > start_slot) and (end_slot is None or entry["slot"] <= end_slot):
+                yield DistributionDelta(previous, entry["slot"], distribution["decimals"],
+                                        self._column(entry, "owners"), self._column(entry, "before"),
+                                        self._column(entry, "after"))
+            previous = entry["slot"]
+
+    def flows(self, key: str, start_slot: Optional[int] = None, end_slot: Optional[int] = None) -> DistributionDelta:
+        """
+        Net changes of a distribution over (start_slot, end_slot], e.g. flows(key, slot).entered for the owners who
+        entered since a slot. Only the deltas of the range are read.
+        :param key: distribution
+        :param start_slot: first slot, exclusive
+        :param end_slot: last slot, inclusive
+        :return: owners whose amount differs between the two ends of the range, their amounts before and after
+        """
+        deltas = list(self.iter_deltas(key, start_slot, end_slot))
+        decimals = self._distribution(key)["decimals"]
+        if not deltas:
+            empty = np.zeros(0, dtype=np.uint64)
+            return DistributionDelta(start_slot if start_slot is not None else -1,
+                                     end_slot if end_slot is not None else -1, decimals,
+                                     np.zeros(0, dtype=KEY_DTYPE), empty, empty)
+
+        owners = np.concatenate([x.owners for x in deltas])
+        before = np.concatenate([x.before for x in deltas])
+        after = np.concatenate([x.after for x in deltas])
+        # Deltas are in slot order, so a stable sort keeps the changes of each owner in slot order
+        order = np.argsort(owners, kind="stable")
+        owners, before, after = owners[order], before[order], after[order]
+        boundaries = np.concatenate(([True], owners[1:] != owners[:-1], [True]))
+        first = np.flatnonzero(boundaries[:-1])
+        last = np.flatnonzero(boundaries[1:])
+        owners, before, after = owners[first], before[first], after[last]
+        moved = before != after
+        return DistributionDelta(deltas[0].start_slot, deltas[-1].end_slot, decimals,
+                                 owners[moved], before[moved], after[moved])
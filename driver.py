@@ -1,39 +1,281 @@
 import os
+import sys
+import time
+import argparse
 import aiohttp
 import asyncio
-from aiolimiter import AsyncLimiter
+from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from LPInfo import RaydiumPoolInfo
+from subscription import LiveAPR
+from rate_limit import TokenBucket
+from refresh_scheduler import AdaptiveRefresh
+from timeseries import TimeSeriesStore
+from query_server import SnapshotServer
+from cassette import Cassette, RECORD, REPLAY
+from instrumentation import get_instrumentation
+from pool_index import PoolDiscovery, PoolIndex
+from distribution_store import DistributionStore
 from pprint import pprint
 
-async def amain():
-    limiter = AsyncLimiter(15, 1)
 
-    task = []
-    async with aiohttp.ClientSession() as session:
-        async with limiter:
-            LP = RaydiumPoolInfo(session)
-            fee_apy_task = asyncio.create_task(LP.RAYDIUM.get_pair())
-            fee_apy = await fee_apy_task
+# Where the scraped results are stored
+TIMESERIES_PATH = "./data/timeseries"
+# Longest time in seconds results are buffered in memory before they are written to the store
+STORE_FLUSH_INTERVAL = 60
+# Port of the local query API serving the latest snapshot
+QUERY_SERVER_PORT = 8080
+# Index of the AMM pools found by --discover-pools
+POOL_INDEX_PATH = "./data/pools.idx"
+# Delta-encoded staker distributions recorded by --snapshot-distributions
+DISTRIBUTIONS_PATH = "./data/distributions"
 
-            for farm in LP.farms_info:
-                task.append(LP.get_APR(farm))
-            result = await asyncio.gather(*task)
+
+class RaydiumScraper:
+    """
+    Long-lived scraper service.
+
+    Owns one pooled keep-alive HTTP session and one RaydiumPoolInfo (with its static address and decimals index),
+    both built once in start() and reused by every cycle. Cycles never overlap: a cycle requested while another
+    one is still in flight is skipped.
+
+    With store_path set, every result is also appended to a TimeSeriesStore. With server_port set, the latest results
+    are served by a SnapshotServer in the same event loop. With pool_index_path set, the pools of that index are
+    added to the configured ones. With rpc_rate set, no Solana RPC endpoint is sent more requests per second.
+    """
+    def __init__(self, connection_limit: int = 100, connection_limit_per_host: int = 30,
+                 keepalive_timeout: float = 75, dns_cache_ttl: int = 300, store_path: Optional[str] = None,
+                 server_port: Optional[int] = None, cassette: Optional[Cassette] = None,
+                 pool_index_path: Optional[str] = None, rpc_rate: Optional[float] = None):
+        self._connector_options = {
+            "limit": connection_limit,
+            "limit_per_host": connection_limit_per_host,
+            "keepalive_timeout": keepalive_timeout,
+            "ttl_dns_cache": dns_cache_ttl
+        }
+        self._store_path = store_path
+        self._server_port = server_port
+        self._cassette = cassette
+        self._pool_index_path = pool_index_path
+        self._rpc_rate = rpc_rate
+        self.session = None
+        self.LP = None
+        self.store = None
+        self.server = None
+        self.cycles = 0
+        self.skipped_cycles = 0
+        self._cycle_running = False
+
+    async def start(self):
+        """
+        Open the pooled session and build the static index.
+        :return:
+        """
+        connector = aiohttp.TCPConnector(**self._connector_options)
+        self.session = aiohttp.ClientSession(connector=connector)
+        pool_index = PoolIndex.load(self._pool_index_path) if self._pool_index_path is not None else None
+        self.LP = RaydiumPoolInfo(self.session, cassette=self._cassette, pool_index=pool_index,
+                                  rpc_rate=self._rpc_rate)
+        if self._store_path is not None:
+            # Live and adaptive results arrive farm by farm, without a cycle to flush them
+            self.store = TimeSeriesStore(self._store_path, flush_interval=STORE_FLUSH_INTERVAL)
+        if self._server_port is not None:
+            self.server = SnapshotServer(port=self._server_port, metrics=self.metrics)
+            await self.server.start()
+
+    def metrics(self):
+        """
+        Scraper gauges for the /metrics endpoint.
+        :return:
+        """
+        return {
+            "raydium_scraper_cycles": self.cycles,
+            "raydium_scraper_skipped_cycles": self.skipped_cycles
+        }
+
+    async def close(self):
+        if self.server is not None:
+            await self.server.close()
+        if self.store is not None:
+            self.store.close()
+        if self.session is not None:
+            await self.session.close()
+        if self.LP is not None:
+            self.LP.analytics.close()
+
+    async def run_cycle(self):
+        """
+        Scrape every farm once.
+        :return: list of {farm: farm info} dicts, None if the cycle was skipped
+        """
+        if self._cycle_running:
+            self.skipped_cycles += 1
+            print('Previous cycle still running, skipping this one')
+            return None
+
+        self._cycle_running = True
+        try:
+            # The pairs snapshot is downloaded in the same wave as the reads of the cycle
+            fee_apy, result = await asyncio.gather(self.LP.RAYDIUM.get_pair(), self.LP.get_all_APR())
 
             for farm in result:
                 farm_name = list(farm.keys())[0]
                 farm[farm_name].update({"Fee_APR": fee_apy[farm_name]})
                 pprint(farm)
 
+            if self.store is not None:
+                self.store.append(time.time(), result)
+                self.store.flush()
+            if self.server is not None:
+                self.server.publish(result)
+            self.cycles += 1
+            return result
+        finally:
+            self._cycle_running = False
+
+    async def discover_pools(self, full: bool = False):
+        """
+        Refresh the pool index from the AMM program and print what changed.
+        :param full: re-read every pool instead of the new ones only
+        :return:
+        """
+        discovery = PoolDiscovery(self.LP.SOLANA, self._pool_index_path)
+        diff = await discovery.refresh(full)
+        print("{} pools indexed: {} added, {} removed, {} changed".format(
+            len(discovery.index), len(diff.added), len(diff.removed), len(diff.changed)))
+        for label, amm_ids in zip(("+", "-", "~"), diff):
+            for amm_id in amm_ids:
+                print(label, amm_id)
+
+    async def snapshot_distributions(self, path: str = DISTRIBUTIONS_PATH):
+        """
+        Record the RAY stakers and the LP stakers of the fusion farms, and print what changed since the last run.
+        :param path: distribution store directory
+        :return:
+        """
+        deltas = await self.LP.record_distribution_snapshots(DistributionStore(path))
+        for key, delta in deltas.items():
+            print("{}: {} entered, {} exited, {} changed, net flow {:+.6f}".format(
+                key, len(delta.entered), len(delta.exited), len(delta.changed), delta.net_flow))
+
+    async def _publish_farm(self, farm: str, farm_info: dict):
+        """
+        Print, store and serve the new result of one farm.
+        """
+        fee_apy = await self.LP.RAYDIUM.get_pair()
+        farm_info.update({"Fee_APR": fee_apy[farm]})
+        pprint({farm: farm_info})
+        if self.store is not None:
+            self.store.append(time.time(), [{farm: farm_info}])
+        if self.server is not None:
+            self.server.update([{farm: farm_info}])
+
+    async def run_live(self):
+        """
+        Live mode: follow the farm accounts through websocket subscriptions and print each farm as it changes,
+        instead of polling every farm once a minute.
+        :return:
+        """
+        await LiveAPR(self.LP, self.session, on_update=self._publish_farm).run()
+
+    async def run_adaptive(self, rpc_budget: float):
+        """
+        Adaptive mode: refresh each farm at its own interval, set by its liquidity and APR volatility, within an
+        RPC budget, instead of polling every farm once a minute.
+        :param rpc_budget: RPC requests per second spent on the refreshes
+        :return:
+        """
+        await AdaptiveRefresh(self.LP, TokenBucket(rpc_budget), on_update=self._publish_farm).run()
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Scrape Raydium farm APRs.")
+    parser.add_argument("--live", action="store_true", help="follow the farms through websocket subscriptions")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="refresh each farm at its own interval, set by its liquidity and APR volatility")
+    parser.add_argument("--rpc-budget", type=float, default=1.0, metavar="RATE",
+                        help="with --adaptive, RPC requests per second spent on the refreshes (default 1)")
+    parser.add_argument("--rpc-rate", type=float, metavar="RATE",
+                        help="highest RPC requests per second sent to each Solana endpoint, halved on 429 responses "
+                             "(default 10)")
+    parser.add_argument("--record", metavar="CASSETTE", help="record every API call to a cassette file")
+    parser.add_argument("--replay", metavar="CASSETTE", help="replay the API calls from a cassette file")
+    parser.add_argument("--cycles", type=int, help="run this many cycles back to back, then exit")
+    parser.add_argument("--instrument", action="store_true",
+                        help="record hot path latency histograms, served by /metrics")
+    parser.add_argument("--trace", metavar="FILE", help="also trace every span, written to FILE on exit")
+    parser.add_argument("--plan", action="store_true", help="print the planned requests of a cycle, then exit")
+    parser.add_argument("--discover-pools", action="store_true",
+                        help="refresh the index of the AMM pools from the chain, then exit")
+    parser.add_argument("--full", action="store_true", help="with --discover-pools, re-read every pool")
+    parser.add_argument("--snapshot-distributions", action="store_true",
+                        help="record the staker distributions as deltas since the last run, then exit")
+    args = parser.parse_args()
+
+    if args.plan:
+        # Dry run: planning reads the farm configuration only, no request is sent
+        print(RaydiumPoolInfo(None).plan_cycle().describe())
+        sys.exit()
+
+    instrumentation = get_instrumentation()
+    if args.instrument or args.trace:
+        instrumentation.enable(trace=args.trace is not None)
+
+    cassette = None
+    if args.record or args.replay:
+        cassette = Cassette(args.record or args.replay, RECORD if args.record else REPLAY)
+
+    # Only the long-running modes (scheduler, --live, --adaptive) store and serve their results. One-shot runs, e.g.
+    # from cron next to a running service, must not compete with it for the query port or the single-writer store.
+    one_shot = args.discover_pools or args.snapshot_distributions or \
+        (args.cycles is not None and not (args.live or args.adaptive))
+    # Replayed results are past data, never appended to the history under the current time
+    replay = args.replay is not None
+    loop = asyncio.get_event_loop()
+    scraper = RaydiumScraper(store_path=None if one_shot or replay else TIMESERIES_PATH,
+                             server_port=None if one_shot else QUERY_SERVER_PORT, cassette=cassette,
+                             pool_index_path=POOL_INDEX_PATH, rpc_rate=args.rpc_rate)
+    loop.run_until_complete(scraper.start())
+
+    if args.live or args.adaptive or args.cycles is not None or args.discover_pools \
+            or args.snapshot_distributions:
+        try:
+            if args.discover_pools:
+                loop.run_until_complete(scraper.discover_pools(args.full))
+            elif args.snapshot_distributions:
+                loop.run_until_complete(scraper.snapshot_distributions())
+            elif args.live:
+                loop.run_until_complete(scraper.run_live())
+            elif args.adaptive:
+                loop.run_until_complete(scraper.run_adaptive(args.rpc_budget))
+            else:
+                for _ in range(args.cycles):
+                    loop.run_until_complete(scraper.run_cycle())
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            loop.run_until_complete(scraper.close())
+            if cassette is not None:
+                cassette.close()
+            if args.trace:
+                instrumentation.write_trace(args.trace)
+        sys.exit()
+
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(amain, 'cron', minute='*')
+    # Coalesce missed runs and never stack a run on top of one still in flight
+    scheduler.add_job(scraper.run_cycle, 'cron', minute='*', max_instances=1, coalesce=True)
     scheduler.start()
     print('Press Ctrl+{0} to exit'.format('Break' if os.name == 'nt' else 'C'))
 
     # Execution will block here until Ctrl+C (Ctrl+Break on Windows) is pressed.
     try:
-        asyncio.get_event_loop().run_forever()
+        loop.run_forever()
     except (KeyboardInterrupt, SystemExit):
-        pass
\ No newline at end of file
+        pass
+    finally:
+        scheduler.shutdown(wait=False)
+        loop.run_until_complete(scraper.close())
+        if cassette is not None:
+            cassette.close()
+        if args.trace:
+            instrumentation.write_trace(args.trace)
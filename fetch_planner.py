@@ -0,0 +1,122 @@
+"""
+Fetch planner of the APR cycle.
+
+Every account read by the farms of a cycle is known up front from the farm configuration: the pool vaults, LP mint
+and open orders of each LP, and the stake pool and staked LP account of each farm. None of these reads depends on
+another, so the plan issues them all in a single wave (chunked getMultipleAccounts calls and the Raydium price
+snapshot, all concurrent), then computes every farm from the results without further I/O. A cycle therefore takes
+about one round trip plus compute, whatever the number of farms.
+
+Accounts shared by several farms are read once. describe() prints the planned request graph, for dry runs.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+# Accounts read for every farm, in read order: (role, where the address comes from, its key there)
+FARM_READS = [
+    ("coin_vault", "LP_addresses", "coin_in_pool_address"),
+    ("pc_vault", "LP_addresses", "pc_in_pool_address"),
+    ("lp_mint", "LP_addresses", "lp_mint_address"),
+    ("open_orders", "LP_addresses", "pool_amm_address"),
+    ("stake_pool", "farms_info", "poolId"),
+    ("staked_lp", "farms_info", "poolLpTokenAccount")
+]
+PRICE_REQUEST = "GET /coin/price"
+
+
+class PlannedRead(NamedTuple):
+    """
+    One account of the cycle and the farms it is read for.
+    """
+    address: str
+    role: str
+    farms: Tuple[str, ...]
+
+
+class PlannedRequest(NamedTuple):
+    """
+    One request of the fetch wave.
+    """
+    method: str
+    addresses: Tuple[str, ...]
+
+
+class FetchPlan(NamedTuple):
+    """
+    Reads and requests of a cycle. The requests form a single concurrent wave, followed by the compute step of
+    every farm.
+    """
+    farms: List[str]
+    reads: List[PlannedRead]
+    requests: List[PlannedRequest]
+    farm_reads: Dict[str, List[str]]
+    chunk_size: int
+
+    @classmethod
+    def from_config(cls, farms_info: dict, LP_addresses: dict, farms: Optional[List[str]] = None,
+                    chunk_size: int = 100) -> 'FetchPlan':
+        """
+        Plan the reads of some farms from RaydiumPoolInfo.farms_info and RaydiumPoolInfo.LP_addresses.
+        :param farms_info: farm name -> farm configuration
+        :param LP_addresses: farm name -> addresses of the LP
+        :param farms: farm names, all farms by default
+        :param chunk_size: accounts per getMultipleAccounts call
+        :return:
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1.")
+        farms = list(farms or farms_info)
+        sources = {"farms_info": farms_info, "LP_addresses": LP_addresses}
+        roles = {}
+        consumers = {}
+        farm_reads = {}
+        for farm in farms:
+            farm_reads[farm] = []
+            for role, source, key in FARM_READS:
+                address = sources[source][farm][key]
+                roles.setdefault(address, role)
+                consumers.setdefault(address, [])
+                if farm not in consumers[address]:
+                    consumers[address].append(farm)
+                farm_reads[farm].append(address)
+
+        reads = [PlannedRead(address, roles[address], tuple(consumers[address])) for address in consumers]
+        addresses = [x.address for x in reads]
+        requests = [PlannedRequest("getMultipleAccounts", tuple(addresses[i:i + chunk_size]))
+                    for i in range(0, len(addresses), chunk_size)]
+        requests.append(PlannedRequest(PRICE_REQUEST, ()))
+        return cls(farms=farms, reads=reads, requests=requests, farm_reads=farm_reads, chunk_size=chunk_size)
+
+    @property
+    def addresses(self) -> List[str]:
+        """
+        Every account of the plan, each once, in read order.
+        """
+        return [x.address for x in self.reads]
+
+    def describe(self) -> str:
+        """
+        Text rendering of the request graph, e.g. for a dry run.
+        """
+        shared = [x for x in self.reads if len(x.farms) > 1]
+        lines = [
+            "Fetch plan: {} farms, {} accounts ({} shared by several farms)".format(
+                len(self.farms), len(self.reads), len(shared)),
+            "Wave 1: {} concurrent requests".format(len(self.requests))
+        ]
+        for i, request in enumerate(self.requests):
+            if request.addresses:
+                lines.append("  [{}] {} ({} accounts)".format(i, request.method, len(request.addresses)))
+            else:
+                lines.append("  [{}] {}".format(i, request.method))
+
+        request_of = {address: i for i, request in enumerate(self.requests) for address in request.addresses}
+        price_request = len(self.requests) - 1
+        roles = {x.address: x.role for x in self.reads}
+        lines.append("Wave 2: compute {} farms, no I/O".format(len(self.farms)))
+        for farm in self.farms:
+            lines.append("  {} <- [{}] price".format(farm, price_request))
+            for address in self.farm_reads[farm]:
+                lines.append("      <- [{}] {:<12} {}".format(request_of[address], roles[address], address))
+        return "\n".join(lines)
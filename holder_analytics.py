@@ -0,0 +1,215 @@
+"""
+Holder concentration analytics of the distribution scans.
+
+A scan (the user stake accounts of a farm, or the token accounts of a mint) can hold millions of rows. Summarizing
+it in the event loop would stall every other request of the scraper, so DistributionAnalytics hands the decoded
+account buffer of each scan to a process pool: the buffer is copied once into shared memory, instead of being pickled,
+and the worker views it with the structured dtype of the layout, filters it, sums the amounts per owner and returns a
+HolderStats of a few hundred bytes: holder count, total, Gini coefficient, Herfindahl-Hirschman index, whale share
+and the sorted top holders. Concurrent scans are summarized on as many cores as the pool has workers.
+
+Scans smaller than min_parallel_rows are summarized in the calling process, where the hand-off would cost more than
+the work.
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, NamedTuple, Optional, Tuple
+
+import base58
+import numpy as np
+
+from instrumentation import Instrumentation, get_instrumentation
+
+
+KEY_SIZE = 32
+
+
+class HolderStats(NamedTuple):
+    """
+    Concentration summary of one scan. Amounts are in UI units, shares are fractions of the total.
+    """
+    label: str
+    accounts: int
+    holders: int
+    total: float
+    gini: float
+    hhi: float
+    whales: int
+    whale_share: float
+    top_share: float
+    top_owners: List[str]
+    top_amounts: List[float]
+
+
+def concentration(owners: np.ndarray, amounts: np.ndarray, decimals: int, label: str = "", top_n: int = 20,
+                  whale_threshold: float = 0.01) -> HolderStats:
+    """
+    Summarize a distribution. Amounts of the same owner are summed first, so that an owner with several accounts
+    counts as one holder.
+    :param owners: (n, 32) uint8 array of owner public keys
+    :param amounts: n raw (integer) amounts, zero amounts are ignored
+    :param decimals: decimals of the token
+    :param label: name of the distribution
+    :param top_n: top holders returned
+    :param whale_threshold: share of the total from which a holder is a whale
+    :return:
+    """
+    mask = amounts > 0
+    accounts = int(mask.sum())
+    keys = np.ascontiguousarray(owners[mask]).view(np.dtype((np.void, KEY_SIZE))).ravel()
+    unique, inverse = np.unique(keys, return_inverse=True)
+    held = np.bincount(inverse.ravel(), weights=amounts[mask].astype(np.float64), minlength=len(unique))
+    held = held / 10 ** decimals
+
+    total = float(held.sum())
+    if total <= 0:
+        return HolderStats(label, accounts, 0, 0.0, 0.0, 0.0, 0, 0.0, 0.0, [], [])
+    shares = held / total
+
+    # Gini coefficient from the amounts sorted in ascending order
+    ascending = np.sort(held)
+    n = len(ascending)
+    gini = float(2 * np.dot(np.arange(1, n + 1), ascending) / (n * total) - (n + 1) / n)
+
+    top = min(top_n, n)
+    top_index = np.argpartition(held, n - top)[n - top:] if top else np.array([], dtype=np.int64)
+    top_index = top_index[np.argsort(held[top_index])[::-1]]
+    whales = shares >= whale_threshold
+    return HolderStats(
+        label=label,
+        accounts=accounts,
+        holders=n,
+        total=total,
+        gini=gini,
+        hhi=float(np.dot(shares, shares)),
+        whales=int(whales.sum()),
+        whale_share=float(shares[whales].sum()),
+        top_share=float(shares[top_index].sum()),
+        top_owners=[base58.b58encode(unique[x].tobytes()).decode('utf-8') for x in top_index],
+        top_amounts=held[top_index].tolist()
+    )
+
+
+def summarize_records(records: np.ndarray, owner_field: str, amount_field: str, decimals: int, label: str = "",
+                      match: Optional[Tuple[str, bytes]] = None, top_n: int = 20,
+                      whale_threshold: float = 0.01) -> HolderStats:
+    """
+    Summarize decoded accounts, e.g. CompiledLayout.parse_many output.
+    :param records: structured array of the accounts
+    :param owner_field: column of the owner public keys
+    :param amount_field: column of the raw amounts
+    :param decimals: decimals of the token
+    :param label: name of the distribution
+    :param match: (column, public key bytes): only keep the accounts whose column equals the key
+    :param top_n: top holders returned
+    :param whale_threshold: share of the total from which a holder is a whale
+    :return:
+    """
+    owners = records[owner_field]
+    amounts = records[amount_field]
+    if match is not None:
+        keep = (records[match[0]] == np.frombuffer(match[1], dtype=np.uint8)).all(axis=1)
+        owners = owners[keep]
+        amounts = amounts[keep]
+    return concentration(owners, amounts, decimals, label, top_n, whale_threshold)
+
+
+def _summarize_shared(name: str, size: int, dtype: np.dtype, *args) -> HolderStats:
+    """
+    Worker side: summarize the accounts held by a shared memory block.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    records = None
+    try:
+        records = np.frombuffer(block.buf, dtype=dtype, count=size // dtype.itemsize)
+        return summarize_records(records, *args)
+    except Exception as e:
+        # The frames of the traceback hold views of the block too
+        e.__traceback__ = None
+        raise
+    finally:
+        # The views must be gone before the block is closed
+        del records
+        block.close()
+
+
+class DistributionAnalytics:
+    """
+    Process pool summarizing distribution scans off the event loop.
+    """
+    def __init__(self, max_workers: Optional[int] = None, top_n: int = 20, whale_threshold: float = 0.01,
+                 min_parallel_rows: int = 50000, instrumentation: Optional[Instrumentation] = None):
+        """
+        :param max_workers: worker processes, one per core by default
+        :param top_n: top holders returned per scan
+        :param whale_threshold: share of the total from which a holder is a whale
+        :param min_parallel_rows: scans with fewer accounts are summarized in the calling process
+        :param instrumentation: where summaries are timed (holder_stats), get_instrumentation() by default
+        """
+        if not 0 < whale_threshold <= 1:
+            raise ValueError("whale_threshold must be in (0, 1].")
+        self.max_workers = max_workers
+        self.top_n = top_n
+        self.whale_threshold = whale_threshold
+        self.min_parallel_rows = min_parallel_rows
+        self._instrumentation = instrumentation or get_instrumentation()
+        self._executor = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Started on first use. Spawned workers do not inherit the sockets and threads of the event loop.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def summarize(self, buffer, dtype: np.dtype, owner_field: str, amount_field: str, decimals: int,
+                        label: str = "", match: Optional[Tuple[str, bytes]] = None) -> HolderStats:
+        """
+        Summarize concatenated accounts of one layout.
+        :param buffer: account data, e.g. from RaydiumPoolInfo.read_program_accounts
+        :param dtype: structured dtype of the accounts, e.g. CompiledLayout.dtype(sliced=True)
+        :param owner_field: column of the owner public keys
+        :param amount_field: column of the raw amounts
+        :param decimals: decimals of the token
+        :param label: name of the distribution
+        :param match: (column, public key bytes): only keep the accounts whose column equals the key
+        :return:
+        """
+        args = (owner_field, amount_field, decimals, label, match, self.top_n, self.whale_threshold)
+        size = len(buffer) - len(buffer) % dtype.itemsize
+        parallel = size // dtype.itemsize >= self.min_parallel_rows
+        with self._instrumentation.span("holder_stats", mode="process" if parallel else "inline"):
+            if not parallel:
+                return summarize_records(np.frombuffer(buffer, dtype=dtype, count=size // dtype.itemsize), *args)
+
+            block = shared_memory.SharedMemory(create=True, size=size)
+            try:
+                block.buf[:size] = memoryview(buffer)[:size]
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool(), _summarize_shared, block.name, size, dtype, *args)
+            finally:
+                block.close()
+                block.unlink()
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+_ANALYTICS = None
+
+
+def get_analytics() -> DistributionAnalytics:
+    """
+    Get the process-wide distribution analytics, its pool started on first use.
+    """
+    global _ANALYTICS
+    if _ANALYTICS is None:
+        _ANALYTICS = DistributionAnalytics()
+    return _ANALYTICS
@@ -0,0 +1,278 @@
+"""
+Hot path instrumentation: latency histograms, counters and trace spans.
+
+The API calls, rate limiters, decoders and APR stages report to the process-wide Instrumentation returned by
+get_instrumentation(). It is disabled by default: span() then returns a shared no-op context manager and observe() /
+count() return at once, so the hooks cost one attribute check.
+
+Once enabled, it records:
+    <prefix>_<span>_seconds          histogram of every span (RPC requests by method, Raydium downloads, rate limit
+                                     and batch queue waits, JSON decoding, layout decoding, base58 encoding, get_APR
+                                     stages by farm, ...)
+    <prefix>_<counter>_total         counters, e.g. rpc_bytes_received by method
+exported in the Prometheus text format by prometheus(). With tracing on, every span is also kept as a trace event,
+exported by write_trace() in the Chrome trace event format (chrome://tracing, https://ui.perfetto.dev), one track
+per asyncio task.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import time
+import weakref
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PREFIX = "raydium_scraper"
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram, as exported to Prometheus.
+    """
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile, as the upper bound of the bucket holding it.
+        """
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float("inf")
+
+
+class _NullSpan:
+    """
+    Span of disabled instrumentation.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("_instrumentation", "_name", "_labels", "_start")
+
+    def __init__(self, instrumentation: 'Instrumentation', name: str, labels: dict):
+        self._instrumentation = instrumentation
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._instrumentation._end_span(self._name, self._labels, self._start, time.perf_counter())
+        return False
+
+
+def _label_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Instrumentation:
+    """
+    Metrics and trace spans of the hot paths.
+    """
+    def __init__(self, enabled: bool = False, trace: bool = False, max_trace_events: int = 1000000,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, prefix: str = METRIC_PREFIX):
+        """
+        :param enabled: record metrics
+        :param trace: also keep every span as a trace event
+        :param max_trace_events: trace events kept, the oldest ones are dropped first
+        :param buckets: histogram bucket upper bounds, in seconds
+        :param prefix: prefix of the exported metric names
+        """
+        self.enabled = enabled or trace
+        self.trace = trace
+        self.buckets = buckets
+        self.prefix = prefix
+        self.histograms: Dict[Tuple[str, tuple], Histogram] = {}
+        self.counters: Dict[Tuple[str, tuple], float] = {}
+        self.trace_events = deque(maxlen=max_trace_events)
+        self._origin = time.perf_counter()
+        # Track of each live task: finished tasks drop out, their track numbers are not reused
+        self._tracks = weakref.WeakKeyDictionary()
+        self._track_numbers = itertools.count(1)
+
+    def enable(self, trace: bool = False):
+        """
+        Start recording, e.g. get_instrumentation().enable(trace=True).
+        :param trace: also keep every span as a trace event
+        :return:
+        """
+        self.enabled = True
+        self.trace = self.trace or trace
+
+    def disable(self):
+        self.enabled = False
+        self.trace = False
+
+    def reset(self):
+        """
+        Drop everything recorded so far.
+        """
+        self.histograms.clear()
+        self.counters.clear()
+        self.trace_events.clear()
+        self._tracks.clear()
+        self._track_numbers = itertools.count(1)
+        self._origin = time.perf_counter()
+
+    # Recording
+
+    def span(self, name: str, **labels):
+        """
+        Time a block: with instrumentation.span("rpc_request", method="getAccountInfo"): ...
+        :param name: histogram name, exported as <prefix>_<name>_seconds
+        :param labels: labels of the histogram and args of the trace event
+        :return: context manager
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, labels)
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Record a duration measured elsewhere, e.g. a wait.
+        """
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def count(self, name: str, value: float = 1, **labels):
+        """
+        Increase a counter, exported as <prefix>_<name>_total.
+        """
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def _end_span(self, name: str, labels: dict, start: float, end: float):
+        self.observe(name, end - start, **labels)
+        if self.trace:
+            self.trace_events.append({
+                "name": name,
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": self._track(),
+                "args": labels
+            })
+
+    def _track(self) -> int:
+        """
+        Trace track of the running asyncio task, 0 outside of tasks.
+        """
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            return 0
+        track = self._tracks.get(task)
+        if track is None:
+            track = self._tracks[task] = next(self._track_numbers)
+        return track
+
+    # Export
+
+    def _metric(self, name: str, suffix: str) -> str:
+        return "{}_{}{}".format(self.prefix, name, suffix) if self.prefix else name + suffix
+
+    @staticmethod
+    def _labels(labels: tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+        items = list(labels) + ([extra] if extra else [])
+        if not items:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for key, value in items) + "}"
+
+    def prometheus(self) -> str:
+        """
+        Metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            metric = self._metric(name, "_total")
+            if metric not in typed:
+                typed.add(metric)
+                lines.append("# TYPE {} counter".format(metric))
+            lines.append("{}{} {}".format(metric, self._labels(labels), value))
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            metric = self._metric(name, "_seconds")
+            if metric not in typed:
+                typed.add(metric)
+                lines.append("# TYPE {} histogram".format(metric))
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append("{}_bucket{} {}".format(metric, self._labels(labels, ("le", le)), cumulative))
+            lines.append("{}_sum{} {}".format(metric, self._labels(labels), histogram.sum))
+            lines.append("{}_count{} {}".format(metric, self._labels(labels), histogram.count))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def summary(self) -> List[dict]:
+        """
+        One row per histogram: name, labels, count, total seconds and estimated p50 / p99, slowest total first.
+        """
+        rows = [{"name": name, "labels": dict(labels), "count": histogram.count, "seconds": histogram.sum,
+                 "p50": histogram.quantile(0.5), "p99": histogram.quantile(0.99)}
+                for (name, labels), histogram in self.histograms.items()]
+        return sorted(rows, key=lambda x: x["seconds"], reverse=True)
+
+    def write_trace(self, path: str):
+        """
+        Write the trace events in the Chrome trace event format.
+        :param path: JSON file
+        :return:
+        """
+        with open(path, "w") as f:
+            json.dump({"traceEvents": list(self.trace_events), "displayTimeUnit": "ms"}, f)
+
+
+_INSTRUMENTATION = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    """
+    Get the process-wide instrumentation, disabled until enabled.
+    """
+    return _INSTRUMENTATION
@@ -0,0 +1,138 @@
+"""
+JSON decoding layer shared by the Solana and Raydium API calls.
+
+Bodies are decoded straight from the response bytes. orjson is used when it is installed,
+otherwise the standard library json module.
+"""
+
+import json
+import re
+from typing import Callable, List, NamedTuple, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONCodec(NamedTuple):
+    """A JSON backend: decode from bytes, encode to bytes."""
+
+    name: str
+    loads: Callable
+    dumps: Callable
+
+
+def _json_dumps(obj) -> bytes:
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+BACKENDS = {
+    # json.loads detects the encoding of bytes input itself, no intermediate str is needed
+    "json": JSONCodec("json", json.loads, _json_dumps)
+}
+if orjson is not None:
+    BACKENDS["orjson"] = JSONCodec("orjson", orjson.loads, orjson.dumps)
+
+DEFAULT_CODEC = BACKENDS.get("orjson", BACKENDS["json"])
+
+
+def get_codec(name: str = None) -> JSONCodec:
+    """
+    Look up a JSON backend.
+    :param name: backend name ('json' or 'orjson'), the fastest available backend by default
+    :return:
+    """
+    if name is None:
+        return DEFAULT_CODEC
+    if name not in BACKENDS:
+        raise ValueError("Unsupported JSON backend '{}'. "
+                         "Must be one of {}.".format(name, ", ".join(BACKENDS)))
+    return BACKENDS[name]
+
+
+class JSONArrayStream:
+    """
+    Incremental parser of the object items of one array in a JSON document, e.g. the result array of a JSON RPC
+    response.
+
+    feed() takes the response bytes as they arrive and returns the items completed so far. Only the item being
+    parsed is kept in memory, so memory stays bounded however long the array is. The bytes before the array are
+    kept as well, to report an error response if the array never shows up.
+    """
+    _STRUCTURE = re.compile(rb'[{}\[\]"\\]')
+
+    def __init__(self, key: str = "result", codec: Optional[JSONCodec] = None):
+        self._codec = codec or DEFAULT_CODEC
+        self._start = re.compile(rb'"' + re.escape(key.encode()) + rb'"\s*:\s*\[')
+        self._buffer = bytearray()
+        self._position = 0
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._item_start = 0
+        self._in_string = False
+        self._skip_until = 0
+
+    def feed(self, chunk: bytes) -> List:
+        """
+        Parse the next bytes of the document.
+        :param chunk: next bytes of the document
+        :return: items completed by this chunk
+        """
+        if self._finished:
+            return []
+        self._buffer += chunk
+
+        if not self._started:
+            match = self._start.search(self._buffer)
+            if match is None:
+                return []
+            self._started = True
+            del self._buffer[:match.end()]
+
+        items = []
+        for match in self._STRUCTURE.finditer(self._buffer, self._position):
+            i = match.start()
+            if i < self._skip_until:
+                continue
+            char = self._buffer[i]
+            if self._in_string:
+                if char == 0x5c:  # backslash: skip the escaped character
+                    self._skip_until = i + 2
+                elif char == 0x22:
+                    self._in_string = False
+            elif char == 0x22:
+                self._in_string = True
+            elif char in (0x7b, 0x5b):  # { [
+                if self._depth == 0:
+                    self._item_start = i
+                self._depth += 1
+            elif self._depth == 0:  # ] closing the array
+                self._finished = True
+                break
+            else:  # } ]
+                self._depth -= 1
+                if self._depth == 0:
+                    items.append(self._codec.loads(bytes(self._buffer[self._item_start:i + 1])))
+
+        # Drop the bytes of the items already returned
+        cut = self._item_start if self._depth > 0 else len(self._buffer)
+        del self._buffer[:cut]
+        self._item_start -= cut
+        self._skip_until = max(0, self._skip_until - cut)
+        self._position = len(self._buffer)
+        if self._finished:
+            self._buffer = bytearray()
+        return items
+
+    def close(self):
+        """
+        Check the document ended with a complete array.
+        :return: the decoded document if it did not contain the array (e.g. a JSON RPC error response)
+        """
+        if self._finished:
+            return None
+        if self._started:
+            raise ValueError("JSON document ended inside the streamed array.")
+        return self._codec.loads(bytes(self._buffer))
@@ -0,0 +1,325 @@
+"""
+On-chain discovery of the Raydium AMM pools, kept in a binary pool index.
+
+PoolDiscovery scans the AMM program with getProgramAccounts (dataSize filter on the pool state layout) and decodes
+the vaults, mints, open orders and market of every pool. The result is a PoolIndex: one fixed-size record per pool,
+sorted by AMM id, saved to a single file that is memory-mapped when loaded, so opening an index of thousands of
+pools costs about the same as one of 40.
+
+Refreshes are incremental: the addresses, mints and vaults of a pool never change once it is initialized, so a
+refresh only lists the pool accounts (dataSlice of length 0), reads the state of the new pools with
+getMultipleAccounts and drops the closed ones. refresh(full=True) re-reads every pool, e.g. to pick up status
+changes. Every refresh returns its PoolDiff against the previous index.
+
+Only the AMM V4 program is scanned: the V2 / V3 programs are retired and their state layouts are not defined
+here, their few pools come from the resources files.
+
+File format (version 1): a 64 byte header (magic, format version, record size, pool count, UNIX time of the refresh,
+little endian), then the records as POOL_DTYPE.
+"""
+
+import base64
+import os
+import struct
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import base58
+import numpy as np
+
+from compiled_layout import AMM_INFO_V4_DECODER
+from resources.ids import LIQUIDITY_POOL_PROGRAM_ID_V4
+from user_types import DataSliceOpts
+
+
+MAGIC = b"RAYPOOLS"
+INDEX_VERSION = 1
+_HEADER = struct.Struct("<8sIIQd")
+HEADER_SIZE = 64
+POOL_DTYPE = np.dtype([
+    ("amm_id", "u1", (32,)),
+    ("version", "u1"),
+    ("status", "<u8"),
+    ("coin_decimals", "u1"),
+    ("pc_decimals", "u1"),
+    ("coin_mint", "u1", (32,)),
+    ("pc_mint", "u1", (32,)),
+    ("lp_mint", "u1", (32,)),
+    ("coin_vault", "u1", (32,)),
+    ("pc_vault", "u1", (32,)),
+    ("open_orders", "u1", (32,)),
+    ("serum_market", "u1", (32,))
+])
+# Record field -> field of the pool state layout
+STATE_FIELDS = {
+    "status": "status",
+    "coin_decimals": "coinDecimals",
+    "pc_decimals": "pcDecimals",
+    "coin_mint": "coinMintAddress",
+    "pc_mint": "pcMintAddress",
+    "lp_mint": "lpMintAddress",
+    "coin_vault": "poolCoinTokenAccount",
+    "pc_vault": "poolPcTokenAccount",
+    "open_orders": "ammOpenOrders",
+    "serum_market": "serumMarket"
+}
+# AMM program -> (version, decoder of its pool state)
+AMM_PROGRAMS = {
+    LIQUIDITY_POOL_PROGRAM_ID_V4: (4, AMM_INFO_V4_DECODER)
+}
+
+
+def _keys(records: np.ndarray) -> np.ndarray:
+    """
+    AMM ids of records as comparable, sortable 32 byte strings.
+    """
+    return np.ascontiguousarray(records["amm_id"]).view("S32").ravel()
+
+
+def _encode(key: np.ndarray) -> str:
+    return base58.b58encode(key.tobytes()).decode('utf-8')
+
+
+class PoolDiff(NamedTuple):
+    """
+    AMM ids added, removed and changed between two indexes.
+    """
+    added: List[str]
+    removed: List[str]
+    changed: List[str]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+class PoolIndex:
+    """
+    Pools sorted by AMM id.
+    """
+    def __init__(self, records: Optional[np.ndarray] = None, updated_at: float = 0.0):
+        """
+        :param records: POOL_DTYPE array, sorted by AMM id
+        :param updated_at: UNIX time of the refresh the records come from
+        """
+        self.records = np.zeros(0, dtype=POOL_DTYPE) if records is None else records
+        self.updated_at = updated_at
+        self._sorted_keys = None
+
+    @classmethod
+    def from_records(cls, records: np.ndarray, updated_at: Optional[float] = None) -> 'PoolIndex':
+        """
+        Index of unsorted records, the last record of an AMM id winning.
+        """
+        keys = _keys(records)
+        # np.unique keeps the first occurrence: look for it in reverse
+        _, last = np.unique(keys[::-1], return_index=True)
+        records = records[len(records) - 1 - last]
+        return cls(np.ascontiguousarray(records), time.time() if updated_at is None else updated_at)
+
+    # File
+
+    @classmethod
+    def load(cls, path: str) -> 'PoolIndex':
+        """
+        Memory-map an index file. A missing file loads as an empty index.
+        :param path: index file
+        :return:
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a pool index.".format(path))
+        _, version, record_size, count, updated_at = _HEADER.unpack_from(header)
+        if version != INDEX_VERSION or record_size != POOL_DTYPE.itemsize:
+            raise ValueError("Unsupported pool index version {} ({} byte records).".format(version, record_size))
+        if count == 0:
+            return cls(updated_at=updated_at)
+        records = np.memmap(path, dtype=POOL_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+        return cls(records, updated_at)
+
+    def save(self, path: str):
+        """
+        Write the index, replacing the file atomically.
+        :param path: index file
+        :return:
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, INDEX_VERSION, POOL_DTYPE.itemsize, len(self.records),
+                                 self.updated_at).ljust(HEADER_SIZE, b"\0"))
+            f.write(np.ascontiguousarray(self.records, dtype=POOL_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    # Lookups
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def amm_ids(self) -> List[str]:
+        return [_encode(x) for x in self.records["amm_id"]]
+
+    def _find(self, amm_id: str) -> Optional[int]:
+        if self._sorted_keys is None:
+            self._sorted_keys = _keys(self.records)
+        key = np.array(base58.b58decode(amm_id), dtype="S32")
+        i = int(np.searchsorted(self._sorted_keys, key))
+        if i < len(self._sorted_keys) and self._sorted_keys[i] == key:
+            return i
+        return None
+
+    def __contains__(self, amm_id: str) -> bool:
+        return self._find(amm_id) is not None
+
+    def get(self, amm_id: str) -> Optional[dict]:
+        """
+        Pool of an AMM id, with its public keys base58 encoded.
+        :param amm_id: AMM public key
+        :return: dict of record field -> value, None if the pool is not indexed
+        """
+        i = self._find(amm_id)
+        if i is None:
+            return None
+        record = self.records[i]
+        return {name: _encode(record[name]) if POOL_DTYPE[name].shape else int(record[name])
+                for name in POOL_DTYPE.names}
+
+    def diff(self, other: 'PoolIndex') -> PoolDiff:
+        """
+        Changes from this index to other.
+        :param other: newer index
+        :return:
+        """
+        old_keys, new_keys = _keys(self.records), _keys(other.records)
+        common, old_index, new_index = np.intersect1d(old_keys, new_keys, assume_unique=True, return_indices=True)
+        size = POOL_DTYPE.itemsize
+        old = np.frombuffer(np.ascontiguousarray(self.records[old_index]).tobytes(), np.uint8).reshape(-1, size)
+        new = np.frombuffer(np.ascontiguousarray(other.records[new_index]).tobytes(), np.uint8).reshape(-1, size)
+        changed = new_index[(old != new).any(axis=1)]
+        return PoolDiff(
+            added=[_encode(x) for x in other.records["amm_id"][~np.isin(new_keys, common)]],
+            removed=[_encode(x) for x in self.records["amm_id"][~np.isin(old_keys, common)]],
+            changed=[_encode(x) for x in other.records["amm_id"][np.sort(changed)]]
+        )
+
+    def lp_addresses(self, token_info: dict) -> Dict[str, dict]:
+        """
+        Addresses of the indexed pools, in the format of RaydiumPoolInfo.LP_addresses.
+        :param token_info: RaydiumPoolInfo.token_info, to name the coins. Unknown mints are named by address.
+        :return: dict of AMM id -> addresses of the pool
+        """
+        symbols = {x['mintAddress']: name for name, x in token_info.items()}
+        pools = {}
+        for record in self.records:
+            coin_mint, pc_mint = _encode(record["coin_mint"]), _encode(record["pc_mint"])
+            pools[_encode(record["amm_id"])] = {
+                "coin": symbols.get(coin_mint, coin_mint),
+                "pc": symbols.get(pc_mint, pc_mint),
+                "coin_decimals": int(record["coin_decimals"]),
+                "pc_decimals": int(record["pc_decimals"]),
+                # The AMM program mints LP tokens with the decimals of the coin
+                "lp_decimals": int(record["coin_decimals"]),
+                "lp_mint_address": _encode(record["lp_mint"]),
+                "coin_in_pool_address": _encode(record["coin_vault"]),
+                "pc_in_pool_address": _encode(record["pc_vault"]),
+                "pool_amm_address": _encode(record["open_orders"])
+            }
+        return pools
+
+
+def decode_pools(amm_ids: List[str], buffer, version: int, decoder, sliced: bool = False) -> np.ndarray:
+    """
+    Build pool records from concatenated pool states.
+    :param amm_ids: AMM public key of every state
+    :param buffer: concatenated states, full or data_slice() windows
+    :param version: AMM program version
+    :param decoder: CompiledLayout of the pool state
+    :param sliced: the buffer holds data_slice() windows
+    :return: POOL_DTYPE array, in the order of amm_ids
+    """
+    states = decoder.parse_many(buffer, sliced)
+    records = np.zeros(len(states), dtype=POOL_DTYPE)
+    records["amm_id"] = np.array([np.frombuffer(base58.b58decode(x), dtype=np.uint8) for x in amm_ids],
+                                 dtype=np.uint8).reshape(len(amm_ids), 32)
+    records["version"] = version
+    for name, field in STATE_FIELDS.items():
+        records[name] = states[field]
+    return records
+
+
+class PoolDiscovery:
+    """
+    Discovery of the AMM pools, maintaining the pool index file.
+    """
+    def __init__(self, solana, path: str, programs: Optional[Dict[str, tuple]] = None):
+        """
+        :param solana: SolanaAPICall or SolanaRPCPool
+        :param path: pool index file, loaded if it exists
+        :param programs: AMM program -> (version, pool state decoder), AMM_PROGRAMS by default
+        """
+        self.solana = solana
+        self.path = path
+        self.programs = AMM_PROGRAMS if programs is None else programs
+        self.index = PoolIndex.load(path)
+
+    async def _scan(self, program_id: str, decoder, data_slice: DataSliceOpts):
+        """
+        Pool accounts of a program: their public keys and their concatenated (sliced) data.
+        """
+        amm_ids = []
+        buffer = bytearray()
+        async for account_info in self.solana.iterProgramAccounts(program_id, data_size=decoder.sizeof(),
+                                                                  data_slice=data_slice):
+            amm_ids.append(account_info['pubkey'])
+            buffer += base64.b64decode(account_info['account']['data'][0])
+        return amm_ids, buffer
+
+    async def scan(self) -> PoolIndex:
+        """
+        Read the state of every pool of the AMM programs.
+        :return: index of the pools
+        """
+        parts = []
+        for program_id, (version, decoder) in self.programs.items():
+            amm_ids, buffer = await self._scan(program_id, decoder, decoder.data_slice())
+            parts.append(decode_pools(amm_ids, buffer, version, decoder, sliced=True))
+        return PoolIndex.from_records(np.concatenate(parts) if parts else np.zeros(0, dtype=POOL_DTYPE))
+
+    async def _scan_new(self) -> PoolIndex:
+        """
+        List the pools, and read the state of the pools missing from the current index only.
+        """
+        known = self.index
+        parts = []
+        for program_id, (version, decoder) in self.programs.items():
+            amm_ids, _ = await self._scan(program_id, decoder, DataSliceOpts(0, 0))
+            found = [known._find(x) for x in amm_ids]
+            # Pools listed and already indexed are kept as they are, pools no longer listed are dropped
+            parts.append(known.records[np.array([x for x in found if x is not None], dtype=np.int64)])
+
+            new = [x for x, i in zip(amm_ids, found) if i is None]
+            if new:
+                accounts = await self.solana.getMultipleAccountsChunked(new)
+                new = [x for x in new if accounts.get(x) is not None]
+                buffer = b"".join(base64.b64decode(accounts[x])[:decoder.sizeof()] for x in new)
+                parts.append(decode_pools(new, buffer, version, decoder))
+        return PoolIndex.from_records(np.concatenate(parts) if parts else np.zeros(0, dtype=POOL_DTYPE))
+
+    async def refresh(self, full: bool = False) -> PoolDiff:
+        """
+        Bring the index up to date and save it.
+        :param full: re-read the state of every pool instead of the new pools only
+        :return: changes against the previous index
+        """
+        index = await (self.scan() if full or not len(self.index) else self._scan_new())
+        diff = self.index.diff(index)
+        self.index = index
+        self.index.save(self.path)
+        return diff
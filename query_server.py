@@ -0,0 +1,202 @@
+"""
+Local HTTP query API serving the latest farm snapshot.
+
+The snapshot is serialized once when it is published, and never again per request. Each farm is held as JSON
+bytes, along with the full document and its ETag. Requests only look bytes up, or join the bytes of the requested
+farms, so any number of readers can share one scrape.
+
+Routes:
+    GET /farms                  every farm, {farm: farm info}
+    GET /farms?farm=A&farm=B    only some farms (farm=A,B works too)
+    GET /farms/{farm}           one farm info
+    GET /metrics                Prometheus text format metrics, the instrumentation ones included when enabled
+"""
+
+import hashlib
+import re
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import web
+
+from instrumentation import Instrumentation, get_instrumentation
+from json_codec import JSONCodec, get_codec
+
+
+# Filtered documents kept per snapshot
+MAX_CACHED_SELECTIONS = 256
+# One entity tag of an If-None-Match list: *, "opaque" or W/"opaque"
+_ENTITY_TAG = re.compile(r'\*|(?:W/)?"[^"]*"')
+
+
+def _etag(*parts: bytes) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(part)
+    return '"{}"'.format(digest.hexdigest())
+
+
+def _none_match(header: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches an entity tag: * matches any tag, otherwise the header lists the tag,
+    compared whole and weakly (W/"x" matches "x"), as RFC 7232 requires for If-None-Match.
+    :param header: If-None-Match header value, None if absent
+    :param etag: entity tag of the response
+    :return:
+    """
+    if not header:
+        return False
+    for tag in _ENTITY_TAG.findall(header):
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == etag:
+            return True
+    return False
+
+
+class SnapshotServer:
+    """
+    Serves the latest published farm snapshot as pre-serialized JSON with ETag / If-None-Match support.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080, codec: Optional[JSONCodec] = None,
+                 metrics: Optional[Callable[[], Dict[str, float]]] = None,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        :param host: interface to listen on
+        :param port: port to listen on, 0 for any free port
+        :param codec: JSON backend, the fastest available one by default
+        :param metrics: returns extra gauges (name -> value) for /metrics
+        :param instrumentation: hot path metrics exported by /metrics, get_instrumentation() by default
+        """
+        self.host = host
+        self.port = port
+        self._codec = codec or get_codec()
+        self._metrics = metrics
+        self._instrumentation = instrumentation or get_instrumentation()
+        self._farm_bodies: Dict[str, bytes] = {}
+        self._farm_etags: Dict[str, str] = {}
+        self._body = b"{}"
+        self._etag = _etag(self._body)
+        self._selections = {}
+        self.version = 0
+        self.published_at = None
+        self.requests = Counter()
+        self._runner = None
+
+    # Publishing
+
+    def publish(self, results: List[dict]):
+        """
+        Replace the snapshot with the results of a cycle.
+        :param results: list of {farm: farm info} dicts
+        :return:
+        """
+        self._farm_bodies = {}
+        self._farm_etags = {}
+        self._set_farms(results)
+
+    def update(self, results: List[dict]):
+        """
+        Update some farms of the snapshot, e.g. from live updates.
+        :param results: list of {farm: farm info} dicts
+        :return:
+        """
+        self._set_farms(results)
+
+    def _set_farms(self, results: List[dict]):
+        for result in results:
+            for farm, farm_info in result.items():
+                body = self._codec.dumps(farm_info)
+                self._farm_bodies[farm] = body
+                self._farm_etags[farm] = _etag(body)
+        self._body = self._join(list(self._farm_bodies))
+        self._etag = _etag(self._body)
+        self._selections = {}
+        self.version += 1
+        self.published_at = time.time()
+
+    def _join(self, farms: List[str]) -> bytes:
+        """
+        JSON object of some farms, joined from their serialized bodies.
+        """
+        return b"{" + b",".join(self._codec.dumps(farm) + b":" + self._farm_bodies[farm] for farm in farms) + b"}"
+
+    # Serving
+
+    async def start(self):
+        """
+        Start listening, in the running event loop.
+        :return:
+        """
+        app = web.Application()
+        app.router.add_get("/farms", self._get_farms)
+        app.router.add_get("/farms/{farm}", self._get_farm)
+        app.router.add_get("/metrics", self._get_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if self.port == 0:
+            self.port = site._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _respond(self, request: web.Request, route: str, body: bytes, etag: str) -> web.Response:
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if self.published_at is not None:
+            headers["X-Snapshot-Version"] = str(self.version)
+        if _none_match(request.headers.get("If-None-Match"), etag):
+            self.requests[route, 304] += 1
+            return web.Response(status=304, headers=headers)
+        self.requests[route, 200] += 1
+        return web.Response(body=body, content_type="application/json", headers=headers)
+
+    async def _get_farms(self, request: web.Request) -> web.Response:
+        farms = [x for value in request.query.getall("farm", []) for x in value.split(",") if x]
+        if not farms:
+            return self._respond(request, "/farms", self._body, self._etag)
+
+        selection = tuple(dict.fromkeys(farms))
+        unknown = [x for x in selection if x not in self._farm_bodies]
+        if unknown:
+            self.requests["/farms", 404] += 1
+            raise web.HTTPNotFound(text="Unknown farms: {}".format(", ".join(unknown)))
+
+        if selection not in self._selections:
+            if len(self._selections) >= MAX_CACHED_SELECTIONS:
+                self._selections = {}
+            body = self._join(list(selection))
+            self._selections[selection] = (body, _etag(body))
+        body, etag = self._selections[selection]
+        return self._respond(request, "/farms", body, etag)
+
+    async def _get_farm(self, request: web.Request) -> web.Response:
+        farm = request.match_info["farm"]
+        if farm not in self._farm_bodies:
+            self.requests["/farms/{farm}", 404] += 1
+            raise web.HTTPNotFound(text="Unknown farm: {}".format(farm))
+        return self._respond(request, "/farms/{farm}", self._farm_bodies[farm], self._farm_etags[farm])
+
+    async def _get_metrics(self, request: web.Request) -> web.Response:
+        lines = [
+            "# TYPE query_server_requests_total counter"
+        ]
+        for (route, status), count in sorted(self.requests.items()):
+            lines.append('query_server_requests_total{{route="{}",status="{}"}} {}'.format(route, status, count))
+        gauges = {
+            "query_server_snapshot_version": self.version,
+            "query_server_snapshot_farms": len(self._farm_bodies),
+            "query_server_snapshot_bytes": len(self._body)
+        }
+        if self.published_at is not None:
+            gauges["query_server_snapshot_age_seconds"] = time.time() - self.published_at
+        if self._metrics is not None:
+            gauges.update(self._metrics())
+        for name, value in gauges.items():
+            lines += ["# TYPE {} gauge".format(name), "{} {}".format(name, value)]
+        text = "\n".join(lines) + "\n"
+        if self._instrumentation.enabled:
+            text += self._instrumentation.prometheus()
+        return web.Response(text=text, content_type="text/plain")
@@ -0,0 +1,279 @@
+"""
+Per-endpoint adaptive rate limiting for the API calls.
+
+Every endpoint (host) gets its own EndpointLimiter: a request rate limit, a bound on concurrent requests and a retry
+policy. HTTP 429 responses pause the whole endpoint for Retry-After seconds and halve its request rate, which then
+recovers step by step while requests succeed. Transient errors are retried with jittered exponential backoff.
+
+TokenBucket is a budget spanning every endpoint, charged by callers which plan their own request volume.
+"""
+
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+import aiohttp
+from aiolimiter import AsyncLimiter
+
+from instrumentation import Instrumentation, get_instrumentation
+
+
+# HTTP statuses worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class EndpointLimiter:
+    """
+    Rate limit, concurrency bound and retry policy of one endpoint.
+
+    The time requests wait for their slot is reported to the instrumentation as rate_limit_wait, and retries as
+    rate_limit_retries, both labelled with the endpoint name.
+    """
+    def __init__(self, max_rate: float = 10, time_period: float = 1, max_concurrency: int = 10,
+                 max_retries: int = 5, backoff_base: float = 0.5, backoff_max: float = 30, min_rate: float = 1,
+                 name: str = "", instrumentation: Optional[Instrumentation] = None):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.time_period = time_period
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.throttled = 0
+        self.retries = 0
+        self._limiter = AsyncLimiter(max_rate, time_period)
+        self._semaphore = None
+        self._semaphore_loop = None
+        self._resume_at = 0.0
+        self._successes = 0
+        self.name = name
+        self._instrumentation = instrumentation or get_instrumentation()
+
+    def _get_semaphore(self):
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold a request slot of the endpoint, without retries. Used for streamed responses, which cannot be replayed
+        once their first items were consumed. A 429 raised inside the slot still throttles the endpoint.
+        """
+        wait_start = time.perf_counter()
+        pause = self._resume_at - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+        async with self._get_semaphore():
+            await self._limiter.acquire()
+            self._instrumentation.observe("rate_limit_wait", time.perf_counter() - wait_start, endpoint=self.name)
+            try:
+                yield
+            except aiohttp.ClientResponseError as e:
+                if e.status == 429:
+                    retry_after = self._retry_after(e.headers)
+                    self._throttle(retry_after if retry_after is not None else self._backoff(0))
+                raise
+            self._recover()
+
+    async def call(self, request):
+        """
+        Run a request under the endpoint limits, retrying transient errors.
+        :param request: coroutine function sending the request
+        :return: the result of request
+        """
+        semaphore = self._get_semaphore()
+
+        attempt = 0
+        while True:
+            wait_start = time.perf_counter()
+            pause = self._resume_at - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+            async with semaphore:
+                await self._limiter.acquire()
+                self._instrumentation.observe("rate_limit_wait", time.perf_counter() - wait_start,
+                                              endpoint=self.name)
+                try:
+                    result = await request()
+                except aiohttp.ClientResponseError as e:
+                    if e.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                        raise
+                    self._instrumentation.count("rate_limit_retries", endpoint=self.name, status=e.status)
+                    delay = self._backoff(attempt)
+                    if e.status == 429:
+                        retry_after = self._retry_after(e.headers)
+                        if retry_after is not None:
+                            delay = max(delay, retry_after)
+                        self._throttle(delay)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if attempt >= self.max_retries:
+                        raise
+                    self._instrumentation.count("rate_limit_retries", endpoint=self.name, status="connection")
+                    delay = self._backoff(attempt)
+                else:
+                    self._recover()
+                    return result
+
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def retry_delay(self, error: aiohttp.ClientResponseError, attempt: int) -> Optional[float]:
+        """
+        Delay before retrying a request that failed with an HTTP error, for callers retrying on their own (e.g.
+        streamed requests, before any of their items was consumed).
+        :param error: HTTP error of the request
+        :param attempt: number of retries already made
+        :return: seconds to wait, or None if the error must not be retried
+        """
+        if error.status not in RETRY_STATUSES or attempt >= self.max_retries:
+            return None
+        self.retries += 1
+        self._instrumentation.count("rate_limit_retries", endpoint=self.name, status=error.status)
+        delay = self._backoff(attempt)
+        if error.status == 429:
+            retry_after = self._retry_after(error.headers)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+        return delay
+
+    def _backoff(self, attempt: int) -> float:
+        """
+        Full jitter exponential backoff.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(headers) -> Optional[float]:
+        """
+        Parse a Retry-After header given either in seconds or as an HTTP date.
+        """
+        value = headers.get("Retry-After") if headers else None
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _throttle(self, delay: float):
+        """
+        Pause the endpoint and halve its request rate, at most once per pause: the 429s of requests sent before the
+        pause started extend it, but do not halve the rate again.
+        """
+        self.throttled += 1
+        now = time.monotonic()
+        paused = now < self._resume_at
+        self._resume_at = max(self._resume_at, now + delay)
+        self._successes = 0
+        if not paused:
+            self._set_rate(max(self.min_rate, self.rate / 2))
+
+    def _recover(self):
+        """
+        Raise the request rate by one step after a full period of successful requests.
+        """
+        if self.rate >= self.max_rate:
+            return
+        self._successes += 1
+        if self._successes >= self.rate:
+            self._successes = 0
+            self._set_rate(min(self.max_rate, self.rate + 1))
+
+    def _set_rate(self, rate: float):
+        if rate != self.rate:
+            self.rate = rate
+            self._limiter = AsyncLimiter(rate, self.time_period)
+
+
+class TokenBucket:
+    """
+    Request budget shared by callers of any endpoint, e.g. to keep the total RPC usage under a provider quota.
+
+    Tokens accrue at rate per second, up to capacity. A request costing more than the capacity waits for a full
+    bucket and leaves it in debt, paid back before the next request goes through.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: tokens (requests) per second
+        :param capacity: largest burst, rate by default (at least 1)
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive.")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.spent = 0.0
+        self._updated = time.monotonic()
+        self._lock = None
+        self._lock_loop = None
+
+    def _get_lock(self):
+        loop = asyncio.get_event_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Take tokens if available, without waiting.
+        """
+        self._refill()
+        if self.tokens < min(tokens, self.capacity):
+            return False
+        self.tokens -= tokens
+        self.spent += tokens
+        return True
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """
+        Wait for tokens, first come first served.
+        :param tokens: cost of the request
+        :return: seconds waited
+        """
+        start = time.monotonic()
+        async with self._get_lock():
+            self._refill()
+            needed = min(tokens, self.capacity)
+            if self.tokens < needed:
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+            self.spent += tokens
+        return time.monotonic() - start
+
+
+_LIMITERS = {}
+
+
+def get_limiter(endpoint: str, **options) -> EndpointLimiter:
+    """
+    Get the limiter shared by every caller of an endpoint host. Options only apply when the limiter is created.
+    :param endpoint: endpoint URL
+    :return:
+    """
+    host = urlparse(endpoint).netloc or endpoint
+    if host not in _LIMITERS:
+        options.setdefault("name", host)
+        _LIMITERS[host] = EndpointLimiter(**options)
+    return _LIMITERS[host]
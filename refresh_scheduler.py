@@ -0,0 +1,181 @@
+"""
+Adaptive refresh of the farms: each farm gets its own refresh interval instead of one cron cycle for all.
+
+A farm is worth refreshing in proportion to its liquidity, scaled up by how much its APR moved recently (an
+exponential moving average of the relative APR change between refreshes). Its cost is the number of RPC requests a
+refresh of the farm alone is charged, at least one getMultipleAccounts call (see fetch_planner). Given an RPC budget
+in requests per second, the intervals minimizing the value-weighted staleness of the farms within that budget are
+
+    interval_i = sqrt(cost_i / weight_i) * sum_j sqrt(cost_j * weight_j) / budget
+
+clamped to [min_interval, max_interval]: high-value or fast-moving farms are refreshed often, dead farms back off up
+to max_interval. Farms falling due together are refreshed in one get_all_APR call, charged to a TokenBucket shared
+with any other caller of the budget; such a batch costs at most the sum of its farms' costs, so the planned intervals
+never assume more requests than the budget allows.
+"""
+
+import asyncio
+import math
+import time
+from typing import Callable, Dict, List, Optional
+
+from LPInfo import RaydiumPoolInfo
+from fetch_planner import PRICE_REQUEST
+from instrumentation import Instrumentation, get_instrumentation
+from rate_limit import TokenBucket
+
+
+class FarmSchedule:
+    """
+    Refresh state of one farm.
+    """
+    __slots__ = ("interval", "last_at", "next_at", "liquidity", "apr", "volatility", "refreshes")
+
+    def __init__(self):
+        self.interval = 0.0
+        self.last_at = None
+        self.next_at = 0.0
+        self.liquidity = None
+        self.apr = None
+        self.volatility = 0.0
+        self.refreshes = 0
+
+
+def total_apr(farm_info: dict) -> float:
+    """
+    Sum of the reward APRs of a farm info.
+    """
+    return sum(value for key, value in farm_info.items() if key.endswith("_APR"))
+
+
+class AdaptiveRefresh:
+    """
+    get_APR results refreshed farm by farm, each at its own interval, within an RPC budget.
+    """
+    def __init__(self, pool_info: RaydiumPoolInfo, budget: Optional[TokenBucket] = None, rpc_rate: float = 1.0,
+                 farms: Optional[List[str]] = None, min_interval: float = 10, max_interval: float = 600,
+                 volatility_weight: float = 10.0, smoothing: float = 0.3, coalesce: float = 1.0,
+                 on_update: Optional[Callable] = None, instrumentation: Optional[Instrumentation] = None):
+        """
+        :param pool_info: RaydiumPoolInfo computing the farms
+        :param budget: request budget charged with every refresh, a TokenBucket of rpc_rate by default. Share it
+            with the other callers of the same quota.
+        :param rpc_rate: requests per second of the default budget
+        :param farms: farm names, all farms by default
+        :param min_interval: shortest refresh interval of a farm, in seconds
+        :param max_interval: longest refresh interval of a farm, in seconds
+        :param volatility_weight: weight of a 100% APR move against liquidity in the value of a farm
+        :param smoothing: weight of the latest APR change in the volatility moving average
+        :param coalesce: farms due within this many seconds are refreshed together
+        :param on_update: called (or awaited) with (farm, farm info) after every refresh
+        :param instrumentation: where budget waits are reported (rpc_budget_wait), get_instrumentation() by default
+        """
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("Intervals must satisfy 0 < min_interval <= max_interval.")
+        self.pool_info = pool_info
+        self.budget = budget or TokenBucket(rpc_rate)
+        self.farms = list(farms or pool_info.farms_info)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.volatility_weight = volatility_weight
+        self.smoothing = smoothing
+        self.coalesce = coalesce
+        self.on_update = on_update
+        self.results: Dict[str, dict] = {}
+        self.schedules = {farm: FarmSchedule() for farm in self.farms}
+        self._instrumentation = instrumentation or get_instrumentation()
+
+        self._costs = {farm: self.cost([farm]) for farm in self.farms}
+
+    def cost(self, farms: List[str]) -> int:
+        """
+        RPC requests charged for refreshing some farms together: the requests of their fetch plan, prices excluded.
+        """
+        plan = self.pool_info.plan_cycle(farms)
+        return sum(1 for request in plan.requests if request.method != PRICE_REQUEST)
+
+    def weight(self, farm: str) -> float:
+        """
+        Value of refreshing a farm: its liquidity, scaled up by its recent APR volatility.
+        """
+        schedule = self.schedules[farm]
+        return max(schedule.liquidity or 0.0, 0.0) * (1 + self.volatility_weight * schedule.volatility)
+
+    def plan_intervals(self):
+        """
+        Spread the budget over the farms refreshed at least once, and reschedule them.
+        """
+        known = [farm for farm in self.farms if self.schedules[farm].last_at is not None]
+        total = sum(math.sqrt(self._costs[farm] * self.weight(farm)) for farm in known)
+        for farm in known:
+            schedule = self.schedules[farm]
+            weight = self.weight(farm)
+            if weight <= 0 or total <= 0:
+                interval = self.max_interval
+            else:
+                interval = math.sqrt(self._costs[farm] / weight) * total / self.budget.rate
+            schedule.interval = min(self.max_interval, max(self.min_interval, interval))
+            schedule.next_at = schedule.last_at + schedule.interval
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        """
+        Farms to refresh now, including those due within coalesce seconds.
+        """
+        now = time.monotonic() if now is None else now
+        return [farm for farm in self.farms if self.schedules[farm].next_at <= now + self.coalesce]
+
+    def _observe(self, farm: str, farm_info: dict, now: float):
+        schedule = self.schedules[farm]
+        apr = total_apr(farm_info)
+        if schedule.apr is not None:
+            change = abs(apr - schedule.apr) / max(abs(schedule.apr), 1e-9)
+            schedule.volatility += self.smoothing * (change - schedule.volatility)
+        schedule.apr = apr
+        schedule.liquidity = farm_info.get("liquidity")
+        schedule.last_at = now
+        schedule.refreshes += 1
+
+    async def refresh(self, farms: List[str]):
+        """
+        Refresh some farms in one batched read, within the budget.
+        :param farms: farm names
+        :return: list of {farm: farm info} dicts
+        """
+        waited = await self.budget.acquire(self.cost(farms))
+        self._instrumentation.observe("rpc_budget_wait", waited)
+
+        results = await self.pool_info.get_all_APR(farms)
+        now = time.monotonic()
+        for result in results:
+            (farm, farm_info), = result.items()
+            self._observe(farm, farm_info, now)
+            self.results[farm] = farm_info
+        self.plan_intervals()
+
+        if self.on_update is not None:
+            for result in results:
+                (farm, farm_info), = result.items()
+                update = self.on_update(farm, farm_info)
+                if asyncio.iscoroutine(update):
+                    await update
+        return results
+
+    async def run(self):
+        """
+        Refresh the farms as they fall due, until cancelled.
+        :return:
+        """
+        while True:
+            farms = self.due()
+            if farms:
+                try:
+                    await self.refresh(farms)
+                except Exception as e:
+                    # Whatever fails (a request, a closed account, a pool without supply, on_update), only this
+                    # batch is retried later. CancelledError is not an Exception and still stops the loop.
+                    print("Refresh of {} failed: {!r}".format(", ".join(farms), e))
+                    retry_at = time.monotonic() + self.min_interval
+                    for farm in farms:
+                        self.schedules[farm].next_at = retry_at
+            next_at = min(self.schedules[farm].next_at for farm in self.farms)
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
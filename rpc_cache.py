@@ -0,0 +1,203 @@
+"""
+Request coalescing and a short-lived response cache for the JSON RPC calls.
+
+SingleFlight makes concurrent identical calls share one in-flight request. RPCCache adds a bounded LRU cache of
+responses on top of it, with a policy per method: a TTL in seconds and, for account state, a bound in slots. A
+slot-bound response expires once a response of a slot more than `slots` slots newer has been seen, whatever its TTL.
+Methods without a policy are only coalesced. Error responses are never cached.
+
+Calls are keyed on (endpoint, method, params): the JSON RPC id is ignored. Cached responses are shared by every
+caller and must not be modified.
+"""
+
+import asyncio
+import json
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from instrumentation import Instrumentation, get_instrumentation
+from json_codec import JSONCodec, get_codec
+
+
+class CachePolicy(NamedTuple):
+    """
+    How long the responses of a method stay valid.
+    """
+    ttl: float
+    slots: Optional[int] = None
+
+
+DEFAULT_POLICIES = {
+    # Mint supplies change slowly, and only move LP share prices by the liquidity added or removed meanwhile
+    "getTokenSupply": CachePolicy(ttl=30.0),
+    # Balances and account state: about one second, in slots or in time when no newer slot was seen
+    "getTokenAccountBalance": CachePolicy(ttl=1.0, slots=2),
+    "getAccountInfo": CachePolicy(ttl=1.0, slots=2),
+    "getMultipleAccounts": CachePolicy(ttl=1.0, slots=2)
+}
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share the request of the first one.
+    """
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    def in_flight(self, key) -> bool:
+        return key in self._calls
+
+    async def do(self, key, request):
+        """
+        Run request, or join the identical request already in flight.
+        :param key: hashable key of the request
+        :param request: coroutine function making the request
+        :return: the result of the request
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(request())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        # A cancelled caller must not cancel the request of the others
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Retrieved here so that a request whose callers were all cancelled does not log an unretrieved error
+            task.exception()
+
+
+class _Entry(NamedTuple):
+    response: dict
+    expires_at: float
+    slot: Optional[int]
+    slots: Optional[int]
+    size: int
+
+
+class RPCCache:
+    """
+    Coalescing LRU cache of JSON RPC responses, bounded in entries and in bytes.
+    """
+    def __init__(self, policies: Optional[Dict[str, CachePolicy]] = None, max_entries: int = 4096,
+                 max_bytes: int = 64 << 20, codec: Optional[JSONCodec] = None,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        :param policies: method -> CachePolicy, DEFAULT_POLICIES by default. Pass {} to only coalesce calls.
+        :param max_entries: responses kept at most
+        :param max_bytes: serialized size of the responses kept at most
+        :param codec: JSON backend used to size the responses
+        :param instrumentation: where hits and misses are counted (rpc_cache_requests), get_instrumentation() by
+            default
+        """
+        self.policies = DEFAULT_POLICIES if policies is None else policies
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.latest_slot = 0
+        self.size = 0
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evictions = 0
+        self._codec = codec or get_codec()
+        self._instrumentation = instrumentation or get_instrumentation()
+        self._entries = OrderedDict()
+        self._flights = SingleFlight()
+
+    @staticmethod
+    def key(endpoint: str, method: str, params) -> str:
+        return json.dumps([endpoint, method, params], sort_keys=True, separators=(',', ':'))
+
+    async def call(self, endpoint: str, data: dict, request):
+        """
+        Serve a JSON RPC call from the cache, from the identical call in flight, or by making it.
+        :param endpoint: endpoint (or pool of endpoints) the call is sent to
+        :param data: JSON RPC request
+        :param request: coroutine function making the request, returning the decoded response
+        :return: decoded response
+        """
+        method = data['method']
+        key = self.key(endpoint, method, data['params'])
+        policy = self.policies.get(method)
+
+        if policy is not None:
+            response = self._get(key)
+            if response is not None:
+                self.hits[method] += 1
+                self._instrumentation.count("rpc_cache_requests", method=method, result="hit")
+                return response
+
+        result = "coalesced" if self._flights.in_flight(key) else "miss"
+        self.misses[method] += 1
+        self._instrumentation.count("rpc_cache_requests", method=method, result=result)
+        return await self._flights.do(key, lambda: self._fetch(key, policy, request))
+
+    async def _fetch(self, key: str, policy: Optional[CachePolicy], request):
+        response = await request()
+        slot = self._slot(response)
+        if slot is not None and slot > self.latest_slot:
+            self.latest_slot = slot
+        if policy is not None and isinstance(response, dict) and 'error' not in response:
+            self._put(key, response, policy, slot)
+        return response
+
+    @staticmethod
+    def _slot(response) -> Optional[int]:
+        try:
+            return response['result']['context']['slot']
+        except (KeyError, TypeError):
+            return None
+
+    def _get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic() or (
+                entry.slots is not None and entry.slot is not None and self.latest_slot - entry.slot > entry.slots):
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.response
+
+    def _put(self, key: str, response: dict, policy: CachePolicy, slot: Optional[int]):
+        size = len(self._codec.dumps(response)) + len(key)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(response, time.monotonic() + policy.ttl, slot, policy.slots, size)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        self.size -= self._entries.pop(key).size
+
+    def invalidate(self):
+        """
+        Drop every cached response.
+        """
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        """
+        Hit and miss counts (per method, coalesced calls counted as misses), evictions and current size.
+        """
+        return {
+            "hits": sum(self.hits.values()),
+            "misses": sum(self.misses.values()),
+            "coalesced": self._flights.coalesced,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits_by_method": dict(self.hits),
+            "misses_by_method": dict(self.misses)
+        }
@@ -0,0 +1,98 @@
+"""
+Endpoint health tracking for the multi-endpoint RPC pool.
+
+Each endpoint keeps an exponentially weighted moving average of its latency and error rate, which the pool turns
+into a load balancing weight, and a circuit breaker that takes it out of rotation after repeated failures.
+"""
+
+import random
+import time
+from typing import List, Optional
+
+
+class EndpointHealth:
+    """
+    Latency / error statistics and circuit breaker state of one endpoint.
+
+    The circuit opens after failure_threshold consecutive failures. Once cooldown seconds have passed it is
+    half-open: a single trial request is let through, which closes the circuit on success or re-opens it on failure.
+    """
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30, alpha: float = 0.2):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self._trial_running = False
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """
+        Whether the endpoint may take a request: circuit closed, or half-open with no trial running.
+        """
+        if self.failures < self.failure_threshold:
+            return True
+        now = time.monotonic() if now is None else now
+        return now >= self.open_until and not self._trial_running
+
+    def begin(self):
+        """
+        Mark a request as sent. A request sent while the circuit is half-open is its trial.
+        """
+        self.requests += 1
+        if self.failures >= self.failure_threshold:
+            self._trial_running = True
+
+    def record_success(self, latency: float):
+        self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+        self.error_rate *= 1 - self.alpha
+        self.failures = 0
+        self._trial_running = False
+
+    def record_failure(self):
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        self.failures += 1
+        self._trial_running = False
+        if self.failures >= self.failure_threshold:
+            self.open_until = time.monotonic() + self.cooldown
+
+    def cancel(self):
+        """
+        Forget a request cancelled before it completed (e.g. the losing side of a hedge).
+        """
+        self._trial_running = False
+
+    def score(self) -> float:
+        """
+        Expected cost of a request: lower is better. Endpoints without measurements score 0 so they get probed.
+        """
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + 10 * self.error_rate)
+
+
+def rank_endpoints(health: List[EndpointHealth]) -> List[int]:
+    """
+    Order endpoints for a request.
+
+    The first endpoint is drawn at random among the available ones, weighted by the inverse of its score, so load
+    spreads over all healthy endpoints in proportion to their speed. The others follow by score as failover
+    candidates. Endpoints with an open circuit, or half-open with their trial running, are left out until they are
+    available again.
+    :param health: health of each endpoint
+    :return: endpoint indexes, empty if no endpoint is available
+    """
+    now = time.monotonic()
+    available = [i for i, x in enumerate(health) if x.available(now)]
+    if not available:
+        return []
+
+    unmeasured = [i for i in available if health[i].score() == 0]
+    if unmeasured:
+        first = random.choice(unmeasured)
+    else:
+        first = random.choices(available, weights=[1 / health[i].score() for i in available])[0]
+    rest = sorted((i for i in available if i != first), key=lambda i: health[i].score())
+    return [first] + rest
@@ -1,4 +1,4 @@
-from construct import Bytes, Padding, Int64ul, Int8ul, BytesInteger
+from construct import Bytes, Padding, Int64ul, Int32ul, Int8ul, BytesInteger
 from construct import BitsInteger, BitsSwapped, BitStruct, Const, Flag
 from construct import Struct
 
@@ -84,4 +84,93 @@ USER_STAKE_INFO_ACCOUNT_LAYOUT_V4 = Struct(
   "depositBalance" / Int64ul,
   "rewardDebt" / Int64ul,
   "rewardDebtB" / Int64ul
-)
\ No newline at end of file
+)
+
+USER_STAKE_INFO_ACCOUNT_LAYOUT_V5 = Struct(
+  "state" / Int64ul,
+  "poolId" / Bytes(32),
+  "stakerOwner" / Bytes(32),
+  "depositBalance" / Int64ul,
+  "rewardDebt" / Int64ul,
+  "rewardDebtB" / Int64ul,
+  Padding(17 * 8)
+)
+
+# SPL Token Account
+SPL_ACCOUNT_LAYOUT = Struct(
+    "mint" / Bytes(32),
+    "owner" / Bytes(32),
+    "amount" / Int64ul,
+    "delegateOption" / Int32ul,
+    "delegate" / Bytes(32),
+    "state" / Int8ul,
+    "isNativeOption" / Int32ul,
+    "isNative" / Int64ul,
+    "delegatedAmount" / Int64ul,
+    "closeAuthorityOption" / Int32ul,
+    "closeAuthority" / Bytes(32)
+)
+
+# SPL Token Mint
+SPL_MINT_LAYOUT = Struct(
+    "mintAuthorityOption" / Int32ul,
+    "mintAuthority" / Bytes(32),
+    "supply" / Int64ul,
+    "decimals" / Int8ul,
+    "initialized" / Flag,
+    "freezeAuthorityOption" / Int32ul,
+    "freezeAuthority" / Bytes(32)
+)
+
+# Raydium AMM V4 liquidity pool state
+LIQUIDITY_STATE_LAYOUT_V4 = Struct(
+    "status" / Int64ul,
+    "nonce" / Int64ul,
+    "orderNum" / Int64ul,
+    "depth" / Int64ul,
+    "coinDecimals" / Int64ul,
+    "pcDecimals" / Int64ul,
+    "state" / Int64ul,
+    "resetFlag" / Int64ul,
+    "minSize" / Int64ul,
+    "volMaxCutRatio" / Int64ul,
+    "amountWaveRatio" / Int64ul,
+    "coinLotSize" / Int64ul,
+    "pcLotSize" / Int64ul,
+    "minPriceMultiplier" / Int64ul,
+    "maxPriceMultiplier" / Int64ul,
+    "systemDecimalsValue" / Int64ul,
+    "minSeparateNumerator" / Int64ul,
+    "minSeparateDenominator" / Int64ul,
+    "tradeFeeNumerator" / Int64ul,
+    "tradeFeeDenominator" / Int64ul,
+    "pnlNumerator" / Int64ul,
+    "pnlDenominator" / Int64ul,
+    "swapFeeNumerator" / Int64ul,
+    "swapFeeDenominator" / Int64ul,
+    "needTakePnlCoin" / Int64ul,
+    "needTakePnlPc" / Int64ul,
+    "totalPnlPc" / Int64ul,
+    "totalPnlCoin" / Int64ul,
+    "poolTotalDepositPc" / BytesInteger(16, swapped=True),
+    "poolTotalDepositCoin" / BytesInteger(16, swapped=True),
+    "swapCoinInAmount" / BytesInteger(16, swapped=True),
+    "swapPcOutAmount" / BytesInteger(16, swapped=True),
+    "swapCoin2PcFee" / Int64ul,
+    "swapPcInAmount" / BytesInteger(16, swapped=True),
+    "swapCoinOutAmount" / BytesInteger(16, swapped=True),
+    "swapPc2CoinFee" / Int64ul,
+    "poolCoinTokenAccount" / Bytes(32),
+    "poolPcTokenAccount" / Bytes(32),
+    "coinMintAddress" / Bytes(32),
+    "pcMintAddress" / Bytes(32),
+    "lpMintAddress" / Bytes(32),
+    "ammOpenOrders" / Bytes(32),
+    "serumMarket" / Bytes(32),
+    "serumProgramId" / Bytes(32),
+    "ammTargetOrders" / Bytes(32),
+    "poolWithdrawQueue" / Bytes(32),
+    "poolTempLpTokenAccount" / Bytes(32),
+    "ammOwner" / Bytes(32),
+    "pnlOwner" / Bytes(32)
+)
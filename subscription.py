@@ -0,0 +1,321 @@
+"""
+Live account state through Solana websocket subscriptions.
+
+AccountSubscriber keeps the base64 data of a set of accounts up to date from accountSubscribe notifications and
+resubscribes after reconnecting. LiveAPR builds on it. It seeds the account store with one batched read and then
+recomputes get_APR only for the farms whose accounts or prices changed.
+"""
+
+import asyncio
+import random
+from typing import Callable, Dict, List, Optional, Set
+
+import aiohttp
+
+from LPInfo import AccountSnapshot, RaydiumPoolInfo, SOLANA_ENDPOINT, RAYDIUM_SNAPSHOT_TTL
+from json_codec import JSONCodec, get_codec
+
+
+# Errors of a seed read, price refresh or update callback that are retried instead of stopping LiveAPR
+RETRY_ERRORS = (ValueError, KeyError, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+def websocket_endpoint(endpoint: str) -> str:
+    """
+    Websocket URL of a JSON RPC endpoint: the RPC URL with a ws / wss scheme.
+    :param endpoint: http(s) or ws(s) endpoint URL
+    :return:
+    """
+    if endpoint.startswith("https://"):
+        return "wss://" + endpoint[len("https://"):]
+    if endpoint.startswith("http://"):
+        return "ws://" + endpoint[len("http://"):]
+    return endpoint
+
+
+class AccountSubscriber:
+    """
+    Websocket accountSubscribe client of a fixed set of accounts.
+
+    accounts maps every public key to its latest base64 data (None for a closed account), along with the slot of
+    that data. Accounts only appear in accounts once a notification for them has arrived. Seeding them is up to the
+    caller, see on_subscribed. The connection is reopened with jittered exponential backoff when it drops or when a
+    subscription is rejected, and every account is subscribed to again.
+    """
+    def __init__(self, endpoint: str, session, commitment: str = 'max', codec: Optional[JSONCodec] = None,
+                 on_change: Optional[Callable] = None, on_subscribed: Optional[Callable] = None,
+                 reconnect_base: float = 0.5, reconnect_max: float = 30):
+        """
+        :param endpoint: RPC endpoint, http(s) URLs are mapped to ws(s)
+        :param session: aiohttp ClientSession
+        :param commitment: commitment of the notifications
+        :param codec: JSON backend, the fastest available one by default
+        :param on_change: called with (public key, base64 data, slot) for every notification
+        :param on_subscribed: called once every subscription is confirmed, after each (re)connect
+        :param reconnect_base: first reconnect delay in seconds
+        :param reconnect_max: longest reconnect delay in seconds
+        """
+        self._endpoint = websocket_endpoint(endpoint)
+        self._session = session
+        self._commitment = commitment
+        self._codec = codec or get_codec()
+        self.on_change = on_change
+        self.on_subscribed = on_subscribed
+        self.reconnect_base = reconnect_base
+        self.reconnect_max = reconnect_max
+        self.accounts = AccountSnapshot()
+        self.notifications = 0
+        self.reconnects = 0
+        self._addresses: List[str] = []
+        self._pending: Dict[int, str] = {}
+        self._subscriptions: Dict[int, str] = {}
+        self._subscribed = False
+
+    async def run(self, addresses: List[str]):
+        """
+        Subscribe to the accounts and process notifications until cancelled.
+        :param addresses: public keys to follow
+        :return:
+        """
+        self._addresses = list(dict.fromkeys(addresses))
+        attempt = 0
+        while True:
+            try:
+                async with self._session.ws_connect(self._endpoint, heartbeat=30) as ws:
+                    await self._subscribe(ws)
+                    async for message in ws:
+                        if message.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                            self._handle(self._codec.loads(message.data))
+                        elif message.type == aiohttp.WSMsgType.ERROR:
+                            break
+            except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError):
+                pass
+            except ValueError as e:
+                # Rejected subscription: start over on a new connection
+                print("Resubscribing after error: {}".format(e))
+
+            # Connection closed or failed: reconnect and resubscribe. The backoff only resets once a connection got
+            # every subscription confirmed, so a subscription rejected every time does not reconnect in a tight loop.
+            if self._subscribed:
+                attempt = 0
+            self.reconnects += 1
+            await asyncio.sleep(random.uniform(0, min(self.reconnect_max, self.reconnect_base * 2 ** attempt)))
+            attempt += 1
+
+    async def _subscribe(self, ws):
+        self._pending = {}
+        self._subscriptions = {}
+        self._subscribed = False
+        for request_id, address in enumerate(self._addresses):
+            self._pending[request_id] = address
+            await ws.send_bytes(self._codec.dumps({
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": "accountSubscribe",
+                "params": [address, {"encoding": "base64", "commitment": self._commitment}]
+            }))
+
+    def _handle(self, message: dict):
+        if "id" in message:
+            # Subscription confirmation
+            address = self._pending.pop(message["id"], None)
+            if address is None:
+                return
+            if "error" in message:
+                raise ValueError("accountSubscribe failed for {}: {}".format(address, message["error"]))
+            self._subscriptions[message["result"]] = address
+            if not self._pending:
+                self._subscribed = True
+                if self.on_subscribed is not None:
+                    self.on_subscribed()
+            return
+
+        if message.get("method") != "accountNotification":
+            return
+        params = message["params"]
+        address = self._subscriptions.get(params["subscription"])
+        if address is None:
+            return
+        value = params["result"]["value"]
+        data = value["data"][0] if value is not None else None
+        slot = params["result"]["context"]["slot"]
+        self.notifications += 1
+        self.accounts.set(address, data, slot)
+        if self.on_change is not None:
+            self.on_change(address, data, slot)
+
+
+class LiveAPR:
+    """
+    get_APR results kept up to date from account subscriptions instead of polling.
+
+    Every input account of the farms (poolId, poolLpTokenAccount, coin and pc vaults, ammOpenOrders and LP mint) is
+    subscribed to. A change marks only the farms reading that account as dirty. After a short debounce the dirty farms
+    are recomputed together from the account store, in one pass of the APR engine. Prices are refreshed every
+    price_interval seconds and only farms whose coin or pc price moved are recomputed.
+
+    The account store is seeded with one batched read after every (re)subscription. A failed seed read is retried
+    with the backoff of the subscriber until it succeeds. So is a failed price refresh, the last prices being kept
+    meanwhile, and a failed on_update call, whose farm is recomputed again after the backoff.
+    """
+    def __init__(self, pool_info: RaydiumPoolInfo, session, endpoint: str = SOLANA_ENDPOINT,
+                 farms: Optional[List[str]] = None, debounce: float = 0.05,
+                 price_interval: float = RAYDIUM_SNAPSHOT_TTL, on_update: Optional[Callable] = None):
+        """
+        :param pool_info: RaydiumPoolInfo used for the seed reads, prices and get_APR
+        :param session: aiohttp ClientSession of the websocket
+        :param endpoint: RPC endpoint to subscribe on
+        :param farms: farm names, all farms by default
+        :param debounce: seconds to wait for more changes before recomputing
+        :param price_interval: seconds between price refreshes
+        :param on_update: called (or awaited) with (farm, farm info) after every recompute
+        """
+        self.pool_info = pool_info
+        self.farms = list(farms or pool_info.farms_info)
+        self.debounce = debounce
+        self.price_interval = price_interval
+        self.on_update = on_update
+        self.results: Dict[str, dict] = {}
+        self.recomputes = 0
+        self.seeds = 0
+        self.price = None
+
+        self._inputs = {farm: pool_info.cycle_addresses([farm]) for farm in self.farms}
+        self._farms_of: Dict[str, Set[str]] = {}
+        for farm, addresses in self._inputs.items():
+            for address in addresses:
+                self._farms_of.setdefault(address, set()).add(farm)
+
+        self.subscriber = AccountSubscriber(endpoint, session, on_change=self._on_change,
+                                            on_subscribed=self._on_subscribed)
+        self.accounts = self.subscriber.accounts
+        self._dirty: Set[str] = set()
+        self._dirty_event = None
+        self._notified: Optional[Set[str]] = None
+        self._seed_event = None
+
+    async def run(self):
+        """
+        Follow the farms until cancelled.
+        :return:
+        """
+        self._dirty_event = asyncio.Event()
+        self._seed_event = asyncio.Event()
+        tasks = [asyncio.ensure_future(x) for x in (self.subscriber.run(list(self._farms_of)),
+                                                     self._seed_loop(),
+                                                     self._recompute_loop(),
+                                                     self._price_loop())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _mark_dirty(self, farms):
+        self._dirty.update(farms)
+        if self._dirty and self._dirty_event is not None:
+            self._dirty_event.set()
+
+    def _on_change(self, address: str, data: Optional[str], slot: int):
+        if self._notified is not None:
+            self._notified.add(address)
+        self._mark_dirty(self._farms_of.get(address, ()))
+
+    def _on_subscribed(self):
+        # Notifications only carry changes: read the current state once per (re)subscription
+        if self._seed_event is not None:
+            self._seed_event.set()
+
+    def _backoff(self, attempt: int) -> float:
+        """
+        Retry delay of the attempt-th consecutive failure, the reconnect backoff of the subscriber.
+        """
+        return random.uniform(0, min(self.subscriber.reconnect_max, self.subscriber.reconnect_base * 2 ** attempt))
+
+    async def _seed_loop(self):
+        attempt = 0
+        while True:
+            await self._seed_event.wait()
+            self._seed_event.clear()
+            try:
+                await self._seed()
+                attempt = 0
+            except RETRY_ERRORS as e:
+                print("Seed read failed, retrying: {!r}".format(e))
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                self._seed_event.set()
+
+    async def _seed(self):
+        """
+        Fill the account store with one batched read. Accounts notified while the read was in flight are newer than
+        the read and are kept.
+        """
+        self._notified = set()
+        try:
+            accounts = await self.pool_info.SOLANA.getMultipleAccountsChunked(list(self._farms_of))
+            for address, data in accounts.items():
+                if address not in self._notified:
+                    self.accounts.set(address, data, accounts.slots[address])
+        finally:
+            self._notified = None
+        self.seeds += 1
+        self._mark_dirty(self.farms)
+
+    async def _price_loop(self):
+        attempt = 0
+        while True:
+            try:
+                price = await self.pool_info.RAYDIUM.get_price()
+            except RETRY_ERRORS as e:
+                # Keep computing with the last prices until a refresh succeeds
+                print("Price refresh failed, retrying: {!r}".format(e))
+                await asyncio.sleep(min(self.price_interval, self._backoff(attempt)))
+                attempt += 1
+                continue
+            attempt = 0
+            if self.price is None:
+                changed = self.farms
+            else:
+                changed = [farm for farm in self.farms
+                           if any(price.get(coin) != self.price.get(coin)
+                                  for coin in (self.pool_info.LP_addresses[farm]['coin'],
+                                               self.pool_info.LP_addresses[farm]['pc']))]
+            self.price = price
+            self._mark_dirty(changed)
+            await asyncio.sleep(self.price_interval)
+
+    async def _recompute_loop(self):
+        attempt = 0
+        while True:
+            await self._dirty_event.wait()
+            await asyncio.sleep(self.debounce)
+            self._dirty_event.clear()
+            if self.price is None:
+                # No price yet: the first price refresh marks every farm dirty
+                continue
+            farms, self._dirty = self._dirty, set()
+            # Skip farms not seeded yet (or with a closed input account)
+            farms = [farm for farm in self.farms if farm in farms
+                     and all(self.accounts.get(address) is not None for address in self._inputs[farm])]
+            if not farms:
+                continue
+            failed = []
+            for result in self.pool_info.compute_farms(farms, self.accounts, self.price):
+                (farm, farm_info), = result.items()
+                self.results[farm] = farm_info
+                self.recomputes += 1
+                if self.on_update is not None:
+                    try:
+                        update = self.on_update(farm, farm_info)
+                        if asyncio.iscoroutine(update):
+                            await update
+                    except RETRY_ERRORS as e:
+                        print("Update of {} failed, retrying: {!r}".format(farm, e))
+                        failed.append(farm)
+            if failed:
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                self._mark_dirty(failed)
+            else:
+                attempt = 0
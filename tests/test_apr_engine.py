@@ -0,0 +1,128 @@
+"""
+compute_apr on a small farm table computed by hand: RAY yield, fusion and dual farms, and a farm without liquidity.
+"""
+
+import numpy as np
+import pytest
+
+from apr_engine import BLOCKS_PER_YEAR, CycleInputs, FarmTable, compute_apr, sensitivity_grid
+
+FARMS_INFO = {
+    "RAY-USDC": {"dual": False, "fusion": False, "reward": "RAY"},
+    "STEP-USDC": {"dual": False, "fusion": True, "reward": "RAY", "rewardB": "STEP"},
+    # Reward A in the coin side
+    "RAY-SOL": {"dual": True, "fusion": False, "reward": "RAY", "rewardB": "SOL"},
+    # Reward B in the coin side
+    "MEDIA-USDC": {"dual": True, "fusion": False, "reward": "RAY", "rewardB": "MEDIA"},
+    "RAY-USDT": {"dual": False, "fusion": False, "reward": "RAY"},
+}
+LP_ADDRESSES = {
+    "RAY-USDC": {"coin": "RAY", "pc": "USDC", "coin_decimals": 6, "pc_decimals": 6, "lp_decimals": 6},
+    "STEP-USDC": {"coin": "STEP", "pc": "USDC", "coin_decimals": 9, "pc_decimals": 6, "lp_decimals": 9},
+    "RAY-SOL": {"coin": "RAY", "pc": "SOL", "coin_decimals": 6, "pc_decimals": 9, "lp_decimals": 6},
+    "MEDIA-USDC": {"coin": "MEDIA", "pc": "USDC", "coin_decimals": 6, "pc_decimals": 6, "lp_decimals": 6},
+    "RAY-USDT": {"coin": "RAY", "pc": "USDT", "coin_decimals": 6, "pc_decimals": 6, "lp_decimals": 6},
+}
+PRICE = {"RAY": 2.0, "USDC": 1.0, "USDT": 1.0, "STEP": 0.5, "SOL": 100.0, "MEDIA": 10.0}
+
+INPUTS = CycleInputs(
+    coin_amount=np.array([1000.0, 4000.0, 500.0, 100.0, 0.0]),
+    pc_amount=np.array([2000.0, 2000.0, 10.0, 1000.0, 0.0]),
+    lp_supply=np.array([100.0, 200.0, 40.0, 100.0, 100.0]),
+    staked_lp=np.array([50.0, 100.0, 20.0, 50.0, 0.0]),
+    # Raw rates: reward A of the fusion farm is ignored, it has none
+    per_block_a=np.array([1000.0, 999.0, 2000.0, 1000.0, 1000.0]),
+    per_block_b=np.array([0.0, 10.0 ** 6, 1000.0, 500.0, 0.0])
+)
+
+# Rewards per block and per year (63072000 blocks), in UI amounts
+EXPECTED = {
+    # 1000 RAY + 2000 USDC, a share of 40, 50 shares staked. 0.001 RAY per block.
+    "RAY-USDC": {"liquidity": 4000.0, "lp_share_price": 40.0, "staked_liquidity": 2000.0,
+                 "reward_a_ann": 63072.0, "reward_a_apr": 63072.0 * 2.0 / 2000.0,
+                 "reward_b_ann": 0.0, "reward_b_apr": 0.0},
+    # 4000 STEP at 0.5 + 2000 USDC. 0.001 STEP (9 decimals) per block.
+    "STEP-USDC": {"liquidity": 4000.0, "lp_share_price": 20.0, "staked_liquidity": 2000.0,
+                  "reward_a_ann": 0.0, "reward_a_apr": 0.0,
+                  "reward_b_ann": 63072.0, "reward_b_apr": 63072.0 * 0.5 / 2000.0},
+    # 500 RAY + 10 SOL. 0.002 RAY per block, and SOL priced with the pc price but scaled by the LP decimals.
+    "RAY-SOL": {"liquidity": 2000.0, "lp_share_price": 50.0, "staked_liquidity": 1000.0,
+                "reward_a_ann": 126144.0, "reward_a_apr": 126144.0 * 2.0 / 1000.0,
+                "reward_b_ann": 63072.0, "reward_b_apr": 63072.0 * 100.0 / 1000.0},
+    # 100 MEDIA at 10 + 1000 USDC. Reward A priced with the pc price, reward B with the coin price.
+    "MEDIA-USDC": {"liquidity": 2000.0, "lp_share_price": 20.0, "staked_liquidity": 1000.0,
+                   "reward_a_ann": 63072.0, "reward_a_apr": 63072.0 * 1.0 / 1000.0,
+                   "reward_b_ann": 31536.0, "reward_b_apr": 31536.0 * 10.0 / 1000.0},
+}
+
+
+def farm_table() -> FarmTable:
+    return FarmTable.from_config(FARMS_INFO, LP_ADDRESSES)
+
+
+def test_farm_table():
+    table = farm_table()
+    assert table.farms == list(FARMS_INFO)
+    assert table.reward_a == ["RAY", None, "RAY", "RAY", "RAY"]
+    assert table.reward_b == [None, "STEP", "SOL", "MEDIA", None]
+    assert table.dual.tolist() == [False, False, True, True, False]
+    assert table.fusion.tolist() == [False, True, False, False, False]
+    assert table.has_a.tolist() == [True, False, True, True, True]
+    assert table.has_b.tolist() == [False, True, True, True, False]
+    assert table.a_is_coin.tolist() == [True, False, True, False, True]
+    assert table.b_is_coin.tolist() == [False, True, False, True, False]
+    assert table.decimals_a.tolist() == [6, 6, 6, 6, 6]
+    assert table.decimals_b.tolist() == [6, 9, 6, 6, 6]
+
+    sub = table.take(["RAY-SOL", "RAY-USDC"])
+    assert sub.farms == ["RAY-SOL", "RAY-USDC"] and sub.reward_b == ["SOL", None]
+    assert sub.dual.tolist() == [True, False] and sub.decimals_b.tolist() == [6, 6]
+
+    farms_info = dict(FARMS_INFO, **{"RAY-SOL": dict(FARMS_INFO["RAY-SOL"], reward="USDC")})
+    with pytest.raises(ValueError, match="RAY-SOL"):
+        FarmTable.from_config(farms_info, LP_ADDRESSES)
+
+
+def test_compute_apr():
+    table = farm_table()
+    fee_apr = [0.1, 0.2, 0.3, 0.4, 0.5]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        columns = compute_apr(table, INPUTS, [PRICE[x] for x in table.coin], [PRICE[x] for x in table.pc], fee_apr)
+
+    for i, farm in enumerate(table.farms[:4]):
+        for column, value in EXPECTED[farm].items():
+            assert columns[column][i] == pytest.approx(value), (farm, column)
+        total = EXPECTED[farm]["reward_a_apr"] + EXPECTED[farm]["reward_b_apr"] + fee_apr[i]
+        assert columns["fee_apr"][i] == fee_apr[i]
+        assert columns["total_apr"][i] == pytest.approx(total), farm
+
+    # No liquidity: nothing staked to share the reward, which does not affect the other farms
+    assert columns["liquidity"][4] == 0 and columns["lp_share_price"][4] == 0
+    assert columns["staked_liquidity"][4] == 0
+    assert columns["reward_a_ann"][4] == pytest.approx(63072.0)
+    assert np.isinf(columns["reward_a_apr"][4]) and np.isnan(columns["reward_b_apr"][4])
+
+
+def test_compute_apr_defaults_and_reward_scale():
+    table = farm_table().take(["RAY-USDC", "RAY-SOL"])
+    inputs = CycleInputs(*[x[[0, 2]] for x in INPUTS])
+    columns = compute_apr(table, inputs, [2.0, 2.0], [1.0, 100.0], reward_scale=0.5)
+    assert columns["fee_apr"].tolist() == [0.0, 0.0]
+    assert columns["reward_a_apr"] == pytest.approx([63072.0 / 2000.0, 126144.0 / 1000.0])
+    assert columns["total_apr"] == pytest.approx([31.536, 126.144 + 3153.6])
+    assert BLOCKS_PER_YEAR == 63072000
+
+
+def test_sensitivity_grid():
+    table = farm_table().take(["RAY-USDC", "RAY-SOL"])
+    inputs = CycleInputs(*[x[[0, 2]] for x in INPUTS])
+    grid = sensitivity_grid(table, inputs, [2.0, 2.0], [1.0, 100.0], price_scales=[1.0, 2.0],
+                            reward_scales=[1.0, 0.5, 0.0])
+    assert grid.shape == (2, 3, 2)
+    base = compute_apr(table, inputs, [2.0, 2.0], [1.0, 100.0])["total_apr"]
+    assert grid[0, 0] == pytest.approx(base)
+    assert grid[0, 1] == pytest.approx(base / 2)
+    assert grid[:, 2] == pytest.approx(np.zeros((2, 2)))
+    # A coin price twice higher: the liquidity and the coin priced rewards scale together
+    doubled = compute_apr(table, inputs, [4.0, 4.0], [1.0, 100.0])["total_apr"]
+    assert grid[1, 0] == pytest.approx(doubled)
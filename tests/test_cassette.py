@@ -0,0 +1,135 @@
+"""
+Cassette record / replay round trips, replay order of repeated keys, replay misses and the index file.
+"""
+
+import asyncio
+import json
+import os
+
+import numpy as np
+import pytest
+
+from cassette import Cassette, INDEX_DTYPE, RECORD, REPLAY, cassette_key
+
+
+class FakeAPI:
+    """
+    Answers every call with its method, params and a call counter, so that repeated calls get different responses.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def request(self, method: str, params):
+        async def request():
+            self.calls += 1
+            return {"jsonrpc": "2.0", "id": self.calls, "result": {"method": method, "params": params,
+                                                                    "call": self.calls}}
+        return request
+
+
+CALLS = [("getSlot", []), ("getAccountInfo", ["A", {"encoding": "base64"}]), ("getSlot", []),
+         ("getAccountInfo", ["B", {"encoding": "base64"}]), ("GET", "https://api.raydium.io/pairs"),
+         ("getAccountInfo", ["A", {"encoding": "base64"}]), ("getSlot", [])]
+
+
+def play(cassette: Cassette, api: FakeAPI, calls=CALLS) -> list:
+    async def main():
+        return [await cassette.call(cassette_key(method, params), api.request(method, params))
+                for method, params in calls]
+    return asyncio.run(main())
+
+
+def test_record_then_replay(tmp_path):
+    path = str(tmp_path / "calls.cassette")
+    api = FakeAPI()
+    cassette = Cassette(path, RECORD)
+    recorded = play(cassette, api)
+    cassette.close()
+    assert cassette.recorded == len(CALLS) and api.calls == len(CALLS)
+
+    cassette = Cassette(path, REPLAY)
+    replayed = play(cassette, api)
+    assert replayed == recorded
+    assert api.calls == len(CALLS) and cassette.replayed == len(CALLS)
+    cassette.close()
+
+
+def test_repeated_keys_replay_in_order(tmp_path):
+    path = str(tmp_path / "calls.cassette")
+    cassette = Cassette(path, RECORD)
+    recorded = play(cassette, FakeAPI())
+    cassette.close()
+
+    cassette = Cassette(path, REPLAY)
+    key = cassette_key("getSlot", [])
+    # The n-th replay of a key is its n-th recorded response, then the last one again
+    slots = [cassette.replay(key) for _ in range(4)]
+    expected = [x for x, (method, _) in zip(recorded, CALLS) if method == "getSlot"]
+    assert [json.loads(x) for x in slots] == expected + expected[-1:]
+    cassette.close()
+
+
+def test_replay_miss(tmp_path):
+    path = str(tmp_path / "calls.cassette")
+    cassette = Cassette(path, RECORD)
+    play(cassette, FakeAPI())
+    cassette.close()
+
+    cassette = Cassette(path, REPLAY)
+    with pytest.raises(ValueError, match="not found"):
+        play(cassette, FakeAPI(), [("getAccountInfo", ["C", {"encoding": "base64"}])])
+    # Same method, other params
+    with pytest.raises(ValueError, match="not found"):
+        cassette.replay(cassette_key("getAccountInfo", ["A", {"encoding": "base58"}]))
+    cassette.close()
+
+    (tmp_path / "other").write_bytes(b"not a cassette")
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "other"), REPLAY)
+    with pytest.raises(ValueError):
+        Cassette(path, "append")
+
+
+def test_index_reloads(tmp_path):
+    path = str(tmp_path / "calls.cassette")
+    cassette = Cassette(path, RECORD)
+    recorded = play(cassette, FakeAPI())
+    cassette.close()
+
+    # Written on close, sorted by key hash then recording order
+    index = np.load(cassette.index_path)
+    assert index.dtype == INDEX_DTYPE and len(index) == len(CALLS)
+    assert np.all(np.diff(index["hash"].astype(float)) >= 0)
+    assert sorted(index["sequence"].tolist()) == [0, 0, 0, 0, 1, 1, 2]
+
+    # An up to date index is memory-mapped as is, not rebuilt
+    mtime = os.path.getmtime(cassette.index_path)
+    cassette = Cassette(path, REPLAY)
+    assert isinstance(cassette._index, np.memmap)
+    assert os.path.getmtime(cassette.index_path) == mtime
+    assert play(cassette, FakeAPI()) == recorded
+    cassette.close()
+
+    # A missing index is rebuilt
+    os.remove(cassette.index_path)
+    cassette = Cassette(path, REPLAY)
+    assert os.path.exists(cassette.index_path) and play(cassette, FakeAPI()) == recorded
+    cassette.close()
+
+
+def test_appending_and_truncated_records(tmp_path):
+    path = str(tmp_path / "calls.cassette")
+    cassette = Cassette(path, RECORD)
+    first = play(cassette, FakeAPI(), CALLS[:3])
+    cassette.close()
+    cassette = Cassette(path, RECORD)
+    second = play(cassette, FakeAPI(), CALLS[3:])
+    cassette.close()
+
+    # A record cut short by an interrupted recording is ignored
+    with open(path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00\x40\x00\x00\x00[\"getSlot\"")
+    os.remove(cassette.index_path)
+    cassette = Cassette(path, REPLAY)
+    assert play(cassette, FakeAPI()) == first + second
+    cassette.close()
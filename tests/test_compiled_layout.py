@@ -0,0 +1,85 @@
+"""
+The compiled decoders must decode exactly what the construct layouts they replace parse.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+import compiled_layout
+from compiled_layout import CompiledLayout, compile_layout
+from stake_layout import OPEN_ORDERS_LAYOUT
+
+
+DECODERS = {name: value for name, value in vars(compiled_layout).items()
+            if name.endswith("_DECODER") and isinstance(value, CompiledLayout)}
+ACCOUNTS = 50
+
+
+def random_account(rnd: random.Random, decoder: CompiledLayout) -> bytes:
+    data = bytearray(rnd.getrandbits(8) for _ in range(decoder.sizeof()))
+    if decoder.layout is OPEN_ORDERS_LAYOUT:
+        # Only the 7 account flag bits may be set, the other 57 bits are a Const(0)
+        data[5:13] = bytes([rnd.getrandbits(7)]) + bytes(7)
+    return bytes(data)
+
+
+def expected_fields(decoder: CompiledLayout, data: bytes) -> dict:
+    parsed = decoder.layout.parse(data)
+    return {name: parsed[name] for name in decoder.fields}
+
+
+def record_value(record, name: str):
+    value = record[name]
+    return value.tobytes() if isinstance(value, np.ndarray) else int(value)
+
+
+@pytest.fixture(params=sorted(DECODERS))
+def decoder(request) -> CompiledLayout:
+    return DECODERS[request.param]
+
+
+def test_sizeof(decoder):
+    assert decoder.sizeof() == decoder.layout.sizeof()
+
+
+def test_parse(decoder):
+    rnd = random.Random(0)
+    for _ in range(ACCOUNTS):
+        data = random_account(rnd, decoder)
+        assert decoder.parse(data)._asdict() == expected_fields(decoder, data)
+
+
+def test_parse_many(decoder):
+    rnd = random.Random(1)
+    accounts = [random_account(rnd, decoder) for _ in range(ACCOUNTS)]
+    records = decoder.parse_many(b"".join(accounts))
+    assert records.dtype == decoder.dtype() and records.dtype.itemsize == decoder.sizeof()
+    assert len(records) == ACCOUNTS
+    for record, data in zip(records, accounts):
+        assert {x: record_value(record, x) for x in decoder.fields} == expected_fields(decoder, data)
+
+
+def test_parse_many_sliced(decoder):
+    rnd = random.Random(2)
+    accounts = [random_account(rnd, decoder) for _ in range(ACCOUNTS)]
+    window = decoder.data_slice()
+    buffer = b"".join(x[window.offset:window.offset + window.length] for x in accounts)
+    records = decoder.parse_many(buffer, sliced=True)
+    assert records.dtype.itemsize == window.length
+    assert len(records) == ACCOUNTS
+    for record, data in zip(records, accounts):
+        assert {x: record_value(record, x) for x in decoder.fields} == expected_fields(decoder, data)
+
+
+def test_data_slice_covers_fields(decoder):
+    window = decoder.data_slice()
+    for name in decoder.fields:
+        assert window.offset <= decoder.offsets[name]
+        assert decoder.offsets[name] + decoder.sizes[name] <= window.offset + window.length
+
+
+def test_unknown_field():
+    with pytest.raises(ValueError):
+        compile_layout(OPEN_ORDERS_LAYOUT, "no_such_field")
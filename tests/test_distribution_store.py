@@ -0,0 +1,140 @@
+"""
+DistributionStore snapshots rebuilt from bases and deltas, and flows over slot ranges.
+"""
+
+import random
+
+import base58
+import numpy as np
+import pytest
+
+from distribution_store import DistributionStore, sorted_distribution
+
+
+def owner(name: str) -> bytes:
+    return name.encode().ljust(32, b"\0")
+
+
+def address(name: str) -> str:
+    return base58.b58encode(owner(name)).decode('utf-8')
+
+
+def scan(amounts: list):
+    """
+    Owner and amount columns of a scan.
+    :param amounts: (owner name, raw amount) pairs, owners may repeat
+    """
+    owners = np.frombuffer(b"".join(owner(name) for name, _ in amounts), dtype=np.uint8).reshape(-1, 32)
+    return owners, np.array([amount for _, amount in amounts], dtype=np.uint64)
+
+
+def as_dict(owners: np.ndarray, amounts: np.ndarray) -> dict:
+    # Reading a 32 byte string element drops its trailing zero bytes
+    return {base58.b58encode(bytes(x).ljust(32, b"\0")).decode('utf-8'): int(y) for x, y in zip(owners, amounts)}
+
+
+def random_scans(count: int, seed: int = 0) -> list:
+    """
+    Scans of 40 possible owners, each present or not and changing amount from one scan to the next.
+    """
+    rnd = random.Random(seed)
+    amounts = {}
+    scans = []
+    for _ in range(count):
+        for name in ("owner{}".format(i) for i in range(40)):
+            if rnd.random() < 0.3:
+                amounts[name] = rnd.choice([0, rnd.randrange(1, 10 ** 12)])
+        # Owners of several accounts, and empty accounts
+        rows = [(name, amount) for name, amount in amounts.items()] + [("owner0", 7), ("owner39", 0)]
+        rnd.shuffle(rows)
+        scans.append(rows)
+    return scans
+
+
+@pytest.mark.parametrize("rebase_every", [1, 3, 168])
+def test_snapshots_match_the_scans(tmp_path, rebase_every):
+    scans = random_scans(12)
+    store = DistributionStore(str(tmp_path), rebase_every=rebase_every)
+    for i, rows in enumerate(scans):
+        store.append("program/pool", 100 * (i + 1), *scan(rows), decimals=6, timestamp=1000.0 + i)
+    assert len(store.scans("program/pool")) == 12
+
+    # Read back by this store and by a new one, which only has the files
+    for reader in (store, DistributionStore(str(tmp_path))):
+        for i, rows in enumerate(scans):
+            expected = as_dict(*sorted_distribution(*scan(rows)))
+            for slot in (100 * (i + 1), 100 * (i + 1) + 50):
+                snapshot = reader.snapshot("program/pool", slot)
+                assert snapshot.slot == 100 * (i + 1) and snapshot.timestamp == 1000.0 + i
+                assert as_dict(snapshot.owners, snapshot.amounts) == expected, (i, slot)
+                assert list(snapshot.owners) == sorted(snapshot.owners)
+        assert reader.snapshot("program/pool").slot == 1200
+
+    with pytest.raises(ValueError):
+        store.snapshot("program/pool", 99)
+    with pytest.raises(ValueError):
+        store.snapshot("other/pool")
+
+
+def test_snapshot_distribution():
+    owners, amounts = sorted_distribution(*scan([("B", 250), ("A", 100), ("B", 50), ("C", 0)]))
+    assert as_dict(owners, amounts) == {address("A"): 100, address("B"): 300}
+
+
+# Raw amounts of 5 owners over 4 scans, with 2 decimals
+FLOW_SCANS = [
+    (10, [("A", 100), ("B", 200), ("C", 300)]),
+    # C exits, D enters, A grows
+    (20, [("A", 150), ("B", 200), ("D", 50)]),
+    # B exits, C enters again, D grows
+    (30, [("A", 150), ("B", 0), ("C", 40), ("D", 80)]),
+    # A shrinks back, E enters
+    (40, [("A", 100), ("C", 40), ("D", 80), ("E", 500)]),
+]
+
+
+def flow_store(path: str) -> DistributionStore:
+    store = DistributionStore(path, rebase_every=2)
+    for slot, rows in FLOW_SCANS:
+        store.append("program/pool", slot, *scan(rows), decimals=2, timestamp=float(slot))
+    return store
+
+
+@pytest.mark.parametrize("start_slot, end_slot, entered, exited, changed, inflow, outflow", [
+    # A 100 -> 150, C 300 -> 0, D 0 -> 50
+    (10, 20, ["D"], ["C"], ["A"], 1.0, 3.0),
+    # B 200 -> 0, C 0 -> 40, D 50 -> 80
+    (20, 30, ["C"], ["B"], ["D"], 0.7, 2.0),
+    # A back to 100 and unchanged overall, B 200 -> 0, C 300 -> 40, D 0 -> 80, E 0 -> 500
+    (10, 40, ["D", "E"], ["B"], ["C"], 5.8, 4.6),
+    (10, None, ["D", "E"], ["B"], ["C"], 5.8, 4.6),
+    # From nothing: B entered and exited within the range
+    (None, 40, ["A", "C", "D", "E"], [], [], 7.2, 0.0),
+    # Slots between scans: the distribution at slot 15 is the scan of slot 10, at slot 35 the scan of slot 30
+    (15, 35, ["D"], ["B"], ["A", "C"], 1.3, 4.6),
+])
+def test_flows(tmp_path, start_slot, end_slot, entered, exited, changed, inflow, outflow):
+    flows = flow_store(str(tmp_path)).flows("program/pool", start_slot, end_slot)
+    assert sorted(flows.entered) == sorted(address(x) for x in entered)
+    assert sorted(flows.exited) == sorted(address(x) for x in exited)
+    assert sorted(flows.changed) == sorted(address(x) for x in changed)
+    assert flows.inflow == pytest.approx(inflow)
+    assert flows.outflow == pytest.approx(outflow)
+    assert flows.net_flow == pytest.approx(inflow - outflow)
+
+
+def test_flows_of_an_empty_range(tmp_path):
+    flows = flow_store(str(tmp_path)).flows("program/pool", 40)
+    assert len(flows) == 0 and flows.net_flow == 0.0
+
+
+def test_append_returns_the_delta(tmp_path):
+    store = DistributionStore(str(tmp_path))
+    first = store.append("program/pool", 10, *scan(FLOW_SCANS[0][1]), decimals=2)
+    assert first.start_slot == -1 and sorted(first.entered) == sorted(address(x) for x in "ABC")
+    delta = store.append("program/pool", 20, *scan(FLOW_SCANS[1][1]), decimals=2)
+    assert (delta.start_slot, delta.end_slot) == (10, 20)
+    assert as_dict(delta.owners, delta.after) == {address("A"): 150, address("C"): 0, address("D"): 50}
+    assert as_dict(delta.owners, delta.before) == {address("A"): 100, address("C"): 300, address("D"): 0}
+    with pytest.raises(ValueError):
+        store.append("program/pool", 20, *scan(FLOW_SCANS[2][1]), decimals=2)
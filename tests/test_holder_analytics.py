@@ -0,0 +1,128 @@
+"""
+Exact concentration statistics of tiny distributions, and summaries through the spawned process pool.
+"""
+
+import asyncio
+
+import base58
+import numpy as np
+import pytest
+
+import holder_analytics
+from holder_analytics import DistributionAnalytics, concentration, summarize_records
+
+RECORD_DTYPE = np.dtype([("pool", "u1", (32,)), ("owner", "u1", (32,)), ("amount", "<u8")])
+
+
+def key(name: str) -> bytes:
+    return name.encode().rjust(32, b"k")
+
+
+def address(name: str) -> str:
+    return base58.b58encode(key(name)).decode('utf-8')
+
+
+def distribution(rows: list):
+    """
+    :param rows: (owner name, raw amount) pairs
+    :return: owners and amounts columns
+    """
+    owners = np.frombuffer(b"".join(key(name) for name, _ in rows), dtype=np.uint8).reshape(-1, 32)
+    return owners, np.array([amount for _, amount in rows], dtype=np.uint64)
+
+
+def test_all_equal():
+    stats = concentration(*distribution([("A", 5), ("B", 5), ("C", 5), ("D", 5)]), decimals=0, label="equal",
+                          top_n=2)
+    assert stats.label == "equal" and stats.accounts == 4 and stats.holders == 4 and stats.total == 20
+    assert stats.gini == pytest.approx(0.0, abs=1e-12)
+    assert stats.hhi == pytest.approx(0.25)
+    assert stats.whales == 4 and stats.whale_share == pytest.approx(1.0)
+    assert stats.top_share == pytest.approx(0.5) and stats.top_amounts == [5.0, 5.0]
+
+
+def test_skewed():
+    # Ascending 1, 1, 1, 7 of 10: gini = 2 * (1 + 2 + 3 + 4 * 7) / (4 * 10) - 5 / 4
+    stats = concentration(*distribution([("A", 100), ("D", 700), ("B", 100), ("C", 100)]), decimals=2, top_n=2,
+                          whale_threshold=0.2)
+    assert stats.total == pytest.approx(10.0)
+    assert stats.gini == pytest.approx(0.45)
+    assert stats.hhi == pytest.approx(3 * 0.1 ** 2 + 0.7 ** 2)
+    assert stats.whales == 1 and stats.whale_share == pytest.approx(0.7)
+    assert stats.top_owners[0] == address("D") and stats.top_amounts == pytest.approx([7.0, 1.0])
+    assert stats.top_share == pytest.approx(0.8)
+
+    # More holders asked for than there are
+    stats = concentration(*distribution([("A", 1), ("B", 3)]), decimals=0, top_n=20)
+    assert stats.top_owners == [address("B"), address("A")] and stats.top_share == pytest.approx(1.0)
+    assert stats.gini == pytest.approx(0.25)
+
+
+def test_single_holder():
+    # Several accounts of one owner, and an empty account
+    stats = concentration(*distribution([("A", 3), ("A", 4), ("B", 0)]), decimals=0)
+    assert stats.accounts == 2 and stats.holders == 1 and stats.total == 7
+    assert stats.gini == pytest.approx(0.0, abs=1e-12) and stats.hhi == pytest.approx(1.0)
+    assert stats.whales == 1 and stats.whale_share == 1.0 and stats.top_share == 1.0
+    assert stats.top_owners == [address("A")] and stats.top_amounts == [7.0]
+
+
+@pytest.mark.parametrize("rows", [[], [("A", 0), ("B", 0)]])
+def test_empty(rows):
+    owners, amounts = distribution(rows) if rows else (np.zeros((0, 32), dtype=np.uint8), np.zeros(0, np.uint64))
+    stats = concentration(owners, amounts, decimals=6, label="empty")
+    assert stats == holder_analytics.HolderStats("empty", 0, 0, 0.0, 0.0, 0.0, 0, 0.0, 0.0, [], [])
+
+
+def records(rows: list, pool: str = "pool") -> np.ndarray:
+    """
+    :param rows: (owner name, raw amount) pairs
+    """
+    result = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    result["pool"] = np.frombuffer(key(pool), dtype=np.uint8)
+    result["owner"], result["amount"] = distribution(rows) if rows else (np.zeros((0, 32), dtype=np.uint8), [])
+    return result
+
+
+def test_summarize_records_of_one_pool():
+    accounts = np.concatenate([records([("A", 1), ("B", 3)]), records([("C", 100)], pool="other")])
+    stats = summarize_records(accounts, "owner", "amount", 0, match=("pool", key("pool")))
+    assert stats.holders == 2 and stats.total == 4 and stats.gini == pytest.approx(0.25)
+    assert summarize_records(accounts, "owner", "amount", 0).total == 104
+
+
+def test_process_pool_releases_shared_memory(monkeypatch):
+    created = []
+
+    class TrackedSharedMemory(holder_analytics.shared_memory.SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self.name)
+
+    # Only the blocks of this process are tracked: the spawned workers import the module afresh
+    monkeypatch.setattr(holder_analytics.shared_memory, "SharedMemory", TrackedSharedMemory)
+    rng = np.random.default_rng(0)
+    rows = [("owner{}".format(i), int(x)) for i, x in enumerate(rng.integers(0, 10 ** 9, 500))]
+    accounts = records(rows + rows[:50])
+    # A trailing partial record is ignored
+    buffer = accounts.tobytes() + b"\0" * 10
+    analytics = DistributionAnalytics(max_workers=1, min_parallel_rows=1, top_n=5)
+
+    async def main():
+        stats = await analytics.summarize(buffer, RECORD_DTYPE, "owner", "amount", 6, label="pool",
+                                          match=("pool", key("pool")))
+        with pytest.raises(ValueError):
+            await analytics.summarize(buffer, RECORD_DTYPE, "owner", "missing", 6)
+        return stats
+
+    try:
+        stats = asyncio.run(main())
+    finally:
+        analytics.close()
+
+    expected = summarize_records(accounts, "owner", "amount", 6, "pool", ("pool", key("pool")), top_n=5)
+    assert stats == expected and stats.holders == 500 and stats.accounts == 550
+    assert len(created) == 2
+    for name in created:
+        with pytest.raises(FileNotFoundError):
+            holder_analytics.shared_memory.SharedMemory(name=name)
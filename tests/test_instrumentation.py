@@ -0,0 +1,116 @@
+"""
+Instrumentation trace tracks, and what the rpc_request span of SolanaAPICall times.
+"""
+
+import asyncio
+import gc
+
+import aiohttp
+from aiohttp import web
+
+from cassette import Cassette, RECORD, REPLAY
+from instrumentation import Instrumentation
+from LPInfo import SolanaAPICall
+from rate_limit import EndpointLimiter
+from rpc_cache import RPCCache
+
+
+def test_tracks_of_finished_tasks_are_dropped():
+    instrumentation = Instrumentation(trace=True)
+
+    async def work():
+        with instrumentation.span("work"):
+            await asyncio.sleep(0)
+
+    async def main():
+        await asyncio.gather(*(work() for _ in range(100)))
+
+    asyncio.run(main())
+    gc.collect()
+    assert len(instrumentation._tracks) == 0
+    asyncio.run(work())
+    tracks = [x["tid"] for x in instrumentation.trace_events]
+    # One track per task, never reused
+    assert sorted(tracks) == list(range(1, 102))
+
+    instrumentation.reset()
+    asyncio.run(work())
+    assert instrumentation.trace_events[0]["tid"] == 1
+
+
+def rpc_request_counts(instrumentation: Instrumentation) -> dict:
+    return {dict(labels)["method"]: histogram.count for (name, labels), histogram in instrumentation.histograms.items()
+            if name == "rpc_request"}
+
+
+def run_with_client(scenario, instrumentation: Instrumentation, **client_options):
+    """
+    Run a scenario with a SolanaAPICall to a local server answering every call after 0.05 seconds.
+    """
+    requests = []
+
+    async def rpc(request):
+        requests.append(await request.json())
+        await asyncio.sleep(0.05)
+        body = requests[-1]
+        if isinstance(body, list):
+            return web.json_response([{"jsonrpc": "2.0", "id": x["id"], "result": 1} for x in body])
+        return web.json_response({"jsonrpc": "2.0", "id": body["id"],
+                                  "result": {"context": {"slot": 10}, "value": {"amount": "1"}}})
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/", rpc)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = "http://127.0.0.1:{}/".format(site._server.sockets[0].getsockname()[1])
+        try:
+            async with aiohttp.ClientSession() as session:
+                client = SolanaAPICall(url, session, instrumentation=instrumentation,
+                                       limiter=EndpointLimiter(max_rate=1000, name="local"), **client_options)
+                await scenario(client)
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(main())
+    return requests
+
+
+def test_rpc_request_times_network_requests_only(tmp_path):
+    instrumentation = Instrumentation(enabled=True)
+
+    async def scenario(client):
+        for _ in range(3):
+            await client.getTokenAccountBalance("Account")
+
+    # Cache hits are not timed
+    requests = run_with_client(scenario, instrumentation, cache=RPCCache(instrumentation=instrumentation))
+    assert len(requests) == 1 and rpc_request_counts(instrumentation) == {"getTokenAccountBalance": 1}
+    histogram = instrumentation.histograms["rpc_request", (("method", "getTokenAccountBalance"),)]
+    assert histogram.sum >= 0.05
+
+    # Recorded calls are timed, replayed ones are not
+    path = str(tmp_path / "calls.cassette")
+    instrumentation.reset()
+    cassette = Cassette(path, RECORD)
+    run_with_client(scenario, instrumentation, cassette=cassette)
+    cassette.close()
+    assert rpc_request_counts(instrumentation) == {"getTokenAccountBalance": 3}
+
+    instrumentation.reset()
+    cassette = Cassette(path, REPLAY)
+    assert run_with_client(scenario, instrumentation, cassette=cassette) == []
+    cassette.close()
+    assert rpc_request_counts(instrumentation) == {} and cassette.replayed == 3
+
+
+def test_rpc_request_times_batches():
+    instrumentation = Instrumentation(enabled=True)
+
+    async def scenario(client):
+        await asyncio.gather(*(client.getSlot() for _ in range(4)))
+
+    requests = run_with_client(scenario, instrumentation, batch_size=4)
+    assert len(requests) == 1 and rpc_request_counts(instrumentation) == {"batch": 1}
@@ -0,0 +1,104 @@
+"""
+JSONArrayStream must return the items json.loads finds in the array, however the document is split into chunks.
+"""
+
+import json
+
+import pytest
+
+from json_codec import BACKENDS, JSONArrayStream, get_codec
+
+
+def program_accounts(count: int) -> list:
+    return [{"pubkey": "Pubkey{}".format(i),
+             "account": {"data": ["AAAA{}==".format(i), "base64"], "executable": False, "lamports": 2039280 + i,
+                         "owner": "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA", "rentEpoch": 200}}
+            for i in range(count)]
+
+
+DOCUMENTS = {
+    "program_accounts": json.dumps({"jsonrpc": "2.0", "result": program_accounts(3), "id": 1}),
+    "pretty": json.dumps({"jsonrpc": "2.0", "id": 1, "result": program_accounts(2)}, indent=2),
+    "escapes": json.dumps({"jsonrpc": "2.0", "result": [
+        {"s": 'a"}b', "t": "\\", "u": ']{["\\"', "v": "\\\\\"]"},
+        {"w": "é€\U0001F600", "x": "\n\t/"}
+    ], "id": 1}, ensure_ascii=False),
+    "nested": json.dumps({"jsonrpc": "2.0", "result": [
+        {"a": {"b": [{"c": [1, 2, [3, {"d": []}]]}, {}]}, "e": [[], [[]]]},
+        [{"f": 1}, [2]],
+        {}
+    ], "id": 7}),
+    "empty": '{"jsonrpc":"2.0","result":[],"id":1}',
+    "key_spacing": '{"jsonrpc": "2.0", "result" :\n [ {"a": 1} ,{"b": 2}\n] , "id": 1}',
+}
+ERRORS = {
+    "error": json.dumps({"jsonrpc": "2.0", "error": {"code": -32600, "message": "Invalid request"}, "id": 1}),
+    "error_quoting_result": json.dumps({"jsonrpc": "2.0", "id": 1,
+                                        "error": {"code": -32005, "message": 'no "result": [ here'}}),
+}
+
+
+def chunked(document: bytes, splits):
+    """
+    Cut a document at the given offsets.
+    """
+    bounds = [0] + list(splits) + [len(document)]
+    return [document[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def parse(chunks, codec):
+    parser = JSONArrayStream("result", codec)
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items, parser.close()
+
+
+@pytest.mark.parametrize("codec", sorted(BACKENDS))
+@pytest.mark.parametrize("name", sorted(DOCUMENTS))
+def test_every_split_point(name, codec):
+    document = DOCUMENTS[name].encode()
+    expected = json.loads(document)["result"]
+    for split in range(len(document) + 1):
+        assert parse(chunked(document, [split]), get_codec(codec)) == (expected, None), split
+
+
+@pytest.mark.parametrize("name", sorted(DOCUMENTS))
+def test_byte_by_byte(name):
+    document = DOCUMENTS[name].encode()
+    chunks = [document[i:i + 1] for i in range(len(document))]
+    assert parse(chunks, get_codec("json")) == (json.loads(document)["result"], None)
+
+
+@pytest.mark.parametrize("name", sorted(DOCUMENTS))
+def test_every_split_pair(name):
+    document = DOCUMENTS[name].encode()
+    expected = json.loads(document)["result"]
+    for first in range(0, len(document) + 1, 3):
+        for second in range(first, len(document) + 1, 5):
+            assert parse(chunked(document, [first, second]), get_codec("json"))[0] == expected, (first, second)
+
+
+@pytest.mark.parametrize("name", sorted(ERRORS))
+def test_document_without_the_array(name):
+    document = ERRORS[name].encode()
+    for split in range(len(document) + 1):
+        assert parse(chunked(document, [split]), get_codec("json")) == ([], json.loads(document)), split
+
+
+def test_items_are_returned_as_they_complete():
+    parser = JSONArrayStream("result")
+    assert parser.feed(b'{"jsonrpc":"2.0","result":[{"a":1},{"b"') == [{"a": 1}]
+    assert parser.feed(b':2}') == [{"b": 2}]
+    assert parser.feed(b',{"c":"}') == []
+    assert parser.feed(b'"}],"id":1}') == [{"c": "}"}]
+    # Bytes after the array are ignored
+    assert parser.feed(b'garbage') == []
+    assert parser.close() is None
+
+
+def test_truncated_array():
+    parser = JSONArrayStream("result")
+    assert parser.feed(b'{"jsonrpc":"2.0","result":[{"a":1},{"b":') == [{"a": 1}]
+    with pytest.raises(ValueError):
+        parser.close()
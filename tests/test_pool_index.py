@@ -0,0 +1,217 @@
+"""
+PoolIndex file round trip and diffs, incremental PoolDiscovery refreshes, and reads of the discovered pools.
+"""
+
+import asyncio
+import base64
+import random
+
+import base58
+import numpy as np
+import pytest
+
+from LPInfo import AccountSnapshot, RaydiumPoolInfo
+from compiled_layout import AMM_INFO_V4_DECODER, OPEN_ORDERS_DECODER, SPL_ACCOUNT_DECODER, SPL_MINT_DECODER
+from pool_index import POOL_DTYPE, PoolDiscovery, PoolIndex, STATE_FIELDS
+
+
+def random_key(rnd: random.Random) -> str:
+    return base58.b58encode(bytes(rnd.getrandbits(8) for _ in range(32))).decode('utf-8')
+
+
+def pool_state(rnd: random.Random, status: int = 1, coin_mint: str = None, pc_mint: str = None) -> bytes:
+    """
+    AMM V4 pool state with random addresses.
+    """
+    state = np.zeros(1, dtype=AMM_INFO_V4_DECODER.dtype())
+    for field in STATE_FIELDS.values():
+        if state.dtype[field].shape:
+            state[field] = np.frombuffer(base58.b58decode(random_key(rnd)), dtype=np.uint8)
+    state["status"] = status
+    state["coinDecimals"] = 6
+    state["pcDecimals"] = 9
+    if coin_mint is not None:
+        state["coinMintAddress"] = np.frombuffer(base58.b58decode(coin_mint), dtype=np.uint8)
+    if pc_mint is not None:
+        state["pcMintAddress"] = np.frombuffer(base58.b58decode(pc_mint), dtype=np.uint8)
+    return state.tobytes()
+
+
+def make_index(states: dict, updated_at: float = 1000.0) -> PoolIndex:
+    amm_ids = list(states)
+    buffer = b"".join(states[x] for x in amm_ids)
+    records = AMM_INFO_V4_DECODER.parse_many(buffer)
+    pools = np.zeros(len(amm_ids), dtype=POOL_DTYPE)
+    pools["amm_id"] = [np.frombuffer(base58.b58decode(x), dtype=np.uint8) for x in amm_ids]
+    pools["version"] = 4
+    for name, field in STATE_FIELDS.items():
+        pools[name] = records[field]
+    return PoolIndex.from_records(pools, updated_at)
+
+
+def test_round_trip(tmp_path):
+    rnd = random.Random(0)
+    states = {random_key(rnd): pool_state(rnd) for _ in range(20)}
+    index = make_index(states, updated_at=1234.5)
+    path = str(tmp_path / "data" / "pools.idx")
+    index.save(path)
+
+    loaded = PoolIndex.load(path)
+    assert isinstance(loaded.records, np.memmap)
+    assert len(loaded) == 20 and loaded.updated_at == 1234.5
+    assert loaded.records.tobytes() == index.records.tobytes()
+    assert loaded.amm_ids == sorted(states, key=lambda x: base58.b58decode(x))
+    assert not index.diff(loaded)
+
+    amm_id = next(iter(states))
+    pool = loaded.get(amm_id)
+    assert amm_id in loaded and pool["amm_id"] == amm_id
+    assert pool["status"] == 1 and pool["coin_decimals"] == 6 and pool["pc_decimals"] == 9
+    state = AMM_INFO_V4_DECODER.parse(states[amm_id])
+    assert pool["lp_mint"] == base58.b58encode(state.lpMintAddress).decode('utf-8')
+    assert random_key(rnd) not in loaded and loaded.get(random_key(rnd)) is None
+
+
+def test_empty_and_missing_files(tmp_path):
+    path = str(tmp_path / "pools.idx")
+    assert len(PoolIndex.load(path)) == 0
+    PoolIndex(updated_at=5.0).save(path)
+    loaded = PoolIndex.load(path)
+    assert len(loaded) == 0 and loaded.updated_at == 5.0
+
+    (tmp_path / "other.idx").write_bytes(b"not an index" * 10)
+    with pytest.raises(ValueError):
+        PoolIndex.load(str(tmp_path / "other.idx"))
+
+
+def test_from_records_keeps_the_last_record():
+    rnd = random.Random(1)
+    amm_id = random_key(rnd)
+    index = make_index({amm_id: pool_state(rnd, status=1)})
+    records = np.concatenate([index.records, make_index({amm_id: pool_state(rnd, status=6)}).records])
+    merged = PoolIndex.from_records(records)
+    assert len(merged) == 1 and merged.get(amm_id)["status"] == 6
+
+
+def test_diff():
+    rnd = random.Random(2)
+    states = {random_key(rnd): pool_state(rnd) for _ in range(6)}
+    old = make_index(states)
+    kept, removed, changed = list(states)[:4], list(states)[4:], list(states)[0]
+    new_states = {x: states[x] for x in kept}
+    new_states[changed] = bytearray(states[changed])
+    new_states[changed][AMM_INFO_V4_DECODER.offsets["status"]] = 7
+    added = random_key(rnd)
+    new_states[added] = pool_state(rnd)
+
+    diff = old.diff(make_index(new_states))
+    assert diff.added == [added]
+    assert sorted(diff.removed) == sorted(removed)
+    assert diff.changed == [changed]
+
+
+class FakeSolana:
+    """
+    AMM program accounts served from a dict of AMM id -> pool state.
+    """
+    def __init__(self, states: dict):
+        self.states = states
+        self.scans = []
+        self.reads = []
+
+    async def iterProgramAccounts(self, program_id, data_size=None, data_slice=None):
+        self.scans.append(data_slice)
+        for amm_id, state in self.states.items():
+            assert len(state) == data_size
+            data = state[data_slice.offset:data_slice.offset + data_slice.length]
+            yield {"pubkey": amm_id, "account": {"data": [base64.b64encode(data).decode(), "base64"]}}
+
+    async def getMultipleAccountsChunked(self, publicKeys):
+        self.reads.append(list(publicKeys))
+        accounts = AccountSnapshot()
+        for x in publicKeys:
+            accounts.set(x, base64.b64encode(self.states[x]).decode() if x in self.states else None, 1)
+        return accounts
+
+
+def test_incremental_refresh(tmp_path):
+    rnd = random.Random(3)
+    path = str(tmp_path / "pools.idx")
+    states = {random_key(rnd): pool_state(rnd) for _ in range(5)}
+    solana = FakeSolana(states)
+
+    # First refresh: one full scan
+    diff = asyncio.run(PoolDiscovery(solana, path).refresh())
+    assert sorted(diff.added) == sorted(states) and not diff.removed and not diff.changed
+    assert solana.scans == [AMM_INFO_V4_DECODER.data_slice()] and not solana.reads
+
+    # Later refresh: list the pools, read the new one only, drop the closed one. The status change of a known pool is
+    # not seen without a full refresh.
+    closed, changed = list(states)[:2]
+    del states[closed]
+    states[changed] = pool_state(rnd, status=6)
+    new = random_key(rnd)
+    states[new] = pool_state(rnd)
+    discovery = PoolDiscovery(solana, path)
+    diff = asyncio.run(discovery.refresh())
+    assert diff.added == [new] and diff.removed == [closed] and diff.changed == []
+    assert solana.scans[-1].length == 0 and solana.reads == [[new]]
+    assert discovery.index.get(changed)["status"] == 1
+
+    diff = asyncio.run(PoolDiscovery(solana, path).refresh(full=True))
+    assert diff.added == [] and diff.removed == [] and diff.changed == [changed]
+    assert PoolIndex.load(path).get(changed)["status"] == 6
+    assert sorted(PoolIndex.load(path).amm_ids) == sorted(states)
+
+
+def encode(array: np.ndarray) -> str:
+    return base64.b64encode(array.tobytes()).decode()
+
+
+class FakeRaydium:
+    async def get_price(self):
+        return {"RAY": 2.0, "USDC": 1.0}
+
+
+def test_discovered_pools_are_read():
+    rnd = random.Random(4)
+    pool_info = RaydiumPoolInfo(None)
+    ray, usdc = pool_info.get_token_address("RAY"), pool_info.get_token_address("USDC")
+    unknown = random_key(rnd)
+    configured = next(iter(pool_info.LP_address_info.values()))["ammId"]
+    states = {random_key(rnd): pool_state(rnd, coin_mint=ray, pc_mint=usdc),
+              random_key(rnd): pool_state(rnd, coin_mint=unknown, pc_mint=usdc),
+              configured: pool_state(rnd, coin_mint=ray, pc_mint=usdc)}
+    pool_info = RaydiumPoolInfo(None, pool_index=make_index(states))
+
+    # Configured pools are not added again, names taken by a configured pool get the start of the AMM id
+    known = list(states)[0]
+    assert sorted(pool_info.discovered_pools) == sorted(["RAY-USDC-" + known[:8], unknown + "-USDC"])
+    assert pool_info.LP_addresses["RAY-USDC-" + known[:8]]["coin"] == "RAY"
+
+    vault = np.zeros(1, dtype=SPL_ACCOUNT_DECODER.dtype())
+    vault["amount"] = 3 * 10 ** 6
+    mint = np.zeros(1, dtype=SPL_MINT_DECODER.dtype())
+    mint["supply"], mint["decimals"] = 10 ** 7, 6
+    open_orders = np.zeros(1, dtype=OPEN_ORDERS_DECODER.dtype())
+    data = {"coin_in_pool_address": encode(vault), "pc_in_pool_address": encode(vault),
+            "lp_mint_address": encode(mint), "pool_amm_address": encode(open_orders)}
+    accounts = {pool_info.LP_addresses[x][key]: value for x in pool_info.discovered_pools
+                for key, value in data.items()}
+
+    class Solana:
+        async def getMultipleAccountsChunked(self, publicKeys):
+            assert len(publicKeys) == len(set(publicKeys)) == 8
+            return {x: accounts[x] for x in publicKeys}
+
+    pool_info.SOLANA = Solana()
+    pool_info.RAYDIUM = FakeRaydium()
+    pools = dict(x for result in asyncio.run(pool_info.get_discovered_pools()) for x in result.items())
+
+    priced = pools["RAY-USDC-" + known[:8]]
+    assert priced["coinAmount"] == 3 and priced["pcAmount"] == 3 * 10 ** -3 and priced["lp_supply"] == 10
+    assert priced["liquidity"] == pytest.approx(3 * 2.0 + 0.003 * 1.0)
+    assert priced["lp_share_price"] == pytest.approx(0.6003)
+    unpriced = pools[unknown + "-USDC"]
+    assert unpriced["coin_price"] is None and unpriced["liquidity"] is None and unpriced["lp_share_price"] is None
+    assert unpriced["coinAmount"] == 3
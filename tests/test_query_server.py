@@ -0,0 +1,137 @@
+"""
+SnapshotServer routes over HTTP: the snapshot, farm selections, unknown farms, If-None-Match and /metrics.
+"""
+
+import asyncio
+import json
+
+import aiohttp
+
+from instrumentation import Instrumentation
+from query_server import SnapshotServer, _none_match
+
+RESULTS = [{"RAY-USDC": {"RAY_APR": 10.0, "liquidity": 1000.0}},
+           {"RAY-SOL": {"RAY_APR": 20.0, "liquidity": 2000.0}},
+           {"RAY-SRM": {"RAY_APR": 30.0, "liquidity": 3000.0, "FIDA_APR": 1.5}}]
+
+
+def run_with_server(scenario, **server_options):
+    """
+    Run a scenario with a client session and a SnapshotServer on a free port, which published RESULTS.
+    """
+    async def main():
+        server_options.setdefault("instrumentation", Instrumentation())
+        server = SnapshotServer(port=0, **server_options)
+        server.publish(RESULTS)
+        await server.start()
+        try:
+            async with aiohttp.ClientSession("http://127.0.0.1:{}".format(server.port)) as session:
+                await scenario(server, session)
+        finally:
+            await server.close()
+    asyncio.run(main())
+
+
+async def get(session: aiohttp.ClientSession, path: str, **kwargs):
+    async with session.get(path, **kwargs) as response:
+        return response.status, response.headers, await response.read()
+
+
+def test_farms():
+    async def scenario(server, session):
+        status, headers, body = await get(session, "/farms")
+        assert status == 200 and headers["Content-Type"].startswith("application/json")
+        assert json.loads(body) == {farm: info for result in RESULTS for farm, info in result.items()}
+        assert headers["X-Snapshot-Version"] == "1" and headers["ETag"].startswith('"')
+
+        status, _, body = await get(session, "/farms/RAY-SOL")
+        assert status == 200 and json.loads(body) == RESULTS[1]["RAY-SOL"]
+
+        server.update([{"RAY-SOL": {"RAY_APR": 25.0, "liquidity": 2000.0}}])
+        status, headers, body = await get(session, "/farms")
+        assert json.loads(body)["RAY-SOL"]["RAY_APR"] == 25.0 and headers["X-Snapshot-Version"] == "2"
+        assert len(json.loads(body)) == 3
+
+    run_with_server(scenario)
+
+
+def test_farm_selection():
+    async def scenario(server, session):
+        expected = {"RAY-SRM": RESULTS[2]["RAY-SRM"], "RAY-USDC": RESULTS[0]["RAY-USDC"]}
+        for params in ({"farm": "RAY-SRM,RAY-USDC"}, [("farm", "RAY-SRM"), ("farm", "RAY-USDC")],
+                       {"farm": "RAY-SRM,,RAY-USDC,RAY-SRM"}):
+            status, _, body = await get(session, "/farms", params=params)
+            assert status == 200 and json.loads(body) == expected
+            # In the requested order
+            assert list(json.loads(body)) == ["RAY-SRM", "RAY-USDC"]
+        assert len(server._selections) == 1
+
+        _, headers, _ = await get(session, "/farms", params={"farm": "RAY-SOL"})
+        _, single, _ = await get(session, "/farms/RAY-SOL")
+        _, snapshot, _ = await get(session, "/farms")
+        assert len({headers["ETag"], single["ETag"], snapshot["ETag"]}) == 3
+
+    run_with_server(scenario)
+
+
+def test_unknown_farm():
+    async def scenario(server, session):
+        status, _, body = await get(session, "/farms/RAY-ETH")
+        assert status == 404 and b"RAY-ETH" in body
+        status, _, body = await get(session, "/farms", params={"farm": "RAY-USDC,RAY-ETH,RAY-BTC"})
+        assert status == 404 and b"RAY-ETH, RAY-BTC" in body
+        assert server.requests["/farms/{farm}", 404] == 1 and server.requests["/farms", 404] == 1
+
+    run_with_server(scenario)
+
+
+def test_not_modified():
+    async def scenario(server, session):
+        _, headers, _ = await get(session, "/farms")
+        etag = headers["ETag"]
+        for value in (etag, "W/" + etag, "*", '"other", ' + etag, '"other",W/{} , "last"'.format(etag)):
+            status, headers, body = await get(session, "/farms", headers={"If-None-Match": value})
+            assert status == 304 and body == b"" and headers["ETag"] == etag, value
+
+        # Parts of the tag, other tags and stale tags get the body
+        server.update([{"RAY-SOL": {"RAY_APR": 25.0}}])
+        for value in (etag, etag[1:-1], '"{}"'.format(etag[1:9]), '"x{}"'.format(etag[1:-1]), '"other"', ""):
+            status, _, body = await get(session, "/farms", headers={"If-None-Match": value})
+            assert status == 200 and json.loads(body)["RAY-SOL"] == {"RAY_APR": 25.0}, value
+
+        _, headers, _ = await get(session, "/farms/RAY-USDC")
+        status, _, _ = await get(session, "/farms/RAY-USDC", headers={"If-None-Match": headers["ETag"]})
+        assert status == 304
+        assert server.requests["/farms", 304] == 5 and server.requests["/farms/{farm}", 304] == 1
+
+    run_with_server(scenario)
+
+
+def test_none_match():
+    assert _none_match('"a", W/"b"', '"b"')
+    assert _none_match('"a,b"', '"a,b"')
+    assert not _none_match('"a,b"', '"a"')
+    assert not _none_match('"ab"', '"a"')
+    assert not _none_match('""a""', '"a"')
+    assert not _none_match(None, '"a"')
+
+
+def test_metrics():
+    instrumentation = Instrumentation()
+    instrumentation.enable()
+    instrumentation.observe("rpc_request", 0.01, method="getSlot")
+
+    async def scenario(server, session):
+        await get(session, "/farms")
+        await get(session, "/farms/RAY-ETH")
+        status, headers, body = await get(session, "/metrics")
+        assert status == 200 and headers["Content-Type"].startswith("text/plain")
+        text = body.decode()
+        assert 'query_server_requests_total{route="/farms",status="200"} 1' in text
+        assert 'query_server_requests_total{route="/farms/{farm}",status="404"} 1' in text
+        assert "query_server_snapshot_version 1\n" in text and "query_server_snapshot_farms 3\n" in text
+        assert "query_server_snapshot_bytes {}\n".format(len(server._body)) in text
+        assert "query_server_snapshot_age_seconds" in text and "pool_count 7\n" in text
+        assert "rpc_request" in text
+
+    run_with_server(scenario, metrics=lambda: {"pool_count": 7}, instrumentation=instrumentation)
@@ -0,0 +1,71 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+import rate_limit
+from LPInfo import RaydiumPoolInfo, SOLANA_ENDPOINT
+from rate_limit import EndpointLimiter, get_limiter
+
+
+@pytest.fixture(autouse=True)
+def shared_limiters(monkeypatch):
+    # get_limiter is process-wide: every test starts without shared limiters, and leaves none behind
+    monkeypatch.setattr(rate_limit, "_LIMITERS", {})
+
+
+def too_many_requests(retry_after="0.05"):
+    return aiohttp.ClientResponseError(None, (), status=429, headers={"Retry-After": retry_after})
+
+
+def test_throttle_halves_once_per_pause():
+    limiter = EndpointLimiter(max_rate=16, min_rate=1)
+    limiter._throttle(1.0)
+    # 429s of requests sent before the pause only extend it
+    limiter._throttle(1.0)
+    limiter._throttle(2.0)
+    assert limiter.rate == 8
+    assert limiter.throttled == 3
+
+
+def test_throttle_halves_again_after_the_pause():
+    limiter = EndpointLimiter(max_rate=16, min_rate=1)
+    limiter._throttle(0.0)
+    limiter._throttle(0.0)
+    assert limiter.rate == 4
+    limiter._throttle(0.0)
+    limiter._throttle(0.0)
+    limiter._throttle(0.0)
+    assert limiter.rate == 1
+
+
+def test_concurrent_429_burst_halves_once():
+    limiter = EndpointLimiter(max_rate=16, max_concurrency=16, backoff_base=0.01)
+    attempts = []
+
+    async def request():
+        attempts.append(None)
+        if len(attempts) <= 8:
+            await asyncio.sleep(0.01)
+            raise too_many_requests()
+        return "ok"
+
+    async def burst():
+        return await asyncio.gather(*(limiter.call(request) for _ in range(8)))
+
+    assert asyncio.run(burst()) == ["ok"] * 8
+    assert limiter.throttled == 8
+    # halved once, then one recovery step after the retries went through
+    assert limiter.rate == 9
+
+
+def test_rpc_rate_is_scoped_to_the_pool_info():
+    shared = get_limiter(SOLANA_ENDPOINT)
+    pool_info = RaydiumPoolInfo(None, rpc_rate=25)
+    for client in pool_info.RPC_CLIENTS:
+        assert client._limiter is not get_limiter(client._endpoint)
+        assert client._limiter.max_rate == client._limiter.rate == 25
+    assert shared.max_rate == shared.rate == 10
+
+    default = RaydiumPoolInfo(None)
+    assert [x._limiter for x in default.RPC_CLIENTS] == [get_limiter(x._endpoint) for x in default.RPC_CLIENTS]
@@ -0,0 +1,165 @@
+"""
+AdaptiveRefresh on a fake pool info and budget: request costs, the square root interval rule, due farms and the
+refresh loop surviving failed batches.
+"""
+
+import asyncio
+import math
+
+import pytest
+
+from fetch_planner import FetchPlan, FARM_READS
+from refresh_scheduler import AdaptiveRefresh
+
+
+class FakeBudget:
+    """
+    TokenBucket stand-in granting every request at once and recording the charges.
+    """
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.charges = []
+
+    async def acquire(self, tokens: float = 1) -> float:
+        self.charges.append(tokens)
+        return 0.0
+
+
+class FakePoolInfo:
+    """
+    The parts of RaydiumPoolInfo AdaptiveRefresh uses. Farms A and B share their LP accounts, C reads its own.
+    """
+    def __init__(self, liquidity: dict, chunk_size: int = 100, failures=()):
+        """
+        :param liquidity: farm name -> liquidity of its results
+        :param chunk_size: accounts per getMultipleAccounts call
+        :param failures: exceptions raised by the first get_all_APR calls, in order
+        """
+        self.liquidity = dict(liquidity)
+        self.apr = {farm: 10.0 for farm in liquidity}
+        self.chunk_size = chunk_size
+        self.failures = list(failures)
+        self.calls = []
+        lp = {"A": "LP1", "B": "LP1", "C": "LP2"}
+        self.LP_addresses = {farm: {key: "{}-{}".format(lp[farm], key) for _, source, key in FARM_READS
+                                    if source == "LP_addresses"} for farm in liquidity}
+        self.farms_info = {farm: {key: "{}-{}".format(farm, key) for _, source, key in FARM_READS
+                                  if source == "farms_info"} for farm in liquidity}
+
+    def plan_cycle(self, farms=None):
+        return FetchPlan.from_config(self.farms_info, self.LP_addresses, farms, chunk_size=self.chunk_size)
+
+    async def get_all_APR(self, farms=None):
+        self.calls.append(list(farms))
+        if self.failures:
+            raise self.failures.pop(0)
+        return [{farm: {"liquidity": self.liquidity[farm], "RAY_APR": self.apr[farm]}} for farm in farms]
+
+
+def observe(refresh: AdaptiveRefresh, farm: str, liquidity: float, apr: float = 10.0, now: float = 0.0):
+    refresh._observe(farm, {"liquidity": liquidity, "RAY_APR": apr}, now)
+
+
+def test_cost_counts_whole_requests():
+    pool_info = FakePoolInfo({"A": 1, "B": 1, "C": 1})
+    refresh = AdaptiveRefresh(pool_info, FakeBudget(1))
+    # 6 reads fit one getMultipleAccounts call, the price snapshot is not charged
+    assert refresh.cost(["A"]) == 1
+    assert refresh.cost(["A", "B", "C"]) == 1
+
+    pool_info = FakePoolInfo({"A": 1, "B": 1, "C": 1}, chunk_size=4)
+    refresh = AdaptiveRefresh(pool_info, FakeBudget(1))
+    assert refresh.cost(["A"]) == 2
+    # A and B share their 4 LP accounts: 4 + 2 + 2 accounts
+    assert refresh.cost(["A", "B"]) == 2
+    assert refresh.cost(["A", "B", "C"]) == 4
+
+
+def test_square_root_intervals():
+    refresh = AdaptiveRefresh(FakePoolInfo({"A": 1, "B": 1}), FakeBudget(2), min_interval=0.1)
+    observe(refresh, "A", 100, now=5.0)
+    observe(refresh, "B", 400, now=7.0)
+    refresh.plan_intervals()
+
+    # interval_i = sqrt(cost_i / weight_i) * sum_j sqrt(cost_j * weight_j) / budget, costs of 1
+    total = math.sqrt(100) + math.sqrt(400)
+    assert refresh.schedules["A"].interval == pytest.approx(math.sqrt(1 / 100) * total / 2)
+    assert refresh.schedules["B"].interval == pytest.approx(math.sqrt(1 / 400) * total / 2)
+    assert refresh.schedules["A"].next_at == pytest.approx(5.0 + 1.5)
+    assert refresh.schedules["B"].next_at == pytest.approx(7.0 + 0.75)
+    # The planned request rate spends the whole budget
+    assert sum(1 / x.interval for x in refresh.schedules.values()) == pytest.approx(2)
+
+
+def test_intervals_are_clamped():
+    refresh = AdaptiveRefresh(FakePoolInfo({"A": 1, "B": 1, "C": 1}), FakeBudget(1), min_interval=10,
+                              max_interval=600)
+    observe(refresh, "A", 1e12)
+    observe(refresh, "B", 1)
+    observe(refresh, "C", 0)
+    refresh.plan_intervals()
+    assert refresh.schedules["A"].interval == 10
+    assert refresh.schedules["B"].interval == 600
+    assert refresh.schedules["C"].interval == 600
+
+
+def test_unknown_farms_are_not_planned():
+    refresh = AdaptiveRefresh(FakePoolInfo({"A": 1, "B": 1}), FakeBudget(1), min_interval=0.1)
+    observe(refresh, "A", 100)
+    refresh.plan_intervals()
+    assert refresh.schedules["A"].interval == pytest.approx(1.0)
+    assert refresh.schedules["B"].last_at is None and refresh.schedules["B"].next_at == 0.0
+
+
+def test_volatility_raises_the_weight():
+    refresh = AdaptiveRefresh(FakePoolInfo({"A": 1}), FakeBudget(1), volatility_weight=10, smoothing=0.3)
+    observe(refresh, "A", 100, apr=10.0)
+    assert refresh.weight("A") == 100
+    observe(refresh, "A", 100, apr=20.0)
+    assert refresh.schedules["A"].volatility == pytest.approx(0.3)
+    assert refresh.weight("A") == pytest.approx(100 * (1 + 10 * 0.3))
+
+
+def test_due_coalesces_close_farms():
+    refresh = AdaptiveRefresh(FakePoolInfo({"A": 1, "B": 1, "C": 1}), FakeBudget(1), coalesce=1.0)
+    refresh.schedules["A"].next_at = 100.0
+    refresh.schedules["B"].next_at = 100.8
+    refresh.schedules["C"].next_at = 102.0
+    assert refresh.due(99.0) == ["A"]
+    assert refresh.due(99.9) == ["A", "B"]
+    assert refresh.due(101.0) == ["A", "B", "C"]
+
+
+def test_refresh_charges_the_budget():
+    budget = FakeBudget(1)
+    pool_info = FakePoolInfo({"A": 100, "B": 400, "C": 0}, chunk_size=4)
+    updates = []
+    refresh = AdaptiveRefresh(pool_info, budget, on_update=lambda farm, info: updates.append(farm))
+    results = asyncio.run(refresh.refresh(["A", "B"]))
+    assert budget.charges == [2]
+    assert results == [{"A": {"liquidity": 100, "RAY_APR": 10.0}}, {"B": {"liquidity": 400, "RAY_APR": 10.0}}]
+    assert updates == ["A", "B"]
+    assert set(refresh.results) == {"A", "B"}
+    assert refresh.schedules["A"].refreshes == 1 and refresh.schedules["C"].refreshes == 0
+
+
+def test_run_survives_failed_batches():
+    pool_info = FakePoolInfo({"A": 100, "B": 400},
+                             failures=[TypeError("'NoneType' object is not subscriptable"),
+                                       ZeroDivisionError("float division by zero")])
+    refresh = AdaptiveRefresh(pool_info, FakeBudget(100), min_interval=0.01, max_interval=0.05)
+
+    async def main():
+        task = asyncio.ensure_future(refresh.run())
+        try:
+            for _ in range(500):
+                if len(refresh.results) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            assert not task.done()
+        finally:
+            task.cancel()
+
+    asyncio.run(main())
+    assert pool_info.calls[:3] == [["A", "B"]] * 3
+    assert set(refresh.results) == {"A", "B"}
@@ -0,0 +1,211 @@
+"""
+SingleFlight coalescing, and the RPCCache policies: TTL, slot bound, errors and LRU eviction.
+"""
+
+import asyncio
+
+import pytest
+
+import rpc_cache
+from instrumentation import Instrumentation
+from rpc_cache import CachePolicy, RPCCache, SingleFlight
+
+
+def response(value, slot: int = 100) -> dict:
+    return {"jsonrpc": "2.0", "id": 1, "result": {"context": {"slot": slot}, "value": value}}
+
+
+class FakeEndpoint:
+    """
+    Request factory counting the requests made, answering after delay seconds with the given slot.
+    """
+    def __init__(self, slot: int = 100, delay: float = 0.0, error: Exception = None):
+        self.slot = slot
+        self.delay = delay
+        self.error = error
+        self.requests = 0
+
+    def request(self, value=None):
+        async def request():
+            self.requests += 1
+            await asyncio.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            return response(value, self.slot)
+        return request
+
+
+def call(method: str, *params) -> dict:
+    return {"jsonrpc": "2.0", "id": 1, "method": method, "params": list(params)}
+
+
+def make_cache(**kwargs) -> RPCCache:
+    return RPCCache(instrumentation=Instrumentation(), **kwargs)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rpc_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    endpoint = FakeEndpoint(delay=0.01)
+
+    async def main():
+        results = await asyncio.gather(*(flights.do("key", endpoint.request("a")) for _ in range(5)),
+                                       flights.do("other", endpoint.request("b")))
+        assert not flights.in_flight("key")
+        # Done calls are not joined
+        await flights.do("key", endpoint.request("c"))
+        return results
+
+    results = asyncio.run(main())
+    assert [x["result"]["value"] for x in results] == ["a"] * 5 + ["b"]
+    assert results[0] is results[4]
+    assert endpoint.requests == 3 and flights.coalesced == 4
+
+
+def test_single_flight_survives_a_cancelled_caller():
+    flights = SingleFlight()
+    endpoint = FakeEndpoint(delay=0.02)
+
+    async def main():
+        first = asyncio.ensure_future(flights.do("key", endpoint.request("a")))
+        second = asyncio.ensure_future(flights.do("key", endpoint.request("b")))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main())["result"]["value"] == "a"
+    assert endpoint.requests == 1
+
+
+def test_cache_coalesces_concurrent_calls():
+    cache = make_cache()
+    endpoint = FakeEndpoint(delay=0.01)
+
+    async def main():
+        return await asyncio.gather(*(cache.call("url", call("getTokenSupply", "Mint"), endpoint.request())
+                                      for _ in range(4)))
+
+    results = asyncio.run(main())
+    assert endpoint.requests == 1 and all(x is results[0] for x in results)
+    stats = cache.stats()
+    assert stats["misses"] == 4 and stats["coalesced"] == 3 and stats["hits"] == 0 and stats["entries"] == 1
+    # Keyed on endpoint, method and params, not on the request id
+    request = call("getTokenSupply", "Mint")
+    request["id"] = 7
+    assert asyncio.run(cache.call("url", request, endpoint.request())) is results[0]
+    asyncio.run(cache.call("other url", request, endpoint.request()))
+    asyncio.run(cache.call("url", call("getTokenSupply", "Other mint"), endpoint.request()))
+    assert endpoint.requests == 3
+
+
+def test_methods_without_policy_are_only_coalesced():
+    cache = make_cache()
+    endpoint = FakeEndpoint()
+    for _ in range(3):
+        asyncio.run(cache.call("url", call("getSlot"), endpoint.request()))
+    assert endpoint.requests == 3 and cache.stats()["entries"] == 0
+
+
+def test_ttl_expiry(clock):
+    cache = make_cache(policies={"getTokenSupply": CachePolicy(ttl=30.0)})
+    endpoint = FakeEndpoint()
+    request = call("getTokenSupply", "Mint")
+    asyncio.run(cache.call("url", request, endpoint.request()))
+    clock[0] += 29.9
+    asyncio.run(cache.call("url", request, endpoint.request()))
+    assert endpoint.requests == 1 and cache.hits["getTokenSupply"] == 1
+    clock[0] += 0.1
+    asyncio.run(cache.call("url", request, endpoint.request()))
+    assert endpoint.requests == 2 and cache.stats()["entries"] == 1
+
+
+def test_account_reads_are_bound_to_two_slots(clock):
+    cache = make_cache()
+    account, slots = FakeEndpoint(slot=100), FakeEndpoint()
+    request = call("getAccountInfo", "Account")
+
+    def read():
+        return asyncio.run(cache.call("url", request, account.request()))
+
+    read()
+    for slot, requests in ((101, 1), (102, 1), (103, 2)):
+        # Any response carrying a newer slot ages the cached account state
+        slots.slot = slot
+        asyncio.run(cache.call("url", call("getTokenAccountBalance", str(slot)), slots.request()))
+        account.slot = slot
+        read()
+        assert account.requests == requests, slot
+    assert cache.latest_slot == 103
+
+    # Without newer slots, the TTL still applies
+    clock[0] += 1.0
+    read()
+    assert account.requests == 3
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    cache = make_cache()
+    endpoint = FakeEndpoint(delay=0.01, error=ValueError("node behind"))
+    request = call("getTokenSupply", "Mint")
+
+    async def main():
+        return await asyncio.gather(*(cache.call("url", request, endpoint.request()) for _ in range(3)),
+                                    return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert endpoint.requests == 1
+    assert all(isinstance(x, ValueError) and str(x) == "node behind" for x in errors)
+    assert cache.stats()["entries"] == 0
+
+    endpoint.error = None
+    asyncio.run(cache.call("url", request, endpoint.request("supply")))
+    assert endpoint.requests == 2
+
+    # Nor are JSON RPC error responses
+    async def error_response():
+        return {"jsonrpc": "2.0", "id": 1, "error": {"code": -32005, "message": "Node is behind"}}
+    cache = make_cache()
+    for _ in range(2):
+        assert "error" in asyncio.run(cache.call("url", request, error_response))
+    assert cache.stats()["entries"] == 0 and cache.misses["getTokenSupply"] == 2
+
+
+def test_lru_eviction():
+    cache = make_cache(max_entries=3)
+    endpoint = FakeEndpoint()
+
+    def read(mint):
+        return asyncio.run(cache.call("url", call("getTokenSupply", mint), endpoint.request(mint)))
+
+    for mint in "ABC":
+        read(mint)
+    # A is used again: B is now the least recently used
+    read("A")
+    read("D")
+    assert cache.evictions == 1 and cache.stats()["entries"] == 3
+    requests = endpoint.requests
+    for mint in "ACD":
+        read(mint)
+    assert endpoint.requests == requests
+    read("B")
+    assert endpoint.requests == requests + 1 and cache.evictions == 2
+
+
+def test_byte_bound():
+    cache = make_cache()
+    size = len(RPCCache.key("url", "getTokenSupply", ["A"])) + len(cache._codec.dumps(response("A")))
+    cache = make_cache(max_bytes=2 * size)
+    endpoint = FakeEndpoint()
+    for mint in "ABC":
+        asyncio.run(cache.call("url", call("getTokenSupply", mint), endpoint.request(mint)))
+    assert cache.stats()["entries"] == 2 and cache.size == 2 * size and cache.evictions == 1
+
+    cache = make_cache(max_bytes=size - 1)
+    asyncio.run(cache.call("url", call("getTokenSupply", "A"), endpoint.request("A")))
+    assert cache.stats()["entries"] == 0 and cache.size == 0
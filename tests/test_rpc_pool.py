@@ -0,0 +1,270 @@
+"""
+SolanaRPCPool against local stub RPC servers: failover, circuit breaker, half-open trial and hedging, and the
+retry and failover rules of streamed getProgramAccounts calls.
+"""
+
+import asyncio
+import json
+import time
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+import pytest
+
+from LPInfo import SolanaAPICall, SolanaRPCPool
+from rate_limit import EndpointLimiter
+from rpc_pool import EndpointHealth, rank_endpoints
+
+
+def program_accounts(name: str, count: int = 5) -> list:
+    return [{"pubkey": "{}{}".format(name, i), "account": {"data": ["AAAA", "base64"], "lamports": i}}
+            for i in range(count)]
+
+
+class StubRPC:
+    """
+    JSON RPC server answering every request with its name, after delay seconds, or with an HTTP status.
+
+    getProgramAccounts is answered with ACCOUNTS tagged with the server name. With drop_after set, the connection is
+    closed once that many accounts were sent.
+    """
+    def __init__(self, name: str, status: int = 200, delay: float = 0.0, failures: Optional[int] = None,
+                 drop_after: Optional[int] = None):
+        """
+        :param failures: answer status to the first failures requests only, every request by default
+        """
+        self.name = name
+        self.status = status
+        self.delay = delay
+        self.failures = failures
+        self.drop_after = drop_after
+        self.requests = 0
+        self._runner = None
+        self.url = None
+
+    async def _rpc(self, request):
+        self.requests += 1
+        body = await request.json()
+        await asyncio.sleep(self.delay)
+        if self.status != 200 and (self.failures is None or self.requests <= self.failures):
+            return web.Response(status=self.status)
+        if body["method"] == "getProgramAccounts":
+            return await self._program_accounts(request, body)
+        return web.json_response({"jsonrpc": "2.0", "id": body["id"], "result": self.name})
+
+    async def _program_accounts(self, request, body):
+        accounts = program_accounts(self.name)
+        document = json.dumps({"jsonrpc": "2.0", "result": accounts, "id": body["id"]}).encode()
+        response = web.StreamResponse()
+        response.content_length = len(document)
+        await response.prepare(request)
+        if self.drop_after is None:
+            await response.write(document)
+            return response
+        sent = json.dumps({"jsonrpc": "2.0", "result": accounts[:self.drop_after]})[:-2].encode() + b","
+        await response.write(sent)
+        await asyncio.sleep(0.05)
+        request.transport.close()
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/", self._rpc)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = "http://127.0.0.1:{}/".format(site._server.sockets[0].getsockname()[1])
+
+    async def close(self):
+        await self._runner.cleanup()
+
+
+def run_with_pool(servers, scenario, **pool_options):
+    """
+    Run a scenario against a SolanaRPCPool of the stub servers, whose first server is the preferred endpoint.
+    """
+    async def with_pool(session, clients):
+        pool = SolanaRPCPool(clients, **pool_options)
+        # The other endpoints are measured and slower: the unmeasured first one ranks first
+        for health in pool.health[1:]:
+            health.latency = 1.0
+        await scenario(pool)
+
+    run_with_clients(servers, with_pool)
+
+
+def run_with_clients(servers, scenario, **limiter_options):
+    """
+    Run a scenario with one SolanaAPICall per stub server.
+    """
+    async def main():
+        for server in servers:
+            await server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                # No retries in the limiters by default: every failure goes straight to the pool
+                limiter_options.setdefault("max_retries", 0)
+                clients = [SolanaAPICall(server.url, session,
+                                         limiter=EndpointLimiter(name=server.name, backoff_base=0.01,
+                                                                 **limiter_options))
+                           for server in servers]
+                await scenario(session, clients)
+        finally:
+            for server in servers:
+                await server.close()
+    asyncio.run(main())
+
+
+def test_failover_on_5xx():
+    servers = [StubRPC("A", status=503), StubRPC("B")]
+
+    async def scenario(pool):
+        assert (await pool.getSlot())["result"] == "B"
+        assert [x.requests for x in servers] == [1, 1]
+        assert pool.health[0].failures == 1 and pool.health[1].failures == 0
+
+    run_with_pool(servers, scenario)
+
+
+def test_breaker_opens_after_failure_threshold():
+    servers = [StubRPC("A", status=500), StubRPC("B")]
+
+    async def scenario(pool):
+        for _ in range(5):
+            assert (await pool.getSlot())["result"] == "B"
+        # Open after 2 failures: A is neither ranked first nor failed over to any more
+        assert servers[0].requests == 2
+        assert not pool.health[0].available()
+        assert rank_endpoints(pool.health) == [1]
+
+    run_with_pool(servers, scenario, failure_threshold=2, cooldown=60)
+
+
+def test_single_half_open_trial_after_cooldown():
+    servers = [StubRPC("A", status=503), StubRPC("B")]
+
+    async def scenario(pool):
+        assert (await pool.getSlot())["result"] == "B"
+        assert not pool.health[0].available()
+        servers[0].status = 200
+        servers[0].delay = 0.1
+        await asyncio.sleep(0.06)
+
+        # Cooldown over: one of the concurrent requests is the trial, the others avoid A while it runs
+        results = await asyncio.gather(*(pool.getSlot() for _ in range(4)))
+        assert sorted(x["result"] for x in results) == ["A", "B", "B", "B"]
+        assert servers[0].requests == 2
+        assert pool.health[0].failures == 0 and pool.health[0].available()
+
+    run_with_pool(servers, scenario, failure_threshold=1, cooldown=0.05)
+
+
+def test_failed_trial_reopens_the_circuit():
+    servers = [StubRPC("A", status=503), StubRPC("B")]
+
+    async def scenario(pool):
+        await pool.getSlot()
+        await asyncio.sleep(0.06)
+        assert pool.health[0].available()
+        assert (await pool.getSlot())["result"] == "B"
+        assert servers[0].requests == 2
+        assert not pool.health[0].available()
+
+    run_with_pool(servers, scenario, failure_threshold=1, cooldown=0.05)
+
+
+def test_hedge_wins_on_slow_primary():
+    servers = [StubRPC("A", delay=0.5), StubRPC("B")]
+
+    async def scenario(pool):
+        start = time.monotonic()
+        assert (await pool.getSlot())["result"] == "B"
+        assert time.monotonic() - start < 0.4
+        assert [x.requests for x in servers] == [1, 1]
+        # The cancelled primary is not counted as a failure
+        assert pool.health[0].failures == 0 and pool.health[1].failures == 0
+
+    run_with_pool(servers, scenario, hedge_after=0.05)
+
+
+def test_no_endpoint_available():
+    servers = [StubRPC("A", status=503), StubRPC("B", status=503)]
+
+    async def scenario(pool):
+        with pytest.raises(aiohttp.ClientResponseError):
+            await pool.getSlot()
+        assert [x.requests for x in servers] == [1, 1]
+        with pytest.raises(ValueError, match="circuit"):
+            await pool.getSlot()
+        assert [x.requests for x in servers] == [1, 1]
+
+    run_with_pool(servers, scenario, failure_threshold=1, cooldown=60)
+
+
+def test_rank_endpoints_skips_open_circuits():
+    health = [EndpointHealth() for _ in range(3)]
+    for latency, x in zip((0.1, 0.2, 0.3), health):
+        x.record_success(latency)
+    for _ in range(3):
+        health[0].record_failure()
+    for _ in range(20):
+        ranking = rank_endpoints(health)
+        assert sorted(ranking) == [1, 2]
+    assert rank_endpoints(health[1:2]) == [0]
+
+
+async def stream(client) -> list:
+    return [x async for x in client.iterProgramAccounts("Program")]
+
+
+def test_stream_retries_before_first_item():
+    servers = [StubRPC("A", status=503, failures=2)]
+
+    async def scenario(session, clients):
+        assert await stream(clients[0]) == program_accounts("A")
+        assert servers[0].requests == 3
+
+    run_with_clients(servers, scenario, max_retries=2)
+
+
+def test_stream_does_not_retry_after_first_item():
+    servers = [StubRPC("A", drop_after=2)]
+
+    async def scenario(session, clients):
+        received = []
+        with pytest.raises(aiohttp.ClientPayloadError):
+            async for account in clients[0].iterProgramAccounts("Program"):
+                received.append(account)
+        # Retrying would yield the first accounts twice
+        assert received == program_accounts("A")[:2]
+        assert servers[0].requests == 1
+
+    run_with_clients(servers, scenario, max_retries=2)
+
+
+def test_stream_fails_over_before_first_item():
+    servers = [StubRPC("A", status=503), StubRPC("B")]
+
+    async def scenario(pool):
+        assert await stream(pool) == program_accounts("B")
+        assert [x.requests for x in servers] == [1, 1]
+        assert pool.health[0].failures == 1 and pool.health[1].failures == 0
+
+    run_with_pool(servers, scenario)
+
+
+def test_stream_does_not_fail_over_after_first_item():
+    servers = [StubRPC("A", drop_after=2), StubRPC("B")]
+
+    async def scenario(pool):
+        received = []
+        with pytest.raises(aiohttp.ClientPayloadError):
+            async for account in pool.iterProgramAccounts("Program"):
+                received.append(account)
+        assert received == program_accounts("A")[:2]
+        assert [x.requests for x in servers] == [1, 0]
+        assert pool.health[0].failures == 1
+
+    run_with_pool(servers, scenario)
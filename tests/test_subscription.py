@@ -0,0 +1,284 @@
+"""
+AccountSubscriber and LiveAPR against a local websocket server speaking the accountSubscribe protocol.
+"""
+
+import asyncio
+import json
+
+import aiohttp
+from aiohttp import web
+
+from LPInfo import AccountSnapshot, RaydiumAPICall
+from rate_limit import EndpointLimiter
+from subscription import AccountSubscriber, LiveAPR
+
+
+ADDRESSES = ["Account1", "Account2", "Account3"]
+
+
+class FakeValidator:
+    """
+    Websocket server confirming accountSubscribe requests and pushing accountNotification messages.
+    """
+    def __init__(self, reject=(), drop_after_subscribe: int = 0):
+        """
+        :param reject: (connection number, address) pairs whose subscription is rejected
+        :param drop_after_subscribe: connections closed right after their subscriptions are confirmed
+        """
+        self.reject = set(reject)
+        self.drop_after_subscribe = drop_after_subscribe
+        self.connections = 0
+        self.subscribe_requests = []
+        self.sockets = []
+        self._runner = None
+        self.url = None
+
+    async def _websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        connection = self.connections
+        self.sockets.append(ws)
+        subscriptions = 0
+        async for message in ws:
+            request = json.loads(message.data)
+            address = request["params"][0]
+            self.subscribe_requests.append((connection, address))
+            if (connection, address) in self.reject:
+                await ws.send_str(json.dumps({"jsonrpc": "2.0", "id": request["id"],
+                                              "error": {"code": -32602, "message": "Invalid param"}}))
+                continue
+            await ws.send_str(json.dumps({"jsonrpc": "2.0", "id": request["id"],
+                                          "result": ADDRESSES.index(address) + 100}))
+            subscriptions += 1
+            if subscriptions == len(ADDRESSES) and connection <= self.drop_after_subscribe:
+                await ws.close()
+        return ws
+
+    async def notify(self, address: str, data: str, slot: int):
+        await self.sockets[-1].send_str(json.dumps({
+            "jsonrpc": "2.0",
+            "method": "accountNotification",
+            "params": {"subscription": ADDRESSES.index(address) + 100,
+                       "result": {"context": {"slot": slot}, "value": {"data": [data, "base64"]}}}
+        }))
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self._websocket)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = "http://127.0.0.1:{}/".format(site._server.sockets[0].getsockname()[1])
+
+    async def close(self):
+        for ws in self.sockets:
+            await ws.close()
+        await self._runner.cleanup()
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def run_with_subscriber(validator: FakeValidator, scenario, **kwargs):
+    async def main():
+        await validator.start()
+        async with aiohttp.ClientSession() as session:
+            subscribed = []
+            changes = []
+            subscriber = AccountSubscriber(validator.url, session, reconnect_base=0.01, reconnect_max=0.05,
+                                           on_subscribed=lambda: subscribed.append(validator.connections),
+                                           on_change=lambda *x: changes.append(x), **kwargs)
+            task = asyncio.ensure_future(subscriber.run(ADDRESSES))
+            try:
+                await scenario(subscriber, subscribed, changes)
+            finally:
+                task.cancel()
+                await validator.close()
+    asyncio.run(main())
+
+
+def test_subscribe_and_notify():
+    validator = FakeValidator()
+
+    async def scenario(subscriber, subscribed, changes):
+        await wait_for(lambda: subscribed)
+        await validator.notify("Account2", "AAAA", 7)
+        await wait_for(lambda: changes)
+        assert changes == [("Account2", "AAAA", 7)]
+        assert subscriber.accounts["Account2"] == "AAAA" and subscriber.accounts.slots["Account2"] == 7
+        assert subscriber.notifications == 1
+        assert sorted(x[1] for x in validator.subscribe_requests) == sorted(ADDRESSES)
+
+    run_with_subscriber(validator, scenario)
+
+
+def test_reconnect_resubscribes():
+    validator = FakeValidator(drop_after_subscribe=1)
+
+    async def scenario(subscriber, subscribed, changes):
+        await wait_for(lambda: validator.connections == 2 and len(subscribed) == 2)
+        assert subscriber.reconnects >= 1
+        assert sorted(x[1] for x in validator.subscribe_requests if x[0] == 2) == sorted(ADDRESSES)
+        await validator.notify("Account1", "BBBB", 9)
+        await wait_for(lambda: changes)
+        assert subscriber.accounts["Account1"] == "BBBB"
+
+    run_with_subscriber(validator, scenario)
+
+
+def test_rejected_subscription_reconnects():
+    validator = FakeValidator(reject=[(1, "Account3")])
+
+    async def scenario(subscriber, subscribed, changes):
+        # The rejection does not stop the subscriber: it reconnects and subscribes to everything again
+        await wait_for(lambda: subscribed)
+        assert subscribed == [2]
+        assert subscriber.reconnects == 1
+        await validator.notify("Account3", "CCCC", 11)
+        await wait_for(lambda: changes)
+
+    run_with_subscriber(validator, scenario)
+
+
+class FakeSolana:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    async def getMultipleAccountsChunked(self, publicKeys):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ValueError("getMultipleAccounts failed: node is behind")
+        accounts = AccountSnapshot()
+        for publicKey in publicKeys:
+            accounts.set(publicKey, "DDDD", 5)
+        return accounts
+
+
+class FakeRaydium:
+    async def get_price(self):
+        return {}
+
+
+class FakePoolInfo:
+    """
+    The parts of RaydiumPoolInfo LiveAPR uses, with one farm reading every account.
+    """
+    def __init__(self, failures: int = 0, raydium=None):
+        self.farms_info = {"FARM": {}}
+        self.LP_addresses = {"FARM": {"coin": "RAY", "pc": "USDC"}}
+        self.SOLANA = FakeSolana(failures)
+        self.RAYDIUM = raydium or FakeRaydium()
+
+    def cycle_addresses(self, farms):
+        return list(ADDRESSES)
+
+    def compute_farms(self, farms, accounts, price):
+        return [{farm: {"slot": max(accounts.slots.values()), "price": price.get("RAY")}} for farm in farms]
+
+
+class FakeRaydiumAPI:
+    """
+    HTTP server of the Raydium price endpoint, answering 404 to its first failures requests.
+    """
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.requests = 0
+        self._runner = None
+        self.url = None
+
+    async def _price(self, request):
+        self.requests += 1
+        if self.requests <= self.failures:
+            raise web.HTTPNotFound()
+        return web.json_response({"RAY": 1.5, "USDC": 1.0})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/coin/price", self._price)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = "http://127.0.0.1:{}/coin/price".format(site._server.sockets[0].getsockname()[1])
+
+    async def close(self):
+        await self._runner.cleanup()
+
+
+def run_live_apr(scenario, pool_info=None, api: FakeRaydiumAPI = None, **kwargs):
+    """
+    Run a scenario against a LiveAPR of pool_info, or of a FakePoolInfo reading its prices from api.
+    """
+    async def main():
+        validator = FakeValidator()
+        await validator.start()
+        if api is not None:
+            await api.start()
+        updates = []
+        async with aiohttp.ClientSession() as session:
+            info = pool_info or FakePoolInfo(raydium=RaydiumAPICall(api.url, api.url, session, ttl=0,
+                                                                    limiter=EndpointLimiter(name="raydium")))
+            kwargs.setdefault("on_update", lambda farm, farm_info: updates.append((farm, farm_info)))
+            live = LiveAPR(info, session, endpoint=validator.url, debounce=0.01, **kwargs)
+            live.subscriber.reconnect_base = 0.01
+            live.subscriber.reconnect_max = 0.05
+            task = asyncio.ensure_future(live.run())
+            try:
+                await scenario(live, updates, task)
+            finally:
+                task.cancel()
+                await validator.close()
+                if api is not None:
+                    await api.close()
+    asyncio.run(main())
+
+
+def test_live_apr_retries_failed_seed():
+    pool_info = FakePoolInfo(failures=2)
+
+    async def scenario(live, updates, task):
+        await wait_for(lambda: updates)
+        assert pool_info.SOLANA.calls == 3 and live.seeds == 1
+        assert live.results["FARM"] == {"slot": 5, "price": None}
+        assert not task.done()
+
+    run_live_apr(scenario, pool_info, price_interval=3600)
+
+
+def test_live_apr_retries_failed_price_refresh():
+    api = FakeRaydiumAPI(failures=1)
+
+    async def scenario(live, updates, task):
+        # The 404 is not retried by the limiter: LiveAPR retries the refresh itself
+        await wait_for(lambda: updates)
+        assert api.requests == 2
+        assert live.price == {"RAY": 1.5, "USDC": 1.0}
+        assert updates == [("FARM", {"slot": 5, "price": 1.5})]
+        assert not task.done()
+
+    run_live_apr(scenario, api=api, price_interval=3600)
+
+
+def test_live_apr_retries_failed_update():
+    pool_info = FakePoolInfo()
+    published = []
+
+    async def publish(farm, info):
+        published.append(farm)
+        if len(published) == 1:
+            raise KeyError(farm)
+
+    async def scenario(live, updates, task):
+        await wait_for(lambda: len(published) == 2)
+        assert live.recomputes == 2
+        assert not task.done()
+
+    run_live_apr(scenario, pool_info, price_interval=3600, on_update=publish)
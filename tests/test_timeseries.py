@@ -0,0 +1,142 @@
+"""
+TimeSeriesStore writes, compaction and range queries.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import timeseries
+from timeseries import TimeSeriesStore
+
+
+def result(farm: str, apr: float, liquidity: float = 1000.0, slot: int = 100) -> dict:
+    return {farm: {"coin": "RAY", "RAY_APR": apr, "liquidity": liquidity, "slot_range": (slot, slot + 2),
+                   "dual": True}}
+
+
+def fill(store: TimeSeriesStore, timestamps, farms=("A", "B")):
+    for t in timestamps:
+        store.append(t, [result(farm, apr=t + i) for i, farm in enumerate(farms)])
+
+
+def test_append_and_flush(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    fill(store, [1.0, 2.0])
+    # Buffered rows are not visible yet
+    assert len(store.query(["RAY_APR"])["timestamp"]) == 0 and store.chunks == []
+
+    store.flush()
+    assert len(store.chunks) == 1 and store.chunks[0]["rows"] == 4
+    rows = store.query(["RAY_APR", "liquidity", "slot_min", "slot_max"])
+    assert rows["timestamp"].tolist() == [1.0, 1.0, 2.0, 2.0]
+    assert [store.farms[x] for x in rows["farm"]] == ["A", "B", "A", "B"]
+    assert rows["RAY_APR"].tolist() == [1.0, 2.0, 2.0, 3.0]
+    assert rows["slot_min"].tolist() == [100] * 4 and rows["slot_max"].tolist() == [102] * 4
+    # Only numeric fields are stored
+    assert "coin" not in store.columns() and "dual" not in store.columns()
+
+    store.flush()
+    assert len(store.chunks) == 1
+
+
+def test_reopen(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    fill(store, [1.0, 2.0])
+    store.close()
+    store = TimeSeriesStore(str(tmp_path))
+    assert store.farms == ["A", "B"]
+    assert store.query(["RAY_APR"])["RAY_APR"].tolist() == [1.0, 2.0, 2.0, 3.0]
+    with pytest.raises(ValueError):
+        store.append(1.5, [result("A", 0.0)])
+    fill(store, [3.0], farms=("C",))
+    store.flush()
+    assert store.farms == ["A", "B", "C"]
+
+
+def test_decreasing_timestamps(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    store.append(2.0, [result("A", 1.0)])
+    with pytest.raises(ValueError):
+        store.append(1.0, [result("A", 1.0)])
+
+
+def test_batch_rows(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), batch_rows=4)
+    fill(store, [1.0])
+    assert store.chunks == []
+    fill(store, [2.0])
+    assert len(store.chunks) == 1 and len(store.query([])["timestamp"]) == 4
+
+
+def test_flush_interval(tmp_path, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(timeseries.time, "monotonic", lambda: now[0])
+    store = TimeSeriesStore(str(tmp_path), flush_interval=60)
+    store.append(1.0, [result("A", 1.0)])
+    now[0] += 59
+    store.append(2.0, [result("A", 2.0)])
+    assert store.chunks == []
+    now[0] += 1
+    store.append(3.0, [result("A", 3.0)])
+    assert len(store.chunks) == 1 and store.chunks[0]["rows"] == 3
+    # The interval starts again with the next buffered row
+    now[0] += 30
+    store.append(4.0, [result("A", 4.0)])
+    now[0] += 59
+    store.append(5.0, [result("A", 5.0)])
+    assert len(store.chunks) == 1
+    now[0] += 1
+    store.append(6.0, [result("A", 6.0)])
+    assert [x["rows"] for x in store.chunks] == [3, 3]
+
+
+def test_compaction(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), fanout=3)
+    for t in range(8):
+        fill(store, [float(t)])
+        store.flush()
+    # 8 flushes: two level 1 chunks of 3 level 0 chunks, and 2 level 0 chunks
+    assert [x["level"] for x in store.chunks] == [1, 1, 0, 0]
+    assert [x["rows"] for x in store.chunks] == [6, 6, 2, 2]
+    fill(store, [8.0])
+    store.flush()
+    # The third level 1 chunk completes a level 2 chunk
+    assert [x["level"] for x in store.chunks] == [2]
+    assert sorted(os.listdir(str(tmp_path))) == sorted([store.chunks[0]["name"], "manifest.json"])
+    assert store.query([])["timestamp"].tolist() == [float(t) for t in range(9) for _ in range(2)]
+
+
+def test_compact(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    fill(store, [1.0])
+    store.flush()
+    store.append(2.0, [{"A": {"FIDA_APR": 5.0}}])
+    store.compact()
+    assert len(store.chunks) == 1 and store.chunks[0]["rows"] == 3
+    rows = store.query(["RAY_APR", "FIDA_APR"])
+    # Columns missing from a chunk read as NaN
+    assert rows["RAY_APR"][:2].tolist() == [1.0, 2.0] and np.isnan(rows["RAY_APR"][2])
+    assert np.isnan(rows["FIDA_APR"][:2]).all() and rows["FIDA_APR"][2] == 5.0
+
+
+def test_query_time_and_farm_ranges(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    for t in range(10):
+        fill(store, [float(t)], farms=("A", "B", "C"))
+        if t % 3 == 2:
+            store.flush()
+    store.flush()
+
+    rows = store.query(["RAY_APR"], start=2.0, end=5.0)
+    assert rows["timestamp"].tolist() == [2.0] * 3 + [3.0] * 3 + [4.0] * 3
+    rows = store.query(["RAY_APR"], start=3.5, farms=["B", "C", "unknown"])
+    assert rows["timestamp"].tolist() == [4.0, 4.0, 5.0, 5.0, 6.0, 6.0, 7.0, 7.0, 8.0, 8.0, 9.0, 9.0]
+    assert [store.farms[x] for x in rows["farm"][:2]] == ["B", "C"]
+    assert rows["RAY_APR"][:2].tolist() == [5.0, 6.0]
+    assert len(store.query(["RAY_APR"], start=20.0)["timestamp"]) == 0
+    assert len(store.query(["RAY_APR"], farms=["unknown"])["timestamp"]) == 0
+
+    chunks = list(store.iter_chunks(["timestamp"], start=2.0, end=4.0))
+    assert [x["timestamp"].tolist() for x in chunks] == [[2.0] * 3, [3.0] * 3]
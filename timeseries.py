@@ -0,0 +1,270 @@
+"""
+Append-only columnar time-series store of scraped farm results.
+
+Every row is one farm at one point in time: timestamp, slot range, farm and every numeric field of the farm info
+(prices, amounts, liquidity, reward APRs, Fee_APR, ...). Rows are written in batches as chunks. A chunk is a
+directory holding one .npy file per column, and the chunks are listed in order in a JSON manifest. The manifest is
+replaced atomically, so an interrupted write never leaves a partial chunk visible. Small chunks are merged into
+larger ones as they accumulate (fanout chunks of one level form one chunk of the next level).
+
+Queries memory-map the column files and locate the time range by binary search on the timestamp column. A range
+query reads only the columns and chunks it needs, and parses no row-oriented data.
+"""
+
+import json
+import os
+import shutil
+import time
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+# Key columns present in every chunk, and their types. Field columns are float64.
+KEY_COLUMNS = {
+    "timestamp": np.float64,
+    "slot_min": np.int64,
+    "slot_max": np.int64,
+    "farm": np.int32
+}
+
+
+class TimeSeriesStore:
+    """
+    Columnar store of farm results, with a single writer.
+
+    Rows are buffered by append() and written as one chunk by flush(), or automatically once batch_rows rows are
+    buffered or, with flush_interval set, by the first append flush_interval seconds after the oldest buffered row.
+    Timestamps must not decrease between appends.
+    """
+    def __init__(self, path: str, batch_rows: int = 4096, fanout: int = 16, flush_interval: Optional[float] = None):
+        """
+        :param path: store directory, created if needed
+        :param batch_rows: rows buffered before a chunk is written
+        :param fanout: number of chunks of one level merged into a chunk of the next level
+        :param flush_interval: longest time in seconds rows are buffered for, as long as rows keep being appended.
+            Unbounded by default.
+        """
+        if fanout < 2:
+            raise ValueError("fanout must be at least 2.")
+        self.path = path
+        self.batch_rows = batch_rows
+        self.fanout = fanout
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._buffered_at = None
+        os.makedirs(path, exist_ok=True)
+        self._manifest = self._read_manifest()
+        self._farm_codes = {x: i for i, x in enumerate(self._manifest["farms"])}
+
+    # Manifest
+
+    def _read_manifest(self) -> dict:
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return {"version": MANIFEST_VERSION, "next_chunk": 0, "farms": [], "chunks": []}
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError("Unsupported time-series store version {}.".format(manifest.get("version")))
+        return manifest
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, manifest_path)
+
+    @property
+    def farms(self) -> List[str]:
+        return list(self._manifest["farms"])
+
+    @property
+    def chunks(self) -> List[dict]:
+        return list(self._manifest["chunks"])
+
+    def columns(self) -> List[str]:
+        """
+        Names of every column of the store.
+        """
+        names = list(KEY_COLUMNS)
+        for chunk in self._manifest["chunks"]:
+            names += [x for x in chunk["columns"] if x not in names]
+        return names
+
+    # Writing
+
+    def append(self, timestamp: float, results: List[dict]):
+        """
+        Buffer the results of a cycle.
+        :param timestamp: UNIX time of the cycle
+        :param results: list of {farm: farm info} dicts (e.g. get_all_APR results with Fee_APR merged). Numeric
+            fields are stored; the slot_range of each farm info, if any, fills slot_min / slot_max.
+        :return:
+        """
+        if self._rows and timestamp < self._rows[-1][0]:
+            raise ValueError("Timestamps must not decrease.")
+        chunks = self._manifest["chunks"]
+        if not self._rows and chunks and timestamp < chunks[-1]["t_max"]:
+            raise ValueError("Timestamps must not decrease.")
+
+        if not self._rows:
+            self._buffered_at = time.monotonic()
+        for result in results:
+            for farm, farm_info in result.items():
+                if farm not in self._farm_codes:
+                    self._farm_codes[farm] = len(self._manifest["farms"])
+                    self._manifest["farms"].append(farm)
+                slot_range = farm_info.get("slot_range") or (-1, -1)
+                values = {key: float(value) for key, value in farm_info.items()
+                          if isinstance(value, (int, float, np.number)) and not isinstance(value, bool)}
+                self._rows.append((timestamp, slot_range[0], slot_range[1], self._farm_codes[farm], values))
+
+        if len(self._rows) >= self.batch_rows or (
+                self.flush_interval is not None and time.monotonic() - self._buffered_at >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows as a new chunk and compact.
+        :return:
+        """
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+
+        names = []
+        for row in rows:
+            names += [x for x in row[4] if x not in names]
+        columns = {name: np.array([x[i] for x in rows], dtype=dtype)
+                   for i, (name, dtype) in enumerate(KEY_COLUMNS.items())}
+        for name in names:
+            columns[name] = np.array([x[4].get(name, np.nan) for x in rows], dtype=np.float64)
+
+        self._manifest["chunks"].append(self._write_chunk(columns, level=0))
+        self._compact()
+        self._write_manifest()
+
+    def _write_chunk(self, columns: Dict[str, np.ndarray], level: int) -> dict:
+        name = "chunk-{:08d}".format(self._manifest["next_chunk"])
+        self._manifest["next_chunk"] += 1
+        chunk_path = os.path.join(self.path, name)
+        if os.path.exists(chunk_path):
+            # Left over by a write interrupted before the manifest listed it
+            shutil.rmtree(chunk_path)
+        os.makedirs(chunk_path)
+        for column, values in columns.items():
+            with open(os.path.join(chunk_path, column + ".npy"), "wb") as f:
+                np.save(f, values)
+                f.flush()
+                os.fsync(f.fileno())
+        return {
+            "name": name,
+            "level": level,
+            "rows": len(columns["timestamp"]),
+            "t_min": float(columns["timestamp"][0]),
+            "t_max": float(columns["timestamp"][-1]),
+            "columns": [x for x in columns if x not in KEY_COLUMNS]
+        }
+
+    def _compact(self):
+        """
+        Merge the trailing chunks of one level into a chunk of the next level, for as long as fanout of them exist.
+        Chunks are merged only with their neighbours, so the chunks stay in time order.
+        """
+        chunks = self._manifest["chunks"]
+        obsolete = []
+        while len(chunks) >= self.fanout:
+            tail = chunks[-self.fanout:]
+            if any(x["level"] != tail[0]["level"] for x in tail):
+                break
+            merged = self._write_chunk(self._concat(tail, self.columns()), tail[0]["level"] + 1)
+            del chunks[-self.fanout:]
+            chunks.append(merged)
+            obsolete += tail
+        if obsolete:
+            # Old chunks are removed once the manifest no longer lists them
+            self._write_manifest()
+            for chunk in obsolete:
+                shutil.rmtree(os.path.join(self.path, chunk["name"]), ignore_errors=True)
+
+    def compact(self):
+        """
+        Merge every chunk into a single one, e.g. before archiving the store.
+        :return:
+        """
+        self.flush()
+        chunks = self._manifest["chunks"]
+        if len(chunks) < 2:
+            return
+        merged = self._write_chunk(self._concat(chunks, self.columns()), max(x["level"] for x in chunks) + 1)
+        obsolete = list(chunks)
+        self._manifest["chunks"] = [merged]
+        self._write_manifest()
+        for chunk in obsolete:
+            shutil.rmtree(os.path.join(self.path, chunk["name"]), ignore_errors=True)
+
+    def _concat(self, chunks: List[dict], names: List[str]) -> Dict[str, np.ndarray]:
+        names = [x for x in names if x in KEY_COLUMNS or any(x in chunk["columns"] for chunk in chunks)]
+        return {name: np.concatenate([self._column(chunk, name) for chunk in chunks]) for name in names}
+
+    # Reading
+
+    def _column(self, chunk: dict, name: str) -> np.ndarray:
+        """
+        Memory-mapped column of a chunk. Columns missing from the chunk read as NaN.
+        """
+        if name in KEY_COLUMNS or name in chunk["columns"]:
+            return np.load(os.path.join(self.path, chunk["name"], name + ".npy"), mmap_mode="r")
+        return np.full(chunk["rows"], np.nan)
+
+    def iter_chunks(self, columns: List[str], start: Optional[float] = None,
+                    end: Optional[float] = None) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Zero-copy range query: yield, chunk by chunk, memory-mapped slices of the columns over [start, end).
+        :param columns: column names, key columns included
+        :param start: first timestamp, inclusive
+        :param end: last timestamp, exclusive
+        :return: iterator of dicts of column name -> array
+        """
+        for chunk in self._manifest["chunks"]:
+            if (start is not None and chunk["t_max"] < start) or (end is not None and chunk["t_min"] >= end):
+                continue
+            timestamp = self._column(chunk, "timestamp")
+            lo = 0 if start is None else int(np.searchsorted(timestamp, start, side="left"))
+            hi = chunk["rows"] if end is None else int(np.searchsorted(timestamp, end, side="left"))
+            if lo < hi:
+                yield {name: self._column(chunk, name)[lo:hi] for name in columns}
+
+    def query(self, columns: List[str], start: Optional[float] = None, end: Optional[float] = None,
+              farms: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Range query, e.g. query(["RAY_APR"], start=time.time() - 30 * 86400, farms=["RAY-USDC"]).
+        Rows buffered by append() but not flushed yet are not included.
+        :param columns: column names; timestamp and farm are always returned
+        :param start: first timestamp, inclusive
+        :param end: last timestamp, exclusive
+        :param farms: farm names, all farms by default
+        :return: dict of column name -> array, farm holding farm codes (see farms)
+        """
+        names = list(dict.fromkeys(["timestamp", "farm"] + list(columns)))
+        codes = None
+        if farms is not None:
+            codes = np.array([self._farm_codes[x] for x in farms if x in self._farm_codes], dtype=np.int32)
+
+        parts = {name: [] for name in names}
+        for chunk_columns in self.iter_chunks(names, start, end):
+            mask = None if codes is None else np.isin(chunk_columns["farm"], codes)
+            for name in names:
+                parts[name].append(chunk_columns[name] if mask is None else chunk_columns[name][mask])
+
+        return {name: np.concatenate(parts[name]) if parts[name] else np.empty(0, KEY_COLUMNS.get(name, np.float64))
+                for name in names}
+
+    def close(self):
+        self.flush()
@@ -7,4 +7,13 @@ class MemcmpOpts(NamedTuple):
     offset: int
     """Offset into program account data to start comparison: <usize>."""
     bytes: str
-    """Data to match, as base-58 encoded string: <string>."""
\ No newline at end of file
+    """Data to match, as base-58 encoded string: <string>."""
+
+
+class DataSliceOpts(NamedTuple):
+    """Option to limit the returned account data to a byte range."""
+
+    offset: int
+    """Offset into account data to start the slice: <usize>."""
+    length: int
+    """Number of bytes to return: <usize>."""